@@ -0,0 +1,113 @@
+"""
+Helpers for the benchmarks in the test suite.
+
+Benchmarks report the best per-call time over several repeats, which is the least
+noisy figure on shared CI machines. The reported results are collected, so that they
+can be written as JSON and compared across versions:
+
+.. code-block:: bash
+
+    pytest tests/test_benchmarks.py --benchmark-json=before.json
+    # ... change the code ...
+    pytest tests/test_benchmarks.py --benchmark-json=after.json \\
+        --benchmark-baseline=before.json --benchmark-threshold=0.2
+
+    # or compare two files
+    python -m tests.benchmark before.json after.json --threshold 0.2
+"""
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+from typing import Callable
+
+import timings
+
+# title -> label -> ns per call, of the benchmarks reported in this session
+RESULTS: dict[str, dict[str, float]] = {}
+
+
+def measure(func: Callable, *args, number: int = 1000, repeat: int = 5) -> float:
+    """Returns the best per-call time of ``func(*args)`` in nanoseconds."""
+    timer = timeit.Timer(lambda: func(*args))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def report(title: str, results: dict[str, float], baseline: str | None = None) -> None:
+    """
+    Prints benchmark results (visible with ``pytest -s``) and collects them.
+
+    With a ``baseline`` label, the others are also printed as the latency they add
+    to it and the share of throughput they cost.
+    """
+    RESULTS.setdefault(title, {}).update(results)
+    print(f"\n{title}")
+    for label, ns in results.items():
+        line = f"  {label:<40} {ns:>12,.0f} ns/call"
+        if baseline is not None and label != baseline:
+            base = results[baseline]
+            line += f"  {ns - base:>+12,.0f} ns  {1 - base / ns:>6.1%} throughput loss"
+        print(line)
+
+
+def to_json(results: dict[str, dict[str, float]]) -> dict:
+    return {
+        "version": timings.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def write_json(path: str, results: dict[str, dict[str, float]]) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(to_json(results), file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def read_json(path: str) -> dict[str, dict[str, float]]:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)["results"]
+
+
+def regressions(
+    baseline: dict[str, dict[str, float]],
+    results: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    """
+    Describes the results more than ``threshold`` (e.g. 0.2 for 20%) slower than the
+    baseline. Benchmarks missing from either side are not compared.
+    """
+    found = []
+    for title, labels in results.items():
+        for label, ns in labels.items():
+            base = baseline.get(title, {}).get(label)
+            if base and ns > base * (1 + threshold):
+                found.append(
+                    f"{title} / {label}: {base:,.0f} -> {ns:,.0f} ns/call "
+                    f"({ns / base - 1:+.0%})"
+                )
+    return found
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compares two benchmark results.")
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    found = regressions(
+        read_json(args.baseline), read_json(args.results), args.threshold
+    )
+    for regression in found:
+        print(regression)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
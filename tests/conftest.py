@@ -0,0 +1,56 @@
+import pytest
+
+from tests import benchmark
+from timings.models import ServerTimings
+
+
+@pytest.fixture
+def timings():
+    ServerTimings.setUp("sync")
+    yield ServerTimings()
+    ServerTimings.tearDown()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark-json",
+        metavar="PATH",
+        help="Write the results of the benchmarks that ran as JSON to PATH.",
+    )
+    group.addoption(
+        "--benchmark-baseline",
+        metavar="PATH",
+        help="Fail if benchmarks are slower than in the JSON results at PATH.",
+    )
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=0.2,
+        help="The slowdown against the baseline that fails (default: 0.2 for 20%%).",
+    )
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    path = config.getoption("--benchmark-json")
+    if path:
+        benchmark.write_json(path, benchmark.RESULTS)
+
+    baseline = config.getoption("--benchmark-baseline")
+    if baseline:
+        config.benchmark_regressions = benchmark.regressions(
+            benchmark.read_json(baseline),
+            benchmark.RESULTS,
+            config.getoption("--benchmark-threshold"),
+        )
+        if config.benchmark_regressions and session.exitstatus == 0:
+            session.exitstatus = 1
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    found = getattr(config, "benchmark_regressions", None)
+    if found:
+        terminalreporter.section("benchmark regressions")
+        for regression in found:
+            terminalreporter.line(regression)
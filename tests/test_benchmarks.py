@@ -0,0 +1,360 @@
+"""
+Benchmarks of the per-call overhead of recording metrics and of the per-request
+overhead of the integrations.
+
+Run with ``pytest -s tests/test_benchmarks.py`` to see the figures, see
+:mod:`tests.benchmark` for writing and comparing JSON results.
+"""
+
+import asyncio
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from tests.benchmark import measure, report
+from timings import timed, timed_metric
+from timings.exporters import CallableSink, Exporter
+from timings.header import HEADER_MODES, render_header
+from timings.instruments import describe_query
+from timings.models import ServerTimingMetric, ServerTimings
+from timings.storage import Storage
+
+QUERY = (
+    'SELECT "procedure"."id", "procedure"."name" FROM "procedure" '
+    'INNER JOIN "phase" ON ("procedure"."phase_id" = "phase"."id") '
+    'WHERE "phase"."name" = %s ORDER BY "procedure"."name" ASC LIMIT 21'
+)
+
+
+pytestmark = pytest.mark.usefixtures("timings")
+
+
+def noop():
+    pass
+
+
+def legacy_timed(name=None, description=None):
+    # The previous generator-based implementation of timed
+    @contextmanager
+    def measure_metric(metric):
+        metric.start()
+        yield
+        metric.end()
+
+    @contextmanager
+    def legacy_timed_metric(name, description=None):
+        metric = ServerTimingMetric(name=name, description=description)
+        with measure_metric(metric):
+            yield metric
+
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            metric_name = name if name is not None else func.__name__
+            with legacy_timed_metric(name=metric_name, description=description):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TestOverhead:
+    def test_timed(self, timings, pytestconfig):
+        def clear_after(func):
+            # Keep the buffer small, so that appends do not dominate
+            def call():
+                func()
+                if len(timings._metrics) > 500:
+                    timings.discard_all()
+
+            return call
+
+        legacy = clear_after(legacy_timed("hot helper")(noop))
+        results = {
+            "baseline (no metric)": measure(clear_after(noop), number=5000),
+            "legacy timed": measure(legacy, number=5000),
+            "timed": measure(clear_after(timed("hot helper")(noop)), number=5000),
+        }
+        report("timed overhead", results)
+
+        # Wall-clock comparisons are only checked along with a baseline, on a
+        # machine quiet enough for one
+        if pytestconfig.getoption("--benchmark-baseline"):
+            assert results["timed"] < results["legacy timed"]
+
+    def test_metrics(self, timings):
+        def with_duration():
+            ServerTimingMetric("cache", duration=1.0)
+            timings.discard_all()
+
+        def context_manager():
+            with timed_metric("block"):
+                pass
+            timings.discard_all()
+
+        report(
+            "metric overhead",
+            {
+                "ServerTimingMetric(duration=...)": measure(with_duration, number=5000),
+                "with timed_metric(...)": measure(context_manager, number=5000),
+            },
+        )
+
+
+class TestLookup:
+    def test_lookup(self, timings):
+        def threaded(threads=4):
+            results = []
+
+            def run():
+                ServerTimings.setUp("sync")
+                results.append(measure(ServerTimings, number=10000))
+                ServerTimings.tearDown()
+
+            workers = [threading.Thread(target=run) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            return max(results)
+
+        async def in_tasks(tasks=4):
+            async def run():
+                ServerTimings.setUp("async")
+                try:
+                    return measure(ServerTimings, number=10000)
+                finally:
+                    ServerTimings.tearDown()
+
+            return max(await asyncio.gather(*(run() for _ in range(tasks))))
+
+        results = {
+            "Storage.get() (request)": measure(Storage.get, number=10000),
+            "ServerTimings() (request)": measure(ServerTimings, number=10000),
+            "ServerTimings() (4 threads)": threaded(),
+            "ServerTimings() (4 tasks)": asyncio.run(in_tasks()),
+        }
+        ServerTimings.tearDown()
+        results["ServerTimings() (no request)"] = measure(ServerTimings, number=10000)
+        report("ServerTimings lookup", results)
+
+
+class TestHeader:
+    def test_render_header(self, timings):
+        for i in range(20):
+            ServerTimingMetric(f"db_{i}", description=QUERY[:40], duration=float(i))
+        metrics = timings.metrics
+
+        results = {
+            f"render_header ({mode}, 20 metrics)": measure(
+                render_header, metrics, None, mode, number=2000
+            )
+            for mode in HEADER_MODES
+        }
+        results["render_header (flat, 512 bytes)"] = measure(
+            render_header, metrics, 512, number=2000
+        )
+        report("header rendering", results)
+
+
+class TestQueries:
+    def test_execution_info(self):
+        from timings.django.instruments import DBQueryInstrument
+
+        instrument = DBQueryInstrument(None)
+        report(
+            "query descriptions",
+            {
+                "describe_query": measure(describe_query, QUERY, number=5000),
+                "DBQueryInstrument.execution_info": measure(
+                    instrument.execution_info, QUERY, number=5000
+                ),
+            },
+        )
+
+
+def discarding_exporter():
+    # Measures the request path only, not writing the records
+    return Exporter([CallableSink(lambda batch: None)])
+
+
+def call_wsgi(app, environ):
+    body = app(dict(environ), lambda status, headers, exc_info=None: None)
+    for _ in body:
+        pass
+    if hasattr(body, "close"):
+        body.close()
+
+
+async def call_asgi(app, path):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"test")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+class TestDjango:
+    @pytest.mark.parametrize("queries", [0, 10])
+    def test_middleware(self, queries):
+        pytest.importorskip("django")
+        from django.conf import settings
+
+        if not settings.configured:
+            settings.configure(
+                SECRET_KEY="benchmark",
+                DATABASES={
+                    "default": {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": ":memory:",
+                    }
+                },
+            )
+        import django
+        from django.db import connection
+        from django.http import HttpResponse
+        from django.test import RequestFactory, override_settings
+
+        from timings.django.middleware import ServerTimingMiddleware
+
+        django.setup()
+
+        def view(request):
+            with connection.cursor() as cursor:
+                for i in range(queries):
+                    cursor.execute("SELECT %s", [i])
+            return HttpResponse("{}", content_type="application/json")
+
+        request = RequestFactory().get("/procedures/1/")
+        with override_settings(SERVER_TIMINGS_EXPORTER=discarding_exporter()):
+            middleware = ServerTimingMiddleware(view)
+            results = {
+                "view": measure(view, request, number=200),
+                "ServerTimingMiddleware": measure(middleware, request, number=200),
+            }
+        report(f"Django request ({queries} queries)", results, baseline="view")
+
+
+class TestFlask:
+    def test_extension(self):
+        pytest.importorskip("flask")
+        from flask import Flask
+        from werkzeug.test import EnvironBuilder
+
+        from timings.flask.extension import ServerTimingsExtension
+
+        def create_app(**config):
+            app = Flask(__name__)
+            app.config.update(config)
+
+            @app.route("/items/<int:pk>")
+            def item(pk):
+                ServerTimingMetric("db", duration=1.0)
+                return {}
+
+            return app
+
+        plain = create_app()
+        extension = create_app(SERVER_TIMINGS_EXPORTER=discarding_exporter())
+        ServerTimingsExtension(extension)
+        middleware = create_app(
+            SERVER_TIMINGS_EXPORTER=discarding_exporter(),
+            SERVER_TIMINGS_WSGI_MIDDLEWARE=True,
+        )
+        ServerTimingsExtension(middleware)
+
+        environ = EnvironBuilder(path="/items/1").get_environ()
+        report(
+            "Flask request",
+            {
+                "app": measure(call_wsgi, plain, environ, number=200),
+                "ServerTimingsExtension": measure(
+                    call_wsgi, extension, environ, number=200
+                ),
+                "ServerTimingsExtension (WSGI middleware)": measure(
+                    call_wsgi, middleware, environ, number=200
+                ),
+            },
+            baseline="app",
+        )
+
+
+class TestFastAPI:
+    @pytest.mark.parametrize("endpoint", ["async", "sync"])
+    def test_middleware(self, endpoint):
+        pytest.importorskip("fastapi")
+        from fastapi import FastAPI
+
+        from timings.fastapi.middleware import FastAPIServerTimingMiddleware
+
+        def create_app():
+            app = FastAPI()
+            if endpoint == "async":
+
+                @app.get("/items/{pk}")
+                async def item(pk: int):
+                    ServerTimingMetric("db", duration=1.0)
+                    return {}
+
+            else:
+
+                @app.get("/items/{pk}")
+                def item(pk: int):
+                    ServerTimingMetric("db", duration=1.0)
+                    return {}
+
+            return app
+
+        plain = create_app()
+        instrumented = create_app()
+        instrumented.add_middleware(
+            FastAPIServerTimingMiddleware, exporter=discarding_exporter()
+        )
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = {
+                "app": measure(
+                    lambda: loop.run_until_complete(call_asgi(plain, "/items/1")),
+                    number=200,
+                ),
+                "FastAPIServerTimingMiddleware": measure(
+                    lambda: loop.run_until_complete(
+                        call_asgi(instrumented, "/items/1")
+                    ),
+                    number=200,
+                ),
+            }
+        finally:
+            loop.close()
+        report(f"FastAPI request ({endpoint} endpoint)", results, baseline="app")
+
+
+class TestRegressions:
+    def test_regressions(self):
+        from tests.benchmark import regressions
+
+        baseline = {"timed": {"timed": 1000.0, "legacy": 1000.0}, "gone": {"a": 1.0}}
+        results = {"timed": {"timed": 1300.0, "legacy": 1100.0, "new": 1.0}}
+
+        assert regressions(baseline, results, threshold=0.2) == [
+            "timed / timed: 1,000 -> 1,300 ns/call (+30%)"
+        ]
@@ -0,0 +1,87 @@
+from timings.buffer import BufferPool, MetricBuffer
+from timings.models import ServerTimingMetric, ServerTimings, buffer_pool
+
+
+class TestMetricBuffer:
+    def test_clear_keeps_capacity(self):
+        buffer = MetricBuffer()
+        for i in range(100):
+            buffer.append(i)
+
+        buffer.clear()
+        buffer.append("a")
+
+        assert buffer.capacity == 100
+        assert len(buffer) == 1
+        assert buffer.to_list() == ["a"]
+        assert list(buffer) == ["a"]
+
+    def test_pool_is_bounded(self):
+        pool = BufferPool(max_size=1, max_capacity=10)
+        small, oversized, extra = MetricBuffer(), MetricBuffer(), MetricBuffer()
+        for i in range(11):
+            oversized.append(i)
+
+        pool.release(oversized)
+        pool.release(small)
+        pool.release(extra)
+
+        assert len(pool) == 1
+        assert pool.acquire() is small
+
+
+class TestRecycling:
+    def test_metrics_have_no_dict(self):
+        ServerTimings.setUp("sync")
+        try:
+            metric = ServerTimingMetric("db", duration=1.0)
+        finally:
+            ServerTimings.tearDown()
+        assert not hasattr(metric, "__dict__")
+
+    def test_buffers_are_recycled_across_requests(self):
+        ServerTimings.setUp("sync")
+        timings = ServerTimings()
+        buffer = timings._metrics
+        ServerTimingMetric("first", duration=1.0)
+        ServerTimings.tearDown()
+
+        ServerTimings.setUp("sync")
+        try:
+            assert ServerTimings()._metrics is buffer
+            assert ServerTimings().metrics == []
+        finally:
+            ServerTimings.tearDown()
+
+    def test_late_metrics_do_not_leak_into_recycled_buffer(self):
+        ServerTimings.setUp("sync")
+        stale = ServerTimings()
+        ServerTimings.tearDown()
+
+        ServerTimings.setUp("sync")
+        try:
+            ServerTimingMetric("late", duration=1.0, timings=stale)
+
+            assert stale.metrics == []
+            assert ServerTimings().metrics == []
+        finally:
+            ServerTimings.tearDown()
+        assert len(buffer_pool) > 0
+
+    def test_stale_appenders_do_not_leak_into_recycled_buffer(self):
+        ServerTimings.setUp("sync")
+        stale = ServerTimings()
+        # A worker that read the buffer before the request finished
+        buffer = stale._metrics
+        ServerTimings.tearDown()
+
+        ServerTimings.setUp("sync")
+        try:
+            assert ServerTimings()._metrics is buffer
+            late = ServerTimingMetric("late", duration=1.0, timings=stale)
+            buffer.append(late, stale)
+            ServerTimingMetric("current", duration=1.0)
+
+            assert [m.name for m in ServerTimings().metrics] == ["current"]
+        finally:
+            ServerTimings.tearDown()
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from unittest.mock import patch
 
@@ -6,6 +8,7 @@ pytest.importorskip("django")
 from django.conf import settings
 from django.test import TestCase, RequestFactory
 from django.http import HttpResponse
+from timings.django.instruments import install, uninstall
 from timings.django.middleware import ServerTimingMiddleware
 from timings.models import ServerTimings, ServerTimingMetric
 
@@ -71,6 +74,32 @@ class TestDjango(TestCase):
         self.assertIn('db;desc="Database query";dur=50.00;', header_value)
         self.assertIn("cache;dur=10.00;", header_value)
 
+    def test_traceparent(self):
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+        with self.settings(SERVER_TIMINGS_EXPORTER=exporter):
+            middleware = ServerTimingMiddleware(self.get_response_with_metrics)
+            request = self.factory.get(
+                "/with-metrics",
+                HTTP_TRACEPARENT=(
+                    "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+                ),
+            )
+            response = middleware(request)
+        exporter.flush()
+
+        (record,) = records
+        self.assertEqual(record["trace_id"], "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(record["parent_span_id"], "00f067aa0ba902b7")
+        self.assertTrue(
+            response.headers["Server-Timing"].startswith(
+                'traceparent;desc="00-4bf92f3577b34da6a3ce929d0e0e4736-%s-01";, '
+                % record["span_id"]
+            )
+        )
+
     def test_multiple_requests_isolated_metrics(self):
         """Test that metrics don't bleed between requests"""
 
@@ -104,3 +133,349 @@ class TestDjango(TestCase):
         self.assertEqual(response2.status_code, 200)
         self.assertIn("endpoint2-metric", response2.headers.get("Server-Timing", ""))
         self.assertNotIn("endpoint1-metric", response2.headers.get("Server-Timing", ""))
+
+    def test_db_queries_are_described(self):
+        from django.db import connection
+
+        def get_response_with_query(request):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT "name" FROM "sqlite_master" WHERE "type" = %s', ["table"]
+                )
+            return HttpResponse("{}", content_type="application/json")
+
+        middleware = ServerTimingMiddleware(get_response_with_query)
+        response = middleware(self.factory.get("/query"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertIn("db_1;desc=\"DB: SELECT 'sqlite_master'\";dur=", header_value)
+
+    def _n_plus_one_view(self, request):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT "name" FROM "sqlite_master" WHERE "type" = %s', ["x"]
+            )
+            for i in range(6):
+                cursor.execute(
+                    'SELECT "name" FROM "sqlite_master" WHERE "rootpage" = %s', [i]
+                )
+        return HttpResponse("{}", content_type="application/json")
+
+    def test_db_mode_aggregated(self):
+        with self.settings(SERVER_TIMINGS_DB_MODE="aggregated"):
+            middleware = ServerTimingMiddleware(self._n_plus_one_view)
+        response = middleware(self.factory.get("/n-plus-one"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertNotIn("db_1", header_value)
+        self.assertEqual(header_value.count("db-group;"), 2)
+        self.assertIn(
+            "db-group;desc=\"DB: SELECT 'sqlite_master' x6 (min=", header_value
+        )
+
+    def test_db_duplicates_report_call_site(self):
+        middleware = ServerTimingMiddleware(self._n_plus_one_view)
+        response = middleware(self.factory.get("/n-plus-one"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertIn("db_7;", header_value)
+        self.assertEqual(header_value.count("db-dup;"), 1)
+        self.assertIn("at tests.test_django:", header_value)
+        self.assertIn("(_n_plus_one_view)", header_value)
+
+    def test_db_mode_per_request(self):
+        def db_mode(request):
+            return "both" if "debug" in request.GET else "per-query"
+
+        with self.settings(SERVER_TIMINGS_DB_MODE=db_mode):
+            middleware = ServerTimingMiddleware(self._n_plus_one_view)
+
+        plain = middleware(self.factory.get("/n-plus-one")).headers["Server-Timing"]
+        debug = middleware(self.factory.get("/n-plus-one?debug")).headers[
+            "Server-Timing"
+        ]
+        self.assertNotIn("db-group", plain)
+        self.assertIn("db_7;", debug)
+        self.assertIn("db-group;", debug)
+
+    def test_db_aliases(self):
+        from types import SimpleNamespace
+        from timings.django.instruments import DBQueryInstrument
+
+        ServerTimings.setUp("sync")
+        self.addCleanup(ServerTimings.tearDown)
+        timings = ServerTimings()
+        instrument = DBQueryInstrument(timings, mode="aggregated")
+        for alias in ("default", "replica", "replica"):
+            context = {"connection": SimpleNamespace(alias=alias)}
+            instrument(lambda *args: None, "SELECT 1", None, False, context)
+        instrument.finish()
+
+        descriptions = [m.description for m in timings.metrics if m.name == "db-alias"]
+        self.assertEqual(descriptions, ["default x1", "replica x2"])
+
+    def test_cache_template_and_http_instruments(self):
+        import httpx
+        from django.core.cache import cache
+        from django.template import Context, Engine
+
+        client = httpx.Client(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200))
+        )
+        template = Engine().from_string("{{ value }}")
+
+        def get_response_with_calls(request):
+            cache.set("key", "value")
+            cache.get_or_set("key", "other")
+            template.render(Context({"value": cache.get("key")}))
+            client.get("https://api.example.com/orders")
+            client.get("https://api.example.com/users")
+            return HttpResponse("{}", content_type="application/json")
+
+        with self.settings(
+            SERVER_TIMINGS_INSTRUMENTS=["db", "cache", "template", "http"]
+        ):
+            middleware = ServerTimingMiddleware(get_response_with_calls)
+        self.addCleanup(uninstall)
+        response = middleware(self.factory.get("/calls"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertIn('cache;desc="default x3";', header_value)
+        self.assertIn('template;desc="<string> x1";', header_value)
+        self.assertIn('http;desc="api.example.com x2";', header_value)
+
+        # Outside requests, the hooks do not record anything
+        cache.get("key")
+        self.assertEqual(ServerTimings().metrics, [])
+
+    def test_nested_templates_and_async_cache(self):
+        import asyncio
+
+        from django.core.cache import cache
+        from django.template import Context, Engine
+
+        engine = Engine(
+            loaders=[
+                (
+                    "django.template.loaders.locmem.Loader",
+                    {
+                        "base.html": "<main>{% block main %}{% endblock %}</main>",
+                        "page.html": '{% extends "base.html" %}'
+                        '{% block main %}{% include "item.html" %}{% endblock %}',
+                        "item.html": "{{ value }}",
+                    },
+                )
+            ]
+        )
+
+        async def use_cache():
+            await cache.aset("key", "value")
+            return await cache.aget_or_set("key", "other")
+
+        def get_response_with_calls(request):
+            value = asyncio.run(use_cache())
+            engine.get_template("page.html").render(Context({"value": value}))
+            return HttpResponse("{}", content_type="application/json")
+
+        with self.settings(SERVER_TIMINGS_INSTRUMENTS=["cache", "template"]):
+            middleware = ServerTimingMiddleware(get_response_with_calls)
+        self.addCleanup(uninstall)
+        response = middleware(self.factory.get("/calls"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertIn('cache;desc="default x2";', header_value)
+        for name in ("page.html", "base.html", "item.html"):
+            self.assertIn(f'template;desc="{name} x1";', header_value)
+
+    def test_uninstall_restores_originals(self):
+        import httpx
+        from django.core.cache import CacheHandler, caches
+        from django.template.base import Template
+
+        backend_class = type(caches["default"])
+        originals = (
+            CacheHandler.create_connection,
+            Template._render,
+            httpx.Client.send,
+            backend_class.__dict__.get("get"),
+            backend_class.__dict__.get("touch"),
+        )
+        for name in ("cache", "template", "http"):
+            install(name)
+        self.assertTrue(Template._render.__server_timings__)
+        self.assertTrue(backend_class.get.__server_timings__)
+
+        uninstall()
+
+        self.assertEqual(
+            (
+                CacheHandler.create_connection,
+                Template._render,
+                httpx.Client.send,
+                backend_class.__dict__.get("get"),
+                backend_class.__dict__.get("touch"),
+            ),
+            originals,
+        )
+
+    def test_resource_instrument(self):
+        from timings.resources import ResourceInstrument
+
+        with self.settings(
+            SERVER_TIMINGS_INSTRUMENTS=["db", ResourceInstrument(gc=False)]
+        ):
+            middleware = ServerTimingMiddleware(self.get_response_no_metrics)
+        response = middleware(self.factory.get("/"))
+
+        self.assertIn("cpu;dur=", response.headers["Server-Timing"])
+
+    def test_instruments_finish_when_view_raises(self):
+        from timings import resources
+
+        def get_response_raising(request):
+            raise RuntimeError("boom")
+
+        with self.settings(
+            SERVER_TIMINGS_INSTRUMENTS=[
+                resources.ResourceInstrument(gc=False, memory_sample_rate=1.0)
+            ]
+        ):
+            middleware = ServerTimingMiddleware(get_response_raising)
+        with self.assertRaises(RuntimeError):
+            middleware(self.factory.get("/"))
+
+        self.assertEqual(resources._tracing, 0)
+
+    def test_instruments_disabled_by_default(self):
+        from django.core.cache import cache
+
+        def get_response_with_cache(request):
+            cache.get("key")
+            return HttpResponse("{}", content_type="application/json")
+
+        middleware = ServerTimingMiddleware(get_response_with_cache)
+        response = middleware(self.factory.get("/cache"))
+
+        self.assertNotIn("cache;", response.headers["Server-Timing"])
+
+    def test_header_budget(self):
+        def get_response_many_metrics(request):
+            for i in range(200):
+                ServerTimingMetric(f"m{i}", duration=1.0 + i)
+            return HttpResponse("{}", content_type="application/json")
+
+        with self.settings(SERVER_TIMINGS_HEADER_MAX_BYTES=256):
+            middleware = ServerTimingMiddleware(get_response_many_metrics)
+        response = middleware(self.factory.get("/many"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertLessEqual(len(header_value), 256)
+        self.assertIn("m199;dur=200.00;", header_value)
+        self.assertRegex(header_value, r'truncated;desc="\d+ more";$')
+
+    def test_header_mode_top_level(self):
+        from django.db import connection
+        from timings import timed_metric
+
+        def get_response_with_service(request):
+            with timed_metric("service"), connection.cursor() as cursor:
+                cursor.execute('SELECT "name" FROM "sqlite_master"')
+            return HttpResponse("{}", content_type="application/json")
+
+        with self.settings(SERVER_TIMINGS_HEADER_MODE="top-level"):
+            middleware = ServerTimingMiddleware(get_response_with_service)
+        response = middleware(self.factory.get("/service"))
+
+        header_value = response.headers["Server-Timing"]
+        self.assertIn("request;", header_value)
+        self.assertIn("service;", header_value)
+        self.assertNotIn("db_", header_value)
+
+    def test_sampling(self):
+        from timings.sampling import SamplingPolicy
+
+        policy = SamplingPolicy(rate=0.0, trigger_header="X-Server-Timing")
+        with self.settings(SERVER_TIMINGS_SAMPLING=policy):
+            middleware = ServerTimingMiddleware(self.get_response_no_metrics)
+
+        with patch.object(ServerTimings, "setUp") as set_up:
+            response = middleware(self.factory.get("/"))
+        set_up.assert_not_called()
+        self.assertNotIn("Server-Timing", response.headers)
+
+        response = middleware(self.factory.get("/", HTTP_X_SERVER_TIMING="1"))
+        self.assertIn('request;desc="";dur=', response.headers["Server-Timing"])
+
+    def test_sampling_reports_slow_requests(self):
+        from timings.sampling import SamplingPolicy
+
+        policy = SamplingPolicy(rate=0.0, slow_threshold_ms=0.0)
+        with self.settings(SERVER_TIMINGS_SAMPLING=policy):
+            middleware = ServerTimingMiddleware(self.get_response_no_metrics)
+
+        response = middleware(self.factory.get("/"))
+        self.assertRegex(response.headers["Server-Timing"], r'^request;desc="";dur=')
+
+    def test_exported_records_carry_route(self):
+        from django.urls import ResolverMatch
+
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+
+        def view(request):
+            request.resolver_match = ResolverMatch(
+                view, (), {"pk": 1}, route="procedures/<int:pk>/"
+            )
+            return self.get_response_with_metrics(request)
+
+        with self.settings(SERVER_TIMINGS_EXPORTER=exporter):
+            middleware = ServerTimingMiddleware(view)
+        middleware(self.factory.get("/procedures/1/"))
+        exporter.flush()
+
+        self.assertEqual(records[0]["route"], "procedures/<int:pk>/")
+        self.assertEqual(records[0]["path"], "/procedures/1/")
+
+    def test_metrics_view(self):
+        from timings.django.views import metrics
+        from timings.exporters import Exporter
+        from timings.prometheus import PrometheusAggregates
+
+        aggregates = PrometheusAggregates()
+        exporter = Exporter([aggregates])
+        with self.settings(
+            SERVER_TIMINGS_EXPORTER=exporter, SERVER_TIMINGS_PROMETHEUS=aggregates
+        ):
+            ServerTimingMiddleware(self.get_response_no_metrics)(self.factory.get("/"))
+            exporter.flush()
+            response = metrics(self.factory.get("/metrics"))
+
+        self.assertIn(
+            'server_timings_metric_duration_seconds_count{route="",name="request"} 1',
+            response.content.decode(),
+        )
+
+    def test_recent_view(self):
+        from timings.django.views import recent
+        from timings.exporters import Exporter
+        from timings.recent import RecentRequests
+
+        recent_requests = RecentRequests()
+        exporter = Exporter([recent_requests])
+        with self.settings(
+            SERVER_TIMINGS_EXPORTER=exporter, SERVER_TIMINGS_RECENT=recent_requests
+        ):
+            middleware = ServerTimingMiddleware(self.get_response_with_metrics)
+            middleware(self.factory.get("/with-metrics"))
+            exporter.flush()
+            response = recent(self.factory.get("/debug/timings", {"metric": "db"}))
+            bad_request = recent(self.factory.get("/debug/timings", {"limit": "x"}))
+
+        (request,) = json.loads(response.content)["requests"]
+        self.assertEqual(request["path"], "/with-metrics")
+        self.assertEqual(request["status"], 200)
+        self.assertEqual(bad_request.status_code, 400)
@@ -0,0 +1,76 @@
+import io
+import json
+import logging
+import threading
+
+from timings.exporters import (
+    CallableSink,
+    Exporter,
+    JSONLFileSink,
+    LoggingSink,
+    Sink,
+    StreamSink,
+)
+
+RECORD = {
+    "path": "/",
+    "timings": [{"duration": 1.0, "name": "db", "description": None}],
+}
+
+
+class TestExporter:
+    def test_writes_batches_to_all_sinks(self, tmp_path):
+        batches = []
+        stream = io.StringIO()
+        path = tmp_path / "timings.jsonl"
+        exporter = Exporter(
+            [CallableSink(batches.append), StreamSink(stream), JSONLFileSink(str(path))]
+        )
+
+        for _ in range(3):
+            exporter.export(RECORD)
+        exporter.close()
+
+        assert sum(len(batch) for batch in batches) == 3
+        assert stream.getvalue() == (json.dumps(RECORD) + "\n") * 3
+        assert path.read_text() == (json.dumps(RECORD) + "\n") * 3
+        assert exporter.exported == 3
+
+    def test_drops_when_queue_is_full(self):
+        release = threading.Event()
+
+        class BlockingSink(Sink):
+            def write(self, batch):
+                release.wait()
+
+        exporter = Exporter([BlockingSink()], max_queue_size=2, batch_size=1)
+        results = [exporter.export(RECORD) for _ in range(10)]
+        release.set()
+        exporter.flush()
+
+        assert results[:2] == [True, True]
+        assert not all(results)
+        assert exporter.dropped == results.count(False)
+
+    def test_failing_sink_does_not_stop_others(self):
+        batches = []
+
+        class FailingSink(Sink):
+            def write(self, batch):
+                raise RuntimeError("unavailable")
+
+        exporter = Exporter([FailingSink(), CallableSink(batches.append)])
+        exporter.export(RECORD)
+        exporter.flush()
+
+        assert batches == [[RECORD]]
+        assert exporter.errors == 1
+
+    def test_logging_sink(self, caplog):
+        caplog.set_level(logging.INFO, logger="test-exporter")
+        exporter = Exporter([LoggingSink(logging.getLogger("test-exporter"))])
+
+        exporter.export(RECORD)
+        exporter.flush()
+
+        assert json.loads(caplog.records[0].getMessage()) == RECORD
@@ -103,3 +103,420 @@ class TestFastAPI:
             assert response2.status_code == 200
             assert "endpoint2-metric" in response2.headers.get("Server-Timing", "")
             assert "endpoint1-metric" not in response2.headers.get("Server-Timing", "")
+
+    @pytest.mark.asyncio
+    async def test_header_budget(self):
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, header_max_bytes=256)
+
+        @app.get("/many")
+        async def many():
+            for i in range(200):
+                ServerTimingMetric(f"m{i}", duration=1.0 + i)
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.get("/many")
+
+        header_value = response.headers["Server-Timing"]
+        assert len(header_value) <= 256
+        assert header_value.startswith("m199;dur=200.00;")
+        assert header_value.endswith(' more";')
+
+    @pytest.mark.asyncio
+    async def test_concurrent_sync_and_async_requests_do_not_leak(self):
+        import asyncio
+        import time
+
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware)
+
+        @app.get("/sync/{n}")
+        def sync_endpoint(n: int):
+            ServerTimingMetric(f"sync-{n}", duration=1.0)
+            time.sleep(0)
+            ServerTimingMetric(f"sync-{n}-after", duration=1.0)
+            return {"n": n}
+
+        @app.get("/async/{n}")
+        async def async_endpoint(n: int):
+            ServerTimingMetric(f"async-{n}", duration=1.0)
+            await asyncio.sleep(0)
+            ServerTimingMetric(f"async-{n}-after", duration=1.0)
+            return {"n": n}
+
+        paths = [f"/{kind}/{n}" for n in range(1000) for kind in ("sync", "async")]
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            responses = await asyncio.gather(*(client.get(path) for path in paths))
+
+        for path, response in zip(paths, responses, strict=True):
+            _, kind, n = path.split("/")
+            assert response.status_code == 200
+            assert response.headers["Server-Timing"] == (
+                f"{kind}-{n};dur=1.00;, {kind}-{n}-after;dur=1.00;"
+            )
+
+    @pytest.mark.asyncio
+    async def test_resource_instrument(self):
+        from timings.resources import ResourceInstrument
+
+        app = FastAPI()
+        app.add_middleware(
+            FastAPIServerTimingMiddleware, instruments=[ResourceInstrument(gc=False)]
+        )
+
+        @app.get("/")
+        async def root():
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.get("/")
+
+        assert 'cpu;desc="event loop thread";' in response.headers["Server-Timing"]
+
+    @pytest.mark.asyncio
+    async def test_instruments_finish_when_endpoint_raises(self):
+        from timings import resources
+
+        app = FastAPI()
+        app.add_middleware(
+            FastAPIServerTimingMiddleware,
+            instruments=[
+                resources.ResourceInstrument(gc=False, memory_sample_rate=1.0)
+            ],
+        )
+
+        @app.get("/")
+        async def root():
+            raise RuntimeError("boom")
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            with pytest.raises(RuntimeError):
+                await client.get("/")
+
+        assert resources._tracing == 0
+
+    @pytest.mark.asyncio
+    async def test_exports_when_endpoint_raises(self):
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, exporter=exporter)
+
+        @app.get("/")
+        async def root():
+            ServerTimingMetric("db", duration=1.0)
+            raise RuntimeError("boom")
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            with pytest.raises(RuntimeError):
+                await client.get("/")
+        exporter.flush()
+
+        (record,) = records
+        assert record["path"] == "/"
+        assert record["status"] is None
+        assert [m["name"] for m in record["timings"]] == ["db"]
+
+
+async def call_asgi(app, path, headers=(), extensions=None):
+    """Calls an ASGI app directly, returning the sent messages."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"test"), *headers],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+        "extensions": extensions or {},
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+def streaming_app(exporter=None):
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    app.add_middleware(FastAPIServerTimingMiddleware, exporter=exporter)
+
+    @app.get("/export")
+    async def export():
+        ServerTimingMetric("query", duration=5.0)
+
+        async def rows():
+            for i in range(3):
+                ServerTimingMetric(f"row-{i}", duration=1.0)
+                yield f"{i}\n".encode()
+
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    return app
+
+
+class TestFastAPIStreaming:
+    @pytest.mark.asyncio
+    async def test_trailers(self):
+        messages = await call_asgi(
+            streaming_app(),
+            "/export",
+            headers=[(b"te", b"trailers")],
+            extensions={"http.response.trailers": {}},
+        )
+
+        start, *_, trailers = messages
+        assert start["trailers"] is True
+        headers = dict(start["headers"])
+        assert headers[b"trailer"] == b"server-timing"
+        assert headers[b"server-timing"] == b"query;dur=5.00;"
+
+        assert trailers["type"] == "http.response.trailers"
+        trailer = dict(trailers["headers"])[b"server-timing"].decode()
+        assert "row-0;dur=1.00;, row-1;dur=1.00;, row-2;dur=1.00;" in trailer
+        assert "ttfb;dur=" in trailer
+        assert 'response-body;desc="6 bytes in 3 chunks";dur=' in trailer
+
+    @pytest.mark.asyncio
+    async def test_without_trailer_support_exports_body_metrics(self):
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+
+        messages = await call_asgi(
+            streaming_app(exporter), "/export", headers=[(b"te", b"trailers")]
+        )
+        exporter.flush()
+
+        assert "trailers" not in messages[0]
+        assert all(m["type"] != "http.response.trailers" for m in messages)
+        (record,) = records
+        names = [m["name"] for m in record["timings"]]
+        assert names == ["query", "row-0", "row-1", "row-2", "ttfb", "response-body"]
+
+    @pytest.mark.asyncio
+    async def test_sampling(self):
+        from timings.sampling import SamplingPolicy
+
+        app = FastAPI()
+        app.add_middleware(
+            FastAPIServerTimingMiddleware,
+            sampling=SamplingPolicy(
+                rate=0.0,
+                path_rates={"/slow": 0.0},
+                trigger_header="X-Server-Timing",
+                slow_threshold_ms=0.0,
+            ),
+        )
+
+        @app.get("/with-metrics")
+        async def with_metrics():
+            ServerTimingMetric("db", duration=50.0)
+            return {}
+
+        @app.get("/slow")
+        async def slow():
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            triggered = await client.get(
+                "/with-metrics", headers={"X-Server-Timing": "1"}
+            )
+            slow_response = await client.get("/slow")
+
+        assert triggered.headers["Server-Timing"] == "db;dur=50.00;"
+        assert slow_response.headers["Server-Timing"].startswith('request;desc="";dur=')
+
+    @pytest.mark.asyncio
+    async def test_histograms_by_route(self):
+        from timings.exporters import Exporter
+        from timings.histograms import HistogramRegistry
+
+        histograms = HistogramRegistry()
+        exporter = Exporter([histograms])
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, exporter=exporter)
+
+        @app.get("/procedures/{pk}")
+        async def procedure(pk: int):
+            ServerTimingMetric("db", duration=float(pk))
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            for pk in range(1, 11):
+                await client.get(f"/procedures/{pk}")
+        exporter.flush()
+
+        assert {route for route, _ in histograms.series()} == {"/procedures/{pk}"}
+        assert histograms.histogram("/procedures/{pk}", "db").count == 10
+
+    @pytest.mark.asyncio
+    async def test_metrics_router(self):
+        from timings.exporters import Exporter
+        from timings.fastapi.router import metrics_router
+        from timings.prometheus import PrometheusAggregates
+
+        aggregates = PrometheusAggregates()
+        exporter = Exporter([aggregates])
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, exporter=exporter)
+        app.include_router(metrics_router(aggregates))
+
+        @app.get("/items/{pk}")
+        async def item(pk: int):
+            ServerTimingMetric("db", duration=5.0)
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            await client.get("/items/1")
+            exporter.flush()
+            response = await client.get("/metrics")
+
+        assert response.headers["content-type"].startswith(
+            "application/openmetrics-text"
+        )
+        assert (
+            'server_timings_metric_duration_seconds_count{route="/items/{pk}",name="db"} 1'
+            in response.text
+        )
+
+    @pytest.mark.asyncio
+    async def test_recent_router(self):
+        from timings.exporters import Exporter
+        from timings.fastapi.router import recent_router
+        from timings.recent import RecentRequests
+
+        recent = RecentRequests()
+        exporter = Exporter([recent])
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, exporter=exporter)
+        app.include_router(recent_router(recent))
+
+        @app.get("/items/{pk}")
+        async def item(pk: int):
+            ServerTimingMetric("db", duration=5.0)
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            await client.get("/items/1")
+            await client.get("/missing")
+            exporter.flush()
+            response = await client.get("/debug/timings", params={"metric": "db"})
+
+        (request,) = response.json()["requests"]
+        assert request["route"] == "/items/{pk}"
+        assert request["status"] == 200
+        assert [metric["name"] for metric in request["timings"]][0] == "db"
+
+    @pytest.mark.asyncio
+    async def test_traceparent(self):
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, exporter=exporter)
+
+        @app.get("/")
+        async def root():
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.get(
+                "/",
+                headers={
+                    "traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+                },
+            )
+        exporter.flush()
+
+        (record,) = records
+        assert record["trace_id"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+        assert response.headers["Server-Timing"] == (
+            'traceparent;desc="00-4bf92f3577b34da6a3ce929d0e0e4736-%s-01";'
+            % record["span_id"]
+        )
+
+
+class TestLoopLagMonitor:
+    @pytest.mark.asyncio
+    async def test_blocking_is_attributed_to_requests_in_flight(self):
+        import asyncio
+        import time
+
+        from timings.fastapi.monitor import LoopLagMonitor
+
+        monitor = LoopLagMonitor(interval=0.01, threshold_ms=50.0, capture_stacks=True)
+        app = FastAPI()
+        app.add_middleware(FastAPIServerTimingMiddleware, loop_monitor=monitor)
+
+        @app.get("/blocking")
+        async def blocking():
+            await asyncio.sleep(0.05)
+            time.sleep(0.2)
+            return {}
+
+        @app.get("/waiting")
+        async def waiting():
+            await asyncio.sleep(0.3)
+            return {}
+
+        @app.get("/fast")
+        async def fast():
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            responses = await asyncio.gather(
+                client.get("/blocking"), client.get("/waiting")
+            )
+            fast_response = await client.get("/fast")
+        monitor.stop()
+
+        for response in responses:
+            header_value = response.headers["Server-Timing"]
+            assert (
+                'loop-blocked;desc="1 episodes, at tests.test_fastapi:' in header_value
+            )
+            assert "(blocking)" in header_value
+        assert "Server-Timing" not in fast_response.headers
+        assert len(monitor.episodes) == 1
+        assert monitor.episodes[0].duration >= 150.0
+        assert any("time.sleep(0.2)" in line for line in monitor.episodes[0].stack)
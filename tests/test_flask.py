@@ -75,3 +75,255 @@ class TestFlask:
             assert response2.status_code == 200
             assert "endpoint2-metric" in response2.headers.get("Server-Timing", "")
             assert "endpoint1-metric" not in response2.headers.get("Server-Timing", "")
+
+    def test_header_budget(self):
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_HEADER_MAX_BYTES"] = 256
+        ServerTimingsExtension(app)
+
+        @app.route("/many")
+        def many():
+            for _ in range(200):
+                ServerTimingMetric("cache", duration=1.0)
+            ServerTimingMetric("db", duration=50.0)
+            return {}
+
+        with app.test_client() as client:
+            response = client.get("/many")
+
+        assert response.headers["Server-Timing"] == (
+            'cache;desc="x200";dur=200.00;, db;dur=50.00;'
+        )
+
+    def test_sampling(self):
+        from timings.sampling import SamplingPolicy
+
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_SAMPLING"] = SamplingPolicy(
+            rate=0.0, trigger_cookie="timings"
+        )
+        ServerTimingsExtension(app)
+
+        @app.route("/")
+        def root():
+            return {}
+
+        @app.route("/sampled")
+        def sampled():
+            ServerTimingMetric("db", duration=50.0)
+            return {}
+
+        with app.test_client() as client:
+            with patch.object(ServerTimings, "setUp") as set_up:
+                response = client.get("/", headers={"X-Server-Timing": ""})
+            set_up.assert_not_called()
+            assert response.status_code == 200
+            assert "Server-Timing" not in response.headers
+
+            client.set_cookie("timings", "1")
+            response = client.get("/sampled")
+            assert response.headers["Server-Timing"] == "db;dur=50.00;"
+
+    def test_histograms_by_url_rule(self):
+        from timings.exporters import Exporter
+        from timings.histograms import HistogramRegistry
+
+        histograms = HistogramRegistry()
+        exporter = Exporter([histograms])
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_EXPORTER"] = exporter
+        ServerTimingsExtension(app)
+
+        @app.route("/procedures/<int:pk>")
+        def procedure(pk):
+            ServerTimingMetric("db", duration=float(pk))
+            return {}
+
+        with app.test_client() as client:
+            for pk in range(1, 11):
+                client.get(f"/procedures/{pk}")
+        exporter.flush()
+
+        assert sorted(histograms.series()) == [
+            ("/procedures/<int:pk>", "db"),
+            ("/procedures/<int:pk>", "request"),
+        ]
+        assert histograms.histogram("/procedures/<int:pk>", "request").count == 10
+        assert histograms.quantile("/procedures/<int:pk>", "db", 0.5) == pytest.approx(
+            5.0, rel=0.05
+        )
+
+    def test_metrics_blueprint(self):
+        from timings.exporters import Exporter
+        from timings.flask.blueprint import metrics_blueprint
+        from timings.prometheus import CONTENT_TYPE, PrometheusAggregates
+
+        aggregates = PrometheusAggregates()
+        exporter = Exporter([aggregates])
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_EXPORTER"] = exporter
+        ServerTimingsExtension(app)
+        app.register_blueprint(metrics_blueprint(aggregates))
+
+        @app.route("/")
+        def root():
+            return {}
+
+        with app.test_client() as client:
+            client.get("/")
+            exporter.flush()
+            response = client.get("/metrics")
+
+        assert response.content_type == CONTENT_TYPE
+        assert 'server_timings_request_duration_seconds_count{route="/"} 1' in (
+            response.text
+        )
+
+    def test_resource_instrument(self):
+        from timings.resources import ResourceInstrument
+
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_INSTRUMENTS"] = [ResourceInstrument(gc=False)]
+        ServerTimingsExtension(app)
+
+        @app.route("/")
+        def root():
+            return {}
+
+        with app.test_client() as client:
+            response = client.get("/")
+
+        assert "cpu;dur=" in response.headers["Server-Timing"]
+
+    def test_instruments_finish_when_view_raises(self):
+        from timings import resources
+
+        for wsgi_middleware in (False, True):
+            app = Flask(__name__)
+            # Propagates the exception, without the after_request hooks
+            app.testing = True
+            app.config["SERVER_TIMINGS_WSGI_MIDDLEWARE"] = wsgi_middleware
+            app.config["SERVER_TIMINGS_INSTRUMENTS"] = [
+                resources.ResourceInstrument(gc=False, memory_sample_rate=1.0)
+            ]
+            ServerTimingsExtension(app)
+
+            @app.route("/")
+            def root():
+                raise RuntimeError("boom")
+
+            with pytest.raises(RuntimeError):
+                app.test_client().get("/")
+            assert resources._tracing == 0
+
+    def test_wsgi_middleware_times_streamed_body(self):
+        from flask import stream_with_context
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_WSGI_MIDDLEWARE"] = True
+        app.config["SERVER_TIMINGS_EXPORTER"] = exporter
+        ServerTimingsExtension(app)
+
+        @app.route("/stream/<name>")
+        def stream(name):
+            ServerTimingMetric("db", duration=50.0)
+
+            def generate():
+                for chunk in ("a", "bc"):
+                    ServerTimingMetric("render", duration=5.0)
+                    yield chunk
+
+            return stream_with_context(generate())
+
+        with app.test_client() as client:
+            response = client.get("/stream/x")
+            assert response.text == "abc"
+            # The server closes the body once it has been sent
+            response.close()
+        exporter.flush()
+
+        assert response.headers["Server-Timing"] == "db;dur=50.00;"
+        (record,) = records
+        assert record["path"] == "/stream/x"
+        assert record["route"] == "/stream/<name>"
+        names = [metric["name"] for metric in record["timings"]]
+        assert names == ["db", "render", "render", "ttfb", "response-body"]
+        assert record["timings"][-1]["description"] == "3 bytes in 2 chunks"
+        assert record["duration"] >= record["timings"][-1]["duration"]
+
+    def test_wsgi_middleware_tears_down_on_error(self):
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_WSGI_MIDDLEWARE"] = True
+        ServerTimingsExtension(app)
+
+        def fail(environ, start_response):
+            raise RuntimeError("boom")
+
+        app.wsgi_app.wsgi_app = fail
+        with patch.object(ServerTimings, "tearDown") as tear_down:
+            with pytest.raises(RuntimeError):
+                app.test_client().get("/")
+        tear_down.assert_called_once_with()
+
+    def test_recent_blueprint(self):
+        from timings.exporters import Exporter
+        from timings.flask.blueprint import recent_blueprint
+        from timings.recent import RecentRequests
+
+        recent = RecentRequests()
+        exporter = Exporter([recent])
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_EXPORTER"] = exporter
+        ServerTimingsExtension(app)
+        app.register_blueprint(recent_blueprint(recent))
+
+        @app.route("/items/<int:pk>")
+        def item(pk):
+            ServerTimingMetric("db", duration=float(pk))
+            return {}
+
+        with app.test_client() as client:
+            for pk in (1, 3, 2):
+                client.get(f"/items/{pk}")
+            exporter.flush()
+            response = client.get("/debug/timings?order=slowest&metric=db&limit=2")
+            assert client.get("/debug/timings?limit=x").status_code == 400
+
+        requests = response.json["requests"]
+        assert [request["path"] for request in requests] == ["/items/3", "/items/2"]
+        assert requests[0]["route"] == "/items/<int:pk>"
+        assert requests[0]["status"] == 200
+
+    def test_traceparent(self):
+        from timings.exporters import CallableSink, Exporter
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+        app = Flask(__name__)
+        app.config["SERVER_TIMINGS_EXPORTER"] = exporter
+        ServerTimingsExtension(app)
+
+        @app.route("/")
+        def root():
+            return {}
+
+        with app.test_client() as client:
+            response = client.get(
+                "/",
+                headers={
+                    "traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+                },
+            )
+            untraced = client.get("/")
+        exporter.flush()
+
+        traced, _ = records
+        assert traced["trace_id"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+        assert response.headers["Server-Timing"] == (
+            'traceparent;desc="00-4bf92f3577b34da6a3ce929d0e0e4736-%s-01";'
+            % traced["span_id"]
+        )
+        assert "Server-Timing" not in untraced.headers
@@ -0,0 +1,94 @@
+import pytest
+
+from timings.header import render_header
+from timings.models import ServerTimingMetric, ServerTimings
+
+pytestmark = pytest.mark.usefixtures("timings")
+
+
+def metric(name, duration, description=None):
+    return ServerTimingMetric(name, description, duration=duration)
+
+
+class TestRenderHeader:
+    def test_unbounded_renders_all_in_order(self):
+        metrics = [metric("a", 1.0), metric("b", 2.0, "B"), metric("a", 3.0)]
+
+        assert (
+            render_header(metrics) == 'a;dur=1.00;, b;desc="B";dur=2.00;, a;dur=3.00;'
+        )
+
+    def test_budget_folds_same_named_metrics(self):
+        metrics = [
+            metric("db", 1.0, "query"),
+            metric("db", 2.5, "query"),
+            metric("x", 1.0),
+        ]
+
+        assert render_header(metrics, max_bytes=1000) == (
+            'db;desc="query (x2)";dur=3.50;, x;dur=1.00;'
+        )
+
+    def test_budget_keeps_longest_and_marks_truncation(self):
+        metrics = [metric(f"m{i}", float(i)) for i in range(1, 101)]
+
+        header = render_header(metrics, max_bytes=120)
+
+        assert len(header) <= 120
+        assert header.startswith("m100;dur=100.00;, m99;dur=99.00;")
+        kept = header.count("dur=")
+        assert header.endswith(f'truncated;desc="{100 - kept} more";')
+
+    def test_budget_keeps_metrics_without_duration(self, timings):
+        alloc = ServerTimingMetric("alloc", description="net 1.0 KiB")
+        timings.add(alloc)
+
+        assert (
+            render_header([alloc], max_bytes=100)
+            == str(alloc)
+            == ('alloc;desc="net 1.0 KiB";')
+        )
+        assert render_header([alloc, alloc, metric("alloc", 1.0)], max_bytes=100) == (
+            'alloc;desc="net 1.0 KiB (x3)";dur=1.00;'
+        )
+
+    def test_marker_past_budget_is_dropped(self):
+        metrics = [metric("database", 100.0)]
+
+        assert render_header(metrics, max_bytes=10) == ""
+
+    def test_budget_without_truncation_has_no_marker(self):
+        metrics = [metric("a", 1.0), metric("b", 2.0)]
+
+        assert render_header(metrics, max_bytes=33) == "b;dur=2.00;, a;dur=1.00;"
+
+
+class TestHeaderModes:
+    @pytest.fixture
+    def nested(self):
+        service = ServerTimingMetric("service", duration=10.0)
+        for duration in (2.0, 3.0):
+            query = metric("db", duration)
+            query.parent = service
+        return [service, *(m for m in ServerTimings().metrics if m.name == "db")]
+
+    def test_top_level_skips_children(self, nested):
+        assert render_header(nested, mode="top-level") == "service;dur=10.00;"
+
+    def test_self_time_rollup_by_name(self, nested):
+        assert render_header(nested, mode="self") == (
+            'service;dur=5.00;, db;desc="x2";dur=5.00;'
+        )
+
+    def test_self_time_is_not_negative(self):
+        parent = metric("parallel", 1.0)
+        child = metric("task", 2.0)
+        child.parent = parent
+
+        assert render_header([parent, child], mode="self") == (
+            "parallel;dur=0.00;, task;dur=2.00;"
+        )
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError, match="Header mode must be one of"):
+            render_header([], mode="tree")
@@ -0,0 +1,152 @@
+import pytest
+
+from timings.histograms import (
+    OTHER_NAME,
+    OTHER_ROUTE,
+    REQUEST_NAME,
+    HistogramRegistry,
+    LogHistogram,
+    series_name,
+)
+
+
+def record(route, **durations):
+    return {
+        "path": "/",
+        "route": route,
+        "timings": [
+            {"name": name, "duration": duration, "description": None}
+            for name, duration in durations.items()
+        ],
+    }
+
+
+class TestLogHistogram:
+    def test_quantiles_within_relative_error(self):
+        histogram = LogHistogram(growth=1.1)
+        for value in range(1, 1001):
+            histogram.add(float(value))
+
+        assert histogram.count == 1000
+        for q, expected in ((0.5, 500.0), (0.95, 950.0), (0.99, 990.0)):
+            assert histogram.quantile(q) == pytest.approx(expected, rel=0.05)
+
+    def test_empty(self):
+        assert LogHistogram().quantile(0.5) is None
+
+
+class TestHistogramRegistry:
+    def test_quantiles_per_route_and_metric(self):
+        registry = HistogramRegistry()
+        registry.write(
+            [record("/api/procedures", db=float(i), request=100.0) for i in range(100)]
+        )
+        registry.write([record("/api/users", db=1000.0)])
+
+        assert registry.quantile("/api/procedures", "db", 0.99) == pytest.approx(
+            99.0, rel=0.05
+        )
+        assert registry.quantile("/api/users", "db", 0.5) == pytest.approx(
+            1000.0, rel=0.05
+        )
+        assert set(registry.series()) == {
+            ("/api/procedures", "db"),
+            ("/api/procedures", "request"),
+            ("/api/users", "db"),
+        }
+
+    def test_windows(self):
+        now = [0.0]
+        registry = HistogramRegistry(slice_seconds=10, clock=lambda: now[0])
+        registry.observe("/", "db", 1.0)
+        now[0] = 120.0
+        registry.observe("/", "db", 2.0)
+
+        assert registry.histogram("/", "db", "1m").count == 1
+        assert registry.histogram("/", "db", "5m").count == 2
+        with pytest.raises(ValueError, match="Window must be one of"):
+            registry.histogram("/", "db", "2d")
+
+    def test_rotation_drops_expired_slices(self):
+        now = [0.0]
+        registry = HistogramRegistry(
+            slice_seconds=10, retention_seconds=60, clock=lambda: now[0]
+        )
+        registry.observe("/", "db", 1.0)
+        now[0] = 60.0  # the same slot of the ring, one rotation later
+        registry.observe("/", "db", 2.0)
+
+        assert registry.histogram("/", "db", "1h").count == 1
+
+    def test_series_are_bounded(self):
+        registry = HistogramRegistry(max_series=2)
+        for i in range(5):
+            registry.observe(f"/route-{i}", "db", 1.0)
+
+        assert registry.histogram(OTHER_ROUTE, "db").count == 3
+        assert len(registry.series()) == 3
+
+    def test_numbered_db_metrics_are_one_series(self):
+        registry = HistogramRegistry()
+        registry.record(
+            {
+                "route": "/",
+                "timings": [
+                    {"name": f"db_{i}", "duration": 1.0} for i in range(1, 101)
+                ],
+            }
+        )
+
+        assert registry.series() == [("/", "db")]
+        assert registry.histogram("/", "db").count == 100
+        assert series_name("db_12") == "db"
+        assert series_name("db_cache") == "db_cache"
+
+    def test_metrics_without_duration_are_skipped(self):
+        registry = HistogramRegistry()
+        registry.record(
+            {
+                "route": "/",
+                "timings": [
+                    {"name": "db", "duration": 1.0},
+                    {"name": "alloc", "duration": None},
+                ],
+            }
+        )
+
+        assert registry.series() == [("/", "db")]
+
+    def test_request_duration(self):
+        registry = HistogramRegistry()
+        registry.write(
+            [
+                {**record("/", db=1.0), "duration": 10.0},
+                # The request metric of Django and of unsampled requests
+                {**record("/", request=20.0), "duration": 20.0},
+                record("/", request=30.0),
+            ]
+        )
+
+        assert sorted(registry.series()) == [("/", "db"), ("/", REQUEST_NAME)]
+        assert registry.histogram("/", REQUEST_NAME).count == 3
+        assert registry.histogram("/", REQUEST_NAME).sum == 60.0
+
+    def test_slices_are_allocated_lazily(self):
+        now = [0.0]
+        registry = HistogramRegistry(slice_seconds=10, clock=lambda: now[0])
+        registry.observe("/", "db", 1.0)
+        now[0] = 20.0
+        registry.observe("/", "db", 2.0)
+
+        (ring,) = registry._series.values()
+        assert len(ring) == 2
+        assert registry.histogram("/", "db", "1m").count == 2
+
+    def test_overflow_series_are_bounded(self):
+        registry = HistogramRegistry(max_series=1, max_overflow_series=2)
+        for i in range(5):
+            registry.observe(f"/route-{i}", f"metric-{i}", 1.0)
+
+        assert len(registry.series()) == 4
+        assert registry.histogram(OTHER_ROUTE, "metric-2").count == 1
+        assert registry.histogram(OTHER_ROUTE, OTHER_NAME).count == 2
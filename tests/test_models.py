@@ -0,0 +1,228 @@
+import asyncio
+import threading
+import warnings
+
+import pytest
+
+from timings import timed_metric
+from timings.models import (
+    NULL_TIMINGS,
+    MetricTemplate,
+    ServerTimingMetric,
+    ServerTimings,
+    set_clock,
+)
+
+pytestmark = pytest.mark.usefixtures("timings")
+
+
+class TestLookup:
+    def test_singleton_per_request(self, timings):
+        assert ServerTimings() is timings
+        assert timings is not NULL_TIMINGS
+
+    def test_null_timings_outside_requests(self):
+        ServerTimings.tearDown()
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            timings = ServerTimings()
+            ServerTimingMetric("background", duration=1.0)
+            with timed_metric("job"):
+                pass
+
+        assert timings is NULL_TIMINGS
+        assert timings.metrics == []
+        assert timings.dump() == []
+
+    def test_threads_do_not_share_timings(self, timings):
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(ServerTimings()))
+        thread.start()
+        thread.join()
+
+        assert seen == [NULL_TIMINGS]
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError, match="Mode must be"):
+            ServerTimings.setUp("threads")
+
+
+@pytest.fixture
+def fake_clock():
+    now = [0]
+    set_clock(lambda: now[0])
+    yield now
+    set_clock(None)
+
+
+class TestClock:
+    def test_durations_from_clock(self, timings, fake_clock):
+        metric = ServerTimingMetric("cache")
+        metric.start()
+        fake_clock[0] = 1_500_000
+        assert metric.duration == 1.5
+
+        metric.end()
+        fake_clock[0] = 9_000_000
+        assert metric.duration == 1.5
+        assert str(metric) == "cache;dur=1.50;"
+
+    def test_zero_durations_are_rendered(self, timings, fake_clock):
+        with ServerTimingMetric("hit").measure():
+            pass
+        ServerTimingMetric("miss", duration=0.0)
+
+        assert [str(metric) for metric in timings.metrics] == [
+            "hit;dur=0.00;",
+            "miss;dur=0.00;",
+        ]
+
+    def test_metrics_without_duration_are_rendered_without(self, timings):
+        timings.add(ServerTimingMetric("alloc", description="net 1.0 KiB"))
+
+        assert str(timings.metrics[0]) == 'alloc;desc="net 1.0 KiB";'
+
+    def test_dump_start(self, fake_clock):
+        ServerTimings.setUp("sync")
+        timings = ServerTimings()
+        fake_clock[0] = 2_000_000
+        with timed_metric("render"):
+            fake_clock[0] = 3_000_000
+        ServerTimingMetric("db", duration=1.0)
+
+        assert timings.dump() == [
+            {
+                "duration": 1.0,
+                "name": "render",
+                "description": None,
+                "start": 2.0,
+                "parent": None,
+            },
+            {
+                "duration": 1.0,
+                "name": "db",
+                "description": None,
+                "start": None,
+                "parent": None,
+            },
+        ]
+
+    def test_restart(self, timings, fake_clock):
+        metric = ServerTimingMetric("retry")
+        metric.start()
+        fake_clock[0] = 1_000_000
+        metric.end()
+        metric.start()
+        fake_clock[0] = 3_000_000
+        metric.end()
+
+        assert metric.duration == 2.0
+
+    def test_predefined_duration_cannot_be_measured(self, timings):
+        metric = ServerTimingMetric("db", duration=1.0)
+
+        with pytest.raises(ValueError, match="with a duration"):
+            metric.start()
+        with pytest.raises(ValueError, match="with a duration"):
+            metric.end()
+
+
+class TestNesting:
+    def test_metrics_started_within_a_metric_are_its_children(self, timings):
+        with timed_metric("service") as service:
+            with timed_metric("db") as query:
+                pass
+            fixed = ServerTimingMetric("cache", duration=1.0)
+        after = ServerTimingMetric("after", duration=1.0)
+
+        assert service.parent is None
+        assert query.parent is service
+        assert fixed.parent is service
+        assert after.parent is None
+
+    def test_not_nesting_metric_is_no_parent(self, timings):
+        request = ServerTimingMetric("request")
+        with request.measure(nest=False):
+            with timed_metric("db") as query:
+                pass
+
+        assert query.parent is None
+
+    def test_parent_of_another_request_is_ignored(self, timings):
+        with timed_metric("service"):
+            ServerTimings.tearDown()
+            ServerTimings.setUp("sync")
+            fixed = ServerTimingMetric("db", duration=1.0)
+
+        assert fixed.parent is None
+
+    def test_tasks_nest_under_the_metric_they_were_created_in(self):
+        async def query():
+            with timed_metric("db") as metric:
+                await asyncio.sleep(0)
+            return metric
+
+        async def main():
+            ServerTimings.setUp("async")
+            try:
+                with timed_metric("service") as service:
+                    queries = await asyncio.gather(query(), query())
+                sibling = ServerTimingMetric("after", duration=1.0)
+            finally:
+                ServerTimings.tearDown()
+            return service, queries, sibling
+
+        service, queries, sibling = asyncio.run(main())
+
+        assert all(metric.parent is service for metric in queries)
+        assert sibling.parent is None
+
+    def test_dump_metrics_never_started(self, timings):
+        timings.add(ServerTimingMetric("alloc", description="net 1.0 KiB"))
+
+        assert timings.dump()[0]["duration"] is None
+        (node,) = timings.dump(tree=True)
+        assert node["duration"] is node["self_duration"] is None
+
+    def test_dump_parents(self, timings):
+        with timed_metric("service"):
+            with timed_metric("db"):
+                pass
+        ServerTimingMetric("render", duration=1.0)
+
+        assert [metric["parent"] for metric in timings.dump()] == [None, 0, None]
+
+    def test_dump_tree(self, timings):
+        with timed_metric("service", "orders") as service:
+            ServerTimingMetric("db", duration=2.0)
+            ServerTimingMetric("db", duration=3.0)
+        ServerTimingMetric("render", duration=1.0)
+
+        tree = timings.dump(tree=True)
+
+        assert [node["name"] for node in tree] == ["service", "render"]
+        assert tree[0]["description"] == "orders"
+        assert [child["duration"] for child in tree[0]["children"]] == [2.0, 3.0]
+        assert tree[0]["self_duration"] == pytest.approx(
+            max(0.0, service.duration - 5.0)
+        )
+        assert tree[1] == {
+            "duration": 1.0,
+            "self_duration": 1.0,
+            "name": "render",
+            "description": None,
+            "start": None,
+            "children": [],
+        }
+
+
+class TestMetricTemplate:
+    def test_new_sets_every_slot(self, timings):
+        metric = MetricTemplate("render page", "home").new()
+
+        for slot in ServerTimingMetric.__slots__:
+            assert hasattr(metric, slot), slot
+        assert metric.name == "render-page"
+        assert metric.timings is timings
+        assert metric.duration == 0.0
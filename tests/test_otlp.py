@@ -0,0 +1,128 @@
+import json
+
+from timings.exporters import Exporter
+from timings.otlp import (
+    SPAN_KIND_INTERNAL,
+    SPAN_KIND_SERVER,
+    STATUS_CODE_ERROR,
+    OTLPFileSink,
+    OTLPSink,
+    to_spans,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+def record(**fields):
+    return {
+        "path": "/items/1",
+        "route": "/items/{pk}",
+        "status": 200,
+        "duration": 10.0,
+        "request_id": None,
+        "trace_id": TRACE_ID,
+        "span_id": "a" * 16,
+        "parent_span_id": "00f067aa0ba902b7",
+        "trace_flags": "01",
+        "start_time": 1_000_000_000,
+        "timings": [
+            {"duration": 4.0, "name": "db", "description": "DB: SELECT", "start": 1.0},
+            {"duration": 2.5, "name": "cpu", "description": None, "start": None},
+        ],
+        **fields,
+    }
+
+
+def attributes(span):
+    return {
+        attribute["key"]: next(iter(attribute["value"].values()))
+        for attribute in span["attributes"]
+    }
+
+
+class TestToSpans:
+    def test_request_and_metric_spans(self):
+        request, db = to_spans(record())
+
+        assert request["traceId"] == db["traceId"] == TRACE_ID
+        assert request["spanId"] == "a" * 16
+        assert request["parentSpanId"] == "00f067aa0ba902b7"
+        assert request["name"] == "/items/{pk}"
+        assert request["kind"] == SPAN_KIND_SERVER
+        assert request["startTimeUnixNano"] == "1000000000"
+        assert request["endTimeUnixNano"] == "1010000000"
+        assert "status" not in request
+        assert attributes(request) == {
+            "server_timing.cpu": 2.5,
+            "url.path": "/items/1",
+            "http.route": "/items/{pk}",
+            "http.response.status_code": "200",
+        }
+
+        assert db["parentSpanId"] == "a" * 16
+        assert db["spanId"] != request["spanId"]
+        assert db["name"] == "db"
+        assert db["kind"] == SPAN_KIND_INTERNAL
+        assert db["startTimeUnixNano"] == "1001000000"
+        assert db["endTimeUnixNano"] == "1005000000"
+        assert attributes(db) == {"server_timing.description": "DB: SELECT"}
+
+    def test_nested_metric_spans(self):
+        timings = [
+            {"duration": 6.0, "name": "service", "description": None, "start": 1.0},
+            {
+                "duration": 4.0,
+                "name": "db",
+                "description": None,
+                "start": 2.0,
+                "parent": 0,
+            },
+        ]
+        request, service, db = to_spans(record(timings=timings))
+
+        assert service["parentSpanId"] == request["spanId"]
+        assert db["parentSpanId"] == service["spanId"]
+
+    def test_errors_and_background_work(self):
+        (request, _) = to_spans(record(status=503))
+        assert request["status"] == {"code": STATUS_CODE_ERROR}
+
+        (work, child) = to_spans(record(path=None, route="send_mail", duration=None))
+        assert work["name"] == "send_mail"
+        assert work["kind"] == SPAN_KIND_INTERNAL
+        assert work["endTimeUnixNano"] == child["endTimeUnixNano"]
+
+    def test_untraced_records_have_no_spans(self):
+        assert to_spans({"path": "/", "duration": 1.0, "timings": []}) == []
+
+    def test_unsampled_traces_have_no_spans(self):
+        assert to_spans(record(trace_flags="00")) == []
+        assert len(to_spans(record(trace_flags="03"))) == 2
+
+
+class TestOTLPSink:
+    def test_sends_batches_with_spans(self):
+        payloads = []
+        sink = OTLPSink(payloads.append, service_name="procedures")
+
+        sink.write([{"path": "/", "duration": 1.0, "timings": []}])
+        sink.write([record(), record()])
+
+        (payload,) = payloads
+        (resource_spans,) = payload["resourceSpans"]
+        assert resource_spans["resource"]["attributes"] == [
+            {"key": "service.name", "value": {"stringValue": "procedures"}}
+        ]
+        (scope_spans,) = resource_spans["scopeSpans"]
+        assert scope_spans["scope"]["name"] == "server-timings"
+        assert len(scope_spans["spans"]) == 4
+
+    def test_file_sink(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        exporter = Exporter([OTLPFileSink(str(path))])
+        exporter.export(record())
+        exporter.close()
+
+        (line,) = path.read_text().splitlines()
+        spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert [span["name"] for span in spans] == ["/items/{pk}", "db"]
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from timings.models import ServerTimings
+from timings.profiler import StackSampler
+
+
+@pytest.fixture
+def sampler(tmp_path):
+    sampler = StackSampler(
+        interval=0.002, slow_threshold_ms=50.0, directory=str(tmp_path)
+    )
+    ServerTimings.profiler = sampler
+    yield sampler
+    ServerTimings.profiler = None
+    sampler.close()
+
+
+def sleepy_view():
+    time.sleep(0.1)
+
+
+def busy_view(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def read_profile(sampler, request_id):
+    with open(f"{sampler.directory}/{request_id}.collapsed") as file:
+        return file.read().splitlines()
+
+
+class TestStackSampler:
+    def test_writes_profiles_of_slow_sync_requests(self, sampler):
+        ServerTimings.setUp("sync")
+        request_id = ServerTimings().request_id
+        sleepy_view()
+        ServerTimings.tearDown()
+        sampler.close()
+
+        lines = read_profile(sampler, request_id)
+        assert any("sleepy_view (" in line for line in lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack.count(";") > 0
+
+    def test_discards_fast_requests(self, sampler):
+        ServerTimings.setUp("sync")
+        ServerTimings.tearDown()
+        sampler.close()
+
+        assert sampler.written == 0
+
+    def test_nested_sync_requests(self, sampler):
+        outer = sampler.start(SimpleNamespace(request_id="outer"))
+        inner = sampler.start(SimpleNamespace(request_id="inner"))
+        sleepy_view()
+        inner.stop()
+        sleepy_view()
+        outer.stop()
+        sampler.close()
+
+        assert sampler.written == 2
+        assert len(outer.samples) > len(inner.samples) > 0
+        assert any("sleepy_view (" in line for line in read_profile(sampler, "outer"))
+
+    def test_profiles_async_requests_by_task(self, sampler):
+        async def request(seconds):
+            ServerTimings.setUp("async")
+            request_id = ServerTimings().request_id
+            if seconds > 0.05:
+                # Let the fast request run meanwhile
+                await asyncio.sleep(0)
+            busy_view(seconds)
+            ServerTimings.tearDown()
+            return request_id
+
+        async def main():
+            return await asyncio.gather(request(0.1), request(0.01))
+
+        slow, fast = asyncio.run(main())
+        sampler.close()
+
+        lines = read_profile(sampler, slow)
+        assert all("request (" in line for line in lines)
+        assert any("busy_view (" in line for line in lines)
+        assert sampler.written == 1
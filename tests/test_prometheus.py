@@ -0,0 +1,131 @@
+import multiprocessing
+
+import pytest
+
+from timings.prometheus import (
+    METRIC_FAMILY,
+    REQUEST_FAMILY,
+    AggregateTable,
+    PrometheusAggregates,
+    read_table,
+)
+
+
+def record(route, duration, **metrics):
+    return {
+        "path": "/",
+        "route": route,
+        "duration": duration,
+        "timings": [
+            {"name": name, "duration": value, "description": None}
+            for name, value in metrics.items()
+        ],
+    }
+
+
+def write_in_child(directory):
+    PrometheusAggregates(directory).write([record("/child", 20.0, db=2.0)])
+
+
+class TestAggregateTable:
+    def test_add_and_grow(self, tmp_path):
+        path = str(tmp_path / "table.db")
+        table = AggregateTable(2, path, initial_size=64)
+        for i in range(100):
+            table.add(f"key-{i}", [1.0, float(i)])
+        table.add("key-1", [1.0, 1.0])
+
+        entries = read_table(path)
+        assert len(entries) == 100
+        assert entries["key-1"] == (2.0, 2.0)
+        assert entries["key-99"] == (1.0, 99.0)
+
+    def test_reopen_keeps_entries(self, tmp_path):
+        path = str(tmp_path / "table.db")
+        AggregateTable(1, path).add("a", [1.0])
+        table = AggregateTable(1, path)
+        table.add("a", [1.0])
+
+        assert table.items() == {"a": (2.0,)}
+
+    def test_anonymous(self):
+        table = AggregateTable(1, initial_size=32)
+        table.add("a", [1.0])
+        table.add("b", [2.0])
+
+        assert table.items() == {"a": (1.0,), "b": (2.0,)}
+
+
+class TestPrometheusAggregates:
+    def test_render(self):
+        aggregates = PrometheusAggregates(buckets=(0.01, 0.1))
+        aggregates.write(
+            [
+                record("/api/<int:pk>", 50.0, db=5.0),
+                record("/api/<int:pk>", 500.0, db=5.0),
+            ]
+        )
+
+        text = aggregates.render()
+
+        assert f"# TYPE {REQUEST_FAMILY} histogram\n" in text
+        assert f'{REQUEST_FAMILY}_bucket{{route="/api/<int:pk>",le="0.01"}} 0\n' in text
+        assert f'{REQUEST_FAMILY}_bucket{{route="/api/<int:pk>",le="0.1"}} 1\n' in text
+        assert f'{REQUEST_FAMILY}_bucket{{route="/api/<int:pk>",le="+Inf"}} 2\n' in text
+        assert f'{REQUEST_FAMILY}_count{{route="/api/<int:pk>"}} 2\n' in text
+        assert f'{REQUEST_FAMILY}_sum{{route="/api/<int:pk>"}} 0.55\n' in text
+        assert (
+            f'{METRIC_FAMILY}_bucket{{route="/api/<int:pk>",name="db",le="0.01"}} 2\n'
+            in text
+        )
+        assert text.endswith("# EOF\n")
+
+    def test_escapes_labels(self):
+        aggregates = PrometheusAggregates()
+        aggregates.write([record('/a"b\\', 1.0)])
+
+        assert 'route="/a\\"b\\\\"' in aggregates.render()
+
+    @pytest.mark.skipif(
+        "fork" not in multiprocessing.get_all_start_methods(), reason="requires fork"
+    )
+    def test_merges_processes(self, tmp_path):
+        directory = str(tmp_path)
+        aggregates = PrometheusAggregates(directory)
+        aggregates.write([record("/child", 10.0, db=1.0)])
+
+        context = multiprocessing.get_context("fork")
+        for _ in range(2):
+            process = context.Process(target=write_in_child, args=(directory,))
+            process.start()
+            process.join()
+
+        text = aggregates.render()
+        assert len(list(tmp_path.glob("server_timings_*.db"))) == 3
+        assert f'{REQUEST_FAMILY}_count{{route="/child"}} 3\n' in text
+        assert f'{METRIC_FAMILY}_sum{{route="/child",name="db"}} 0.005\n' in text
+
+    def test_numbered_db_metrics_are_one_series(self):
+        aggregates = PrometheusAggregates()
+        aggregates.write([record("/", 10.0, db_1=1.0, db_2=2.0, db_3=3.0)])
+
+        text = aggregates.render()
+        assert f'{METRIC_FAMILY}_count{{route="/",name="db"}} 3\n' in text
+        assert "db_1" not in text
+
+    def test_series_are_bounded(self):
+        aggregates = PrometheusAggregates(max_series=2)
+        aggregates.write([record("/a", 1.0, db=1.0)])
+        aggregates.write([record(f"/route-{i}", 1.0, db=1.0) for i in range(5)])
+
+        collected = aggregates.collect()
+        assert len(collected) == 4
+        text = aggregates.render()
+        assert f'{REQUEST_FAMILY}_count{{route="<other>"}} 5\n' in text
+        assert f'{METRIC_FAMILY}_count{{route="<other>",name="<other>"}} 5\n' in text
+
+    def test_metrics_without_duration_are_skipped(self):
+        aggregates = PrometheusAggregates()
+        aggregates.write([record("/", 10.0, db=1.0, alloc=None)])
+
+        assert "alloc" not in aggregates.render()
@@ -0,0 +1,179 @@
+import pytest
+
+from timings import timed_metric
+from timings.exporters import CallableSink, Exporter
+from timings.models import ServerTimingMetric, ServerTimings
+from timings.propagation import (
+    TimingContext,
+    TimingProcessPoolExecutor,
+    TimingThreadPoolExecutor,
+    WorkerTimings,
+    capture,
+)
+
+
+def render_pdf(pages):
+    ServerTimingMetric("render", duration=float(pages))
+    return f"{pages} pages"
+
+
+class TestCapture:
+    def test_outside_requests(self):
+        assert capture() is None
+
+    def test_assigns_request_id(self, timings):
+        with timed_metric("service"):
+            context = capture()
+
+        assert context.request_id == timings.request_id
+        assert len(context.request_id) == 32
+        assert context.parent == "service"
+        assert capture().request_id == context.request_id
+
+
+class TestWorkerTimings:
+    def test_record(self):
+        context = TimingContext("abc", "service")
+
+        with WorkerTimings(context, "send_mail") as worker:
+            ServerTimingMetric("smtp", duration=2.0)
+
+        record = worker.record
+        assert record["request_id"] == "abc"
+        assert record["parent"] == "service"
+        assert record["route"] == "send_mail"
+        assert [m["name"] for m in record["timings"]] == ["send_mail", "smtp"]
+        assert ServerTimings().metrics == []
+
+    def test_propagates_trace(self, timings):
+        from timings.tracecontext import parse_traceparent
+
+        timings.trace = parse_traceparent(
+            "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        )
+        context = capture()
+        assert context.traceparent == timings.trace.traceparent
+
+        with WorkerTimings(context, "send_mail") as worker:
+            pass
+
+        record = worker.record
+        assert record["trace_id"] == timings.trace.trace_id
+        assert record["parent_span_id"] == timings.trace.span_id
+        assert record["span_id"] != timings.trace.span_id
+
+    def test_restores_request(self, timings):
+        with WorkerTimings(None, "inline"):
+            ServerTimingMetric("inner", duration=1.0)
+
+        assert ServerTimings() is timings
+        assert timings.metrics == []
+
+
+class TestExecutors:
+    def test_thread_pool_records_into_request(self, timings):
+        with TimingThreadPoolExecutor(max_workers=2) as pool:
+            with timed_metric("batch") as batch:
+                results = list(pool.map(render_pdf, [1, 2, 3]))
+
+        assert results == ["1 pages", "2 pages", "3 pages"]
+        renders = [m for m in timings.metrics if m.name == "render"]
+        assert sorted(m.duration for m in renders) == [1.0, 2.0, 3.0]
+        assert all(m.parent is batch for m in renders)
+
+    def test_process_pool_exports_records(self, timings):
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+
+        with TimingProcessPoolExecutor(max_workers=1, exporter=exporter) as pool:
+            assert pool.submit(render_pdf, 4).result() == "4 pages"
+        exporter.close()
+
+        assert len(records) == 1
+        assert records[0]["request_id"] == timings.request_id
+        assert records[0]["route"] == "render_pdf"
+        assert records[0]["timings"][1]["duration"] == 4.0
+
+    def test_process_pool_propagates_exceptions(self, timings):
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+
+        with TimingProcessPoolExecutor(max_workers=1, exporter=exporter) as pool:
+            future = pool.submit(int, "not a number")
+            with pytest.raises(ValueError):
+                future.result()
+        exporter.close()
+
+        assert [record["route"] for record in records] == ["int"]
+        assert records[0]["request_id"] == timings.request_id
+
+
+class FakeTaskRequest(dict):
+    """The ``request`` of a Celery task, with the message headers in ``headers``."""
+
+    def __init__(self, headers=None, **fields):
+        super().__init__(fields)
+        self.headers = headers
+
+
+class TestCelery:
+    def test_handlers(self, timings):
+        from types import SimpleNamespace
+
+        from timings.celery.signals import HEADER, _handlers
+
+        records = []
+        exporter = Exporter([CallableSink(records.extend)])
+        before_task_publish, task_prerun, task_postrun = _handlers(exporter)
+        headers = {}
+        before_task_publish(headers=headers, sender="send_mail")
+        assert headers[HEADER]["request_id"] == timings.request_id
+
+        # The header is a field of the request, or among its message headers
+        for request in (
+            FakeTaskRequest(**{HEADER: headers[HEADER]}),
+            FakeTaskRequest(headers=headers),
+        ):
+            task = SimpleNamespace(name="send_mail", request=request)
+            task_prerun(task_id="1", task=task, sender=task)
+            ServerTimingMetric("smtp", duration=2.0)
+            task_postrun(task_id="1", task=task, sender=task)
+        # A task published outside of requests, and a stray postrun
+        task = SimpleNamespace(name="cleanup", request=FakeTaskRequest())
+        task_prerun(task_id="2", task=task)
+        task_postrun(task_id="2", task=task)
+        task_postrun(task_id="3")
+        exporter.flush()
+
+        assert [record["request_id"] for record in records[:2]] == [
+            timings.request_id,
+            timings.request_id,
+        ]
+        assert [m["name"] for m in records[0]["timings"]] == ["send_mail", "smtp"]
+        assert records[2]["route"] == "cleanup"
+        assert len(records) == 3
+
+    def test_signals(self, timings):
+        celery = pytest.importorskip("celery")
+        from timings.celery.signals import HEADER, connect
+
+        app = celery.Celery()
+
+        @app.task
+        def send_mail():
+            ServerTimingMetric("smtp", duration=2.0)
+
+        records = []
+        exporter = connect(Exporter([CallableSink(records.extend)]))
+        headers = {}
+        celery.signals.before_task_publish.send(sender="send_mail", headers=headers)
+
+        send_mail.push_request(**{HEADER: headers[HEADER]})
+        celery.signals.task_prerun.send(sender=send_mail, task_id="1", task=send_mail)
+        send_mail.run()
+        celery.signals.task_postrun.send(sender=send_mail, task_id="1", task=send_mail)
+        send_mail.pop_request()
+        exporter.flush()
+
+        assert records[0]["request_id"] == timings.request_id
+        assert [m["name"] for m in records[0]["timings"]] == [send_mail.name, "smtp"]
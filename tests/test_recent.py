@@ -0,0 +1,187 @@
+import json
+import multiprocessing
+from itertools import count
+
+import pytest
+
+from timings.recent import RecentRequests, RequestRing, read_ring
+
+
+def record(route, duration, status=200, **metrics):
+    return {
+        "path": "/",
+        "route": route,
+        "status": status,
+        "duration": duration,
+        "request_id": "a" * 32,
+        "timings": [
+            {"name": name, "duration": value, "description": None}
+            for name, value in metrics.items()
+        ],
+    }
+
+
+def write_in_child(directory, written, done):
+    RecentRequests(directory=directory).write([record("/child", 20.0, db=2.0)])
+    written.set()
+    done.wait(10)
+
+
+class TestRequestRing:
+    def test_keeps_the_last_requests(self):
+        ring = RequestRing(capacity=3, max_metrics=2)
+        for i in range(5):
+            ring.append(record(f"/{i}", float(i), db=1.0), timestamp=float(i))
+
+        requests = sorted(ring.requests())
+        assert [request.route for request in requests] == ["/2", "/3", "/4"]
+        assert requests[0].timings == (("db", 1.0),)
+        assert requests[0].status == 200
+        assert requests[0].request_id == "a" * 32
+
+    def test_truncates(self):
+        ring = RequestRing(capacity=1, max_metrics=2)
+        ring.append(
+            {
+                "path": "/ä" * 200,
+                "route": None,
+                "duration": None,
+                "timings": [
+                    {"name": "n" * 40, "duration": None, "description": None},
+                    {"name": "b", "duration": 1.0, "description": None},
+                    {"name": "c", "duration": 1.0, "description": None},
+                ],
+            },
+            timestamp=0.0,
+        )
+
+        (request,) = ring.requests()
+        assert len(request.path.encode()) <= 192
+        assert request.route is None
+        assert request.status is None
+        assert request.duration is None
+        assert request.timings == (("n" * 32, None), ("b", 1.0))
+
+    def test_reopen_keeps_requests(self, tmp_path):
+        path = str(tmp_path / "ring.db")
+        RequestRing(2, 1, path).append(record("/a", 1.0), timestamp=0.0)
+        ring = RequestRing(2, 1, path)
+        ring.append(record("/b", 1.0), timestamp=1.0)
+
+        assert sorted(request.route for request in read_ring(path)) == ["/a", "/b"]
+
+    def test_skips_slots_being_written(self):
+        from timings.recent import _HEADER, _SEQUENCE
+
+        ring = RequestRing(capacity=1, max_metrics=1)
+        ring.append(record("/a", 1.0), timestamp=0.0)
+        # A reader seeing the next request's start of the slot, but not yet its end
+        _SEQUENCE.pack_into(ring._map, _HEADER.size, 2)
+
+        assert ring.requests() == []
+
+    def test_rereads_slots_written_during_the_copy(self):
+        from timings.recent import _HEADER, _SEQUENCE, _requests
+
+        ring = RequestRing(capacity=1, max_metrics=1)
+        ring.append(record("/a", 1.0), timestamp=0.0)
+
+        class Interleaved:
+            """The slot as a reader sees it with a write starting after its copy."""
+
+            def __init__(self, finish):
+                self.finish = finish
+                self.copies = 0
+
+            def __getitem__(self, key):
+                data = ring._map[key]
+                if key.stop - key.start > _SEQUENCE.size:
+                    self.copies += 1
+                    if self.copies == 1 and self.finish:
+                        ring.append(record("/b", 2.0), timestamp=1.0)
+                    elif not self.finish:
+                        # The writer has only cleared the leading sequence number
+                        _SEQUENCE.pack_into(ring._map, _HEADER.size, 0)
+                return data
+
+        # The copy of /a is torn by the write of /b, which is read on the retry
+        interleaved = Interleaved(finish=True)
+        (request,) = _requests(interleaved, ring.capacity, ring.max_metrics)
+        assert request.route == "/b"
+        assert interleaved.copies == 2
+
+        # A write that does not finish while the reader retries is skipped
+        interleaved = Interleaved(finish=False)
+        assert _requests(interleaved, ring.capacity, ring.max_metrics) == []
+        assert interleaved.copies == 3
+
+
+class TestRecentRequests:
+    @pytest.fixture
+    def recent(self):
+        clock = count()
+        recent = RecentRequests(capacity=10, clock=lambda: float(next(clock)))
+        recent.write([record("/a", 10.0, db=5.0)])
+        recent.write([record("/b", 30.0, db=1.0)])
+        recent.write([record("/a", 20.0, cache=1.0)])
+        recent.write([record("/a", 5.0, db=2.0, **{"db ": 0.0})])
+        return recent
+
+    def test_newest_first(self, recent):
+        durations = [request.duration for request in recent.requests()]
+        assert durations == [5.0, 20.0, 30.0, 10.0]
+
+    def test_slowest_by_route(self, recent):
+        durations = [request.duration for request in recent.slowest(2, route="/a")]
+        assert durations == [20.0, 10.0]
+
+    def test_query_by_metric(self, recent):
+        requests = recent.query(metric="db", min_duration=2.0, slowest=True)
+        assert [request.duration for request in requests] == [10.0, 5.0]
+
+        requests = recent.query(min_duration=20.0)
+        assert [request.duration for request in requests] == [20.0, 30.0]
+
+    def test_render(self, recent):
+        body = json.loads(recent.render({"order": "slowest", "limit": "1"}))
+
+        (request,) = body["requests"]
+        assert request["route"] == "/b"
+        assert request["status"] == 200
+        assert request["timings"] == [{"name": "db", "duration": 1.0}]
+        with pytest.raises(ValueError):
+            recent.render({"order": "fastest"})
+
+    def test_render_limit(self, recent):
+        body = json.loads(recent.render({"limit": "1000"}))
+        assert len(body["requests"]) == 4
+
+        for limit in ("0", "-1", "many"):
+            with pytest.raises(ValueError):
+                recent.render({"limit": limit})
+
+    @pytest.mark.skipif(
+        "fork" not in multiprocessing.get_all_start_methods(), reason="requires fork"
+    )
+    def test_merges_processes(self, tmp_path):
+        directory = str(tmp_path)
+        recent = RecentRequests(directory=directory)
+        recent.write([record("/parent", 10.0)])
+
+        context = multiprocessing.get_context("fork")
+        written, done = context.Event(), context.Event()
+        process = context.Process(
+            target=write_in_child, args=(directory, written, done)
+        )
+        process.start()
+        try:
+            assert written.wait(10)
+            assert len(list(tmp_path.glob("recent_requests_*.db"))) == 2
+            routes = sorted(request.route for request in recent.requests())
+            assert routes == ["/child", "/parent"]
+        finally:
+            done.set()
+            process.join()
+
+        # The files of processes that exited are skipped
+        assert [request.route for request in recent.requests()] == ["/parent"]
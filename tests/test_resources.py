@@ -0,0 +1,78 @@
+import contextvars
+import gc
+import tracemalloc
+
+from timings.resources import ResourceInstrument
+
+
+def metrics(timings):
+    return {metric.name: metric for metric in timings.metrics}
+
+
+class TestResourceInstrument:
+    def test_cpu_and_gc(self, timings):
+        instrument = ResourceInstrument()
+        instrument.start(timings)
+        sum(i * i for i in range(200_000))
+        gc.collect()
+        instrument.finish()
+
+        reported = metrics(timings)
+        assert reported["cpu"].duration > 0
+        assert reported["cpu"].description is None
+        assert reported["gc"].description.endswith(" collections")
+        assert "alloc" not in reported
+
+    def test_gc_outside_requests_is_not_attributed(self, timings):
+        instrument = ResourceInstrument(cpu=False)
+        gc.collect()
+        instrument.start(timings)
+        instrument.finish()
+
+        assert timings.metrics == []
+
+    def test_sampled_allocations(self, timings):
+        instrument = ResourceInstrument(cpu=False, gc=False, memory_sample_rate=1.0)
+        instrument.start(timings)
+        assert tracemalloc.is_tracing()
+        data = [bytes(1024) for _ in range(100)]
+        instrument.finish()
+
+        assert not tracemalloc.is_tracing()
+        description = metrics(timings)["alloc"].description
+        net, peak = (float(part.split()[1]) for part in description.split(", "))
+        assert net >= 100
+        assert peak >= net
+        assert str(timings.metrics[0]).startswith('alloc;desc="net ')
+        del data
+
+    def test_allocations_not_sampled(self, timings):
+        instrument = ResourceInstrument(memory_sample_rate=0.5, rng=lambda: 0.9)
+        instrument.start(timings)
+        instrument.finish()
+
+        assert "alloc" not in metrics(timings)
+
+    def test_instruments_keep_their_own_usage(self, timings):
+        cpu = ResourceInstrument(gc=False)
+        gc_pauses = ResourceInstrument(cpu=False)
+        cpu.start(timings)
+        gc_pauses.start(timings)
+        gc.collect()
+        gc_pauses.finish()
+        cpu.finish()
+
+        assert sorted(metrics(timings)) == ["cpu", "gc"]
+
+    def test_one_request_traces_allocations_at_a_time(self, timings):
+        instrument = ResourceInstrument(cpu=False, gc=False, memory_sample_rate=1.0)
+        instrument.start(timings)
+        # A concurrent request, which does not reset the peak of the traced one
+        other = contextvars.copy_context()
+        other.run(instrument.start, timings)
+        other.run(instrument.finish)
+        assert tracemalloc.is_tracing()
+        instrument.finish()
+
+        assert not tracemalloc.is_tracing()
+        assert [metric.name for metric in timings.metrics] == ["alloc"]
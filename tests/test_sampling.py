@@ -0,0 +1,45 @@
+from timings.sampling import SamplingPolicy, unsampled_record
+
+
+class TestSamplingPolicy:
+    def test_rate(self):
+        policy = SamplingPolicy(rate=0.25, rng=iter([0.1, 0.3]).__next__)
+
+        assert policy.should_sample("/")
+        assert not policy.should_sample("/")
+
+    def test_path_rates_longest_prefix_wins(self):
+        policy = SamplingPolicy(
+            rate=0.0, path_rates={"/api": 1.0, "/api/health": 0.0}, rng=lambda: 0.5
+        )
+
+        assert policy.should_sample("/api/procedures")
+        assert not policy.should_sample("/api/health")
+        assert not policy.should_sample("/admin")
+
+    def test_trigger_always_samples(self):
+        policy = SamplingPolicy(rate=0.0)
+
+        assert policy.should_sample("/", header="1")
+        assert policy.should_sample("/", cookie="1")
+        assert not policy.should_sample("/", header="")
+
+    def test_triggers_are_opt_in(self):
+        policy = SamplingPolicy()
+
+        assert policy.trigger_header is None
+        assert policy.trigger_cookie is None
+
+    def test_is_slow(self):
+        assert not SamplingPolicy().is_slow(10_000.0)
+        assert SamplingPolicy(slow_threshold_ms=500).is_slow(500.0)
+        assert not SamplingPolicy(slow_threshold_ms=500).is_slow(499.0)
+
+
+def test_unsampled_record():
+    record = unsampled_record("/items/1", "/items/<pk>", 200, 12.5)
+
+    assert record["route"] == "/items/<pk>"
+    assert record["duration"] == 12.5
+    assert [metric["name"] for metric in record["timings"]] == ["request"]
+    assert record["timings"][0]["duration"] == 12.5
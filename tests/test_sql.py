@@ -0,0 +1,143 @@
+import pytest
+
+from timings.sql import QueryAggregator, _analyse, fingerprint, normalize
+
+from .benchmark import measure, report
+
+ORM_SELECT = (
+    'SELECT "app_procedure"."id", "app_procedure"."name", "app_procedure"."created", '
+    '"app_user"."id", "app_user"."email" FROM "app_procedure" '
+    'INNER JOIN "app_user" ON ("app_procedure"."owner_id" = "app_user"."id") '
+    'WHERE ("app_procedure"."state" = %s AND "app_procedure"."id" IN (%s, %s, %s)) '
+    'ORDER BY "app_procedure"."created" DESC LIMIT 21'
+)
+
+
+class TestFingerprint:
+    @pytest.mark.parametrize(
+        ("sql", "operation", "table"),
+        [
+            (ORM_SELECT, "SELECT", "'app_procedure'"),
+            ('INSERT INTO "app_user" ("email") VALUES (%s)', "INSERT", "'app_user'"),
+            (
+                'UPDATE "app_user" SET "email" = %s WHERE "id" = %s',
+                "UPDATE",
+                "'app_user'",
+            ),
+            (
+                'DELETE FROM "app_user" WHERE "app_user"."id" = %s',
+                "DELETE",
+                "'app_user'",
+            ),
+            ("UPDATE OR IGNORE app_user SET email = ?", "UPDATE", "app_user"),
+            ('SELECT "a"."x" FROM "public"."app_a" "a"', "SELECT", "'public'.'app_a'"),
+            ('SAVEPOINT "s140_x1"', "SAVEPOINT", "'s140_x1'"),
+        ],
+    )
+    def test_operation_and_table(self, sql, operation, table):
+        result = fingerprint(sql)
+
+        assert result.operation == operation
+        assert result.table == table
+        assert result.description == f"DB: {operation} {table}"
+
+    def test_joins(self):
+        assert fingerprint(ORM_SELECT).tables == ("'app_procedure'", "'app_user'")
+
+    def test_subquery_in_from(self):
+        sql = (
+            'SELECT COUNT(*) FROM (SELECT DISTINCT "app_a"."id" AS "col1" '
+            'FROM "app_a" WHERE "app_a"."x" = %s) subquery'
+        )
+        assert fingerprint(sql).table == "'app_a'"
+
+    def test_subquery_in_where_and_select_list(self):
+        sql = (
+            'SELECT (SELECT MAX("b"."id") FROM "b") AS "m" FROM "a" '
+            'WHERE "a"."id" IN (SELECT "c"."a_id" FROM "c")'
+        )
+        assert fingerprint(sql).tables == ("'a'",)
+
+    def test_cte(self):
+        sql = (
+            'WITH "recent" AS (SELECT "id" FROM "app_log" WHERE "ts" > %s) '
+            'DELETE FROM "app_entry" WHERE "log_id" IN (SELECT "id" FROM "recent")'
+        )
+        result = fingerprint(sql)
+
+        assert result.operation == "DELETE"
+        assert result.table == "'app_entry'"
+
+    def test_ignores_keywords_in_literals_and_comments(self):
+        sql = "SELECT a FROM b WHERE c = 'FROM x' /* FROM y */ -- FROM z"
+        assert fingerprint(sql).table == "b"
+
+    def test_templates_group_parameter_variants(self):
+        assert normalize("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'") == (
+            "SELECT * FROM t WHERE id IN (...) AND name = ?"
+        )
+        assert normalize("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)") == (
+            "INSERT INTO t (a, b) VALUES (...)"
+        )
+        assert (
+            fingerprint("SELECT * FROM t WHERE id = 1").template
+            == fingerprint("SELECT * FROM t WHERE id = 2").template
+        )
+
+    def test_is_cached(self):
+        fingerprint.cache_clear()
+        fingerprint(ORM_SELECT)
+        fingerprint(ORM_SELECT)
+
+        assert fingerprint.cache_info().hits == 1
+
+
+class TestFingerprintBenchmark:
+    def test_faster_than_sqlparse(self):
+        sqlparse = pytest.importorskip("sqlparse")
+
+        def sqlparse_execution_info(sql):
+            # The previous DBQueryInstrument.execution_info
+            parsed = sqlparse.parse(sql)[0]
+            tokens = [token for token in parsed.tokens if not token.is_whitespace]
+            operation = tokens[0].value.upper()
+            for i, token in enumerate(tokens):
+                if token.ttype == sqlparse.tokens.Keyword and token.value == "FROM":
+                    return "DB: " + operation + " " + str(tokens[i + 1].value)
+            return "DB: " + operation
+
+        def uncached(sql):
+            _analyse.__wrapped__(normalize(sql))
+
+        results = {
+            "sqlparse": measure(sqlparse_execution_info, ORM_SELECT, number=50),
+            "fingerprint (uncached)": measure(uncached, ORM_SELECT, number=200),
+            "fingerprint (cached)": measure(fingerprint, ORM_SELECT),
+        }
+        report("execution_info", results)
+
+        assert results["fingerprint (uncached)"] < results["sqlparse"]
+        assert results["fingerprint (cached)"] < results["fingerprint (uncached)"]
+
+
+class TestQueryAggregator:
+    def test_group_statistics(self):
+        aggregator = QueryAggregator()
+        for duration in (1.0, 2.0, 3.0, 4.0):
+            aggregator.record("SELECT * FROM t WHERE id = %s", duration)
+        aggregator.record("SELECT * FROM u", 10.0)
+
+        group = aggregator.groups["SELECT * FROM t WHERE id = ?"]
+        assert (group.count, group.total, group.min, group.max) == (4, 10.0, 1.0, 4.0)
+        assert group.p95 == 4.0
+        assert aggregator.duplicates == []
+
+    def test_duplicates_capture_call_site(self):
+        aggregator = QueryAggregator(duplicate_threshold=3)
+        for i in range(3):
+            aggregator.record(f"SELECT * FROM t WHERE id = {i}", 1.0)
+
+        (group,) = aggregator.duplicates
+        assert group.count == 3
+        assert group.callsite.startswith("tests.test_sql:")
+        assert group.callsite.endswith("(test_duplicates_capture_call_site)")
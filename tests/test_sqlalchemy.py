@@ -0,0 +1,130 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from timings.sqlalchemy.instruments import SQLAlchemyInstrument
+
+QUERY = text("SELECT name FROM sqlite_master WHERE type = :type")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    yield engine
+    engine.dispose()
+
+
+def header_names(timings):
+    return [metric.name for metric in timings.metrics]
+
+
+class TestSQLAlchemyInstrument:
+    def test_per_query(self, engine, timings):
+        instrument = SQLAlchemyInstrument(engine)
+        instrument.start(timings)
+        with engine.connect() as connection:
+            connection.execute(QUERY, {"type": "table"})
+        instrument.finish()
+
+        assert header_names(timings) == ["db_1"]
+        assert timings.metrics[0].description == "DB: SELECT sqlite_master"
+        assert timings.metrics[0]._duration is not None
+
+    def test_aggregated_with_duplicates(self, engine, timings):
+        instrument = SQLAlchemyInstrument(engine, mode="aggregated")
+        instrument.start(timings)
+        with engine.connect() as connection:
+            for _ in range(6):
+                connection.execute(QUERY, {"type": "table"})
+        instrument.finish()
+
+        assert header_names(timings) == ["db-group", "db-dup"]
+        assert "x6 (min=" in timings.metrics[0].description
+        assert "(test_aggregated_with_duplicates)" in timings.metrics[1].description
+
+    def test_failed_queries_end_their_metric(self, engine, timings):
+        instrument = SQLAlchemyInstrument(engine)
+        instrument.start(timings)
+        with engine.connect() as connection, pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM missing"))
+        instrument.finish()
+
+        assert timings.metrics[0]._duration is not None
+
+    def test_not_timed_outside_requests(self, engine, timings):
+        instrument = SQLAlchemyInstrument(engine)
+        with engine.connect() as connection:
+            connection.execute(QUERY, {"type": "table"})
+        instrument.start(timings)
+        instrument.finish()
+        instrument.remove()
+
+        assert timings.metrics == []
+
+    def test_invalid_mode(self, engine):
+        with pytest.raises(ValueError, match="Mode must be one of"):
+            SQLAlchemyInstrument(engine, mode="all")
+
+
+class TestIntegrations:
+    def test_flask(self, engine):
+        flask = pytest.importorskip("flask")
+        from timings.flask.extension import ServerTimingsExtension
+
+        app = flask.Flask(__name__)
+        app.config["SERVER_TIMINGS_INSTRUMENTS"] = [
+            SQLAlchemyInstrument(engine, mode="both")
+        ]
+        ServerTimingsExtension(app)
+
+        @app.route("/")
+        def root():
+            with engine.connect() as connection:
+                connection.execute(QUERY, {"type": "table"})
+            return {}
+
+        with app.test_client() as client:
+            header_value = client.get("/").headers["Server-Timing"]
+
+        assert 'db_1;desc="DB: SELECT sqlite_master";dur=' in header_value
+        assert "db-group;" in header_value
+
+    @pytest.mark.asyncio
+    async def test_fastapi_async_engine(self):
+        pytest.importorskip("aiosqlite")
+        pytest.importorskip("fastapi")
+        from fastapi import FastAPI
+        from httpx import ASGITransport, AsyncClient
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        from timings.fastapi.middleware import FastAPIServerTimingMiddleware
+
+        engine = create_async_engine("sqlite+aiosqlite://")
+        app = FastAPI()
+        app.add_middleware(
+            FastAPIServerTimingMiddleware,
+            instruments=[SQLAlchemyInstrument(engine, mode="both")],
+        )
+
+        @app.get("/")
+        async def root():
+            async with engine.connect() as connection:
+                for _ in range(2):
+                    await connection.execute(QUERY, {"type": "table"})
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            responses = [await client.get("/") for _ in range(2)]
+        await engine.dispose()
+
+        for response in responses:
+            header_value = response.headers["Server-Timing"]
+            assert "db_1;" in header_value
+            assert "db_2;" in header_value
+            assert "db_3;" not in header_value
+            assert "x2 (min=" in header_value
@@ -0,0 +1,94 @@
+import pytest
+
+from timings.header import render_header
+from timings.models import ServerTimingMetric, ServerTimings
+from timings.tracecontext import header_entry, parse_traceparent, record_fields
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+class TestParseTraceparent:
+    def test_valid(self):
+        trace = parse_traceparent(TRACEPARENT)
+
+        assert trace.trace_id == TRACE_ID
+        assert trace.parent_id == "00f067aa0ba902b7"
+        assert len(trace.span_id) == 16
+        assert trace.span_id != trace.parent_id
+        assert trace.sampled
+        assert trace.traceparent == f"00-{TRACE_ID}-{trace.span_id}-01"
+
+    def test_future_versions_may_have_more_fields(self):
+        trace = parse_traceparent(f"01-{TRACE_ID}-00f067aa0ba902b7-00-extra")
+
+        assert trace.trace_id == TRACE_ID
+        assert not trace.sampled
+        assert trace.traceparent.startswith("00-")
+
+    @pytest.mark.parametrize(
+        "value",
+        [
+            None,
+            "",
+            "garbage",
+            f"00-{TRACE_ID}-00f067aa0ba902b7-01-extra",
+            f"ff-{TRACE_ID}-00f067aa0ba902b7-01",
+            f"00-{'0' * 32}-00f067aa0ba902b7-01",
+            f"00-{TRACE_ID}-{'0' * 16}-01",
+            f"00-{TRACE_ID.upper()}-00f067aa0ba902b7-01",
+            f"00-{TRACE_ID}-00f067aa0ba902b-01",
+        ],
+    )
+    def test_invalid(self, value):
+        assert parse_traceparent(value) is None
+
+
+class TestHeader:
+    def test_traceparent_entry_leads(self):
+        trace = parse_traceparent(TRACEPARENT)
+        entry = header_entry(trace)
+
+        assert entry == f'traceparent;desc="{trace.traceparent}";'
+        assert render_header([], leading=entry) == entry
+        metric = ServerTimingMetric("db", duration=1.0)
+        assert render_header([metric], leading=entry) == f"{entry}, db;dur=1.00;"
+
+    def test_traceparent_counts_against_budget(self):
+        entry = header_entry(parse_traceparent(TRACEPARENT))
+        metric = ServerTimingMetric("db", duration=1.0)
+
+        header = render_header([metric], max_bytes=len(entry) + 2 + 12, leading=entry)
+        assert header == f"{entry}, db;dur=1.00;"
+        long = ServerTimingMetric("db", description="select" * 10, duration=1.0)
+        header = render_header([long], max_bytes=len(entry) + 2 + 24, leading=entry)
+        assert header == f'{entry}, truncated;desc="1 more";'
+        header = render_header([metric], max_bytes=len(entry) + 2, leading=entry)
+        assert header == entry
+
+    def test_traceparent_dropped_past_budget(self):
+        entry = header_entry(parse_traceparent(TRACEPARENT))
+        metric = ServerTimingMetric("db", duration=1.0)
+
+        assert render_header([metric], max_bytes=len(entry) - 1, leading=entry) == (
+            "db;dur=1.00;"
+        )
+        assert render_header([], max_bytes=len(entry), leading=entry) == entry
+
+
+def test_record_fields():
+    ServerTimings.setUp("sync")
+    try:
+        timings = ServerTimings()
+        assert record_fields(timings) == {}
+
+        timings.trace = parse_traceparent(TRACEPARENT)
+        assert record_fields(timings) == {
+            "trace_id": TRACE_ID,
+            "span_id": timings.trace.span_id,
+            "parent_span_id": "00f067aa0ba902b7",
+            "trace_flags": "01",
+            "start_time": timings.started_at,
+        }
+    finally:
+        ServerTimings.tearDown()
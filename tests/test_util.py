@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from timings import timed, timed_metric
+
+pytestmark = pytest.mark.usefixtures("timings")
+
+
+def durations(timings):
+    return {metric.name: metric.duration for metric in timings.metrics}
+
+
+class TestTimed:
+    def test_sync_function(self, timings):
+        @timed(description="work")
+        def work(value):
+            return value * 2
+
+        assert work(21) == 42
+        assert [(m.name, m.description) for m in timings.metrics] == [("work", "work")]
+
+    def test_coroutine_function_times_awaited_work(self, timings):
+        @timed("sleep")
+        async def sleep():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        assert asyncio.run(sleep()) == "done"
+        assert durations(timings)["sleep"] >= 15.0
+
+    def test_generator_times_iteration(self, timings):
+        @timed()
+        def numbers():
+            for i in range(3):
+                yield i
+            return "end"
+
+        generator = numbers()
+        assert timings.metrics == []
+        assert list(generator) == [0, 1, 2]
+        assert [m.name for m in timings.metrics] == ["numbers"]
+        assert timings.metrics[0]._duration is not None
+
+    def test_generator_is_not_parent_of_consumer_metrics(self, timings):
+        @timed()
+        def numbers():
+            yield 1
+
+        for _ in numbers():
+            with timed_metric("consumer") as consumer:
+                pass
+
+        assert consumer.parent is None
+
+    def test_async_generator_times_iteration(self, timings):
+        @timed("stream")
+        async def stream():
+            for i in range(2):
+                await asyncio.sleep(0.01)
+                yield i
+
+        async def consume():
+            return [item async for item in stream()]
+
+        assert asyncio.run(consume()) == [0, 1]
+        assert durations(timings)["stream"] >= 15.0
+
+    def test_async_generator_forwards_to_the_generator(self, timings):
+        events = []
+
+        @timed("stream")
+        async def stream():
+            try:
+                received = yield 0
+                events.append(received)
+                try:
+                    yield 1
+                except ValueError:
+                    events.append("thrown")
+                    yield 2
+                yield 3
+            finally:
+                events.append("closed")
+
+        async def consume():
+            generator = stream()
+            items = [await generator.__anext__(), await generator.asend("sent")]
+            items.append(await generator.athrow(ValueError()))
+            await generator.aclose()
+            return items
+
+        assert asyncio.run(consume()) == [0, 1, 2]
+        assert events == ["sent", "thrown", "closed"]
+        assert timings.metrics[0]._duration is not None
+
+    def test_metric_ends_on_exception(self, timings):
+        @timed()
+        def fail():
+            raise RuntimeError
+
+        with pytest.raises(RuntimeError):
+            fail()
+        assert timings.metrics[0]._duration is not None
+
+
+class TestTimedMetric:
+    def test_async_with(self, timings):
+        async def main():
+            async with timed_metric("block", "async") as metric:
+                await asyncio.sleep(0.01)
+            return metric
+
+        metric = asyncio.run(main())
+        assert metric.description == "async"
+        assert metric.duration >= 5.0
+        assert timings.metrics == [metric]
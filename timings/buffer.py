@@ -0,0 +1,114 @@
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .models import ServerTimingMetric
+
+# The owner of buffers returned to the pool, which no appender passes
+_RETURNED = object()
+
+
+class MetricBuffer:
+    """
+    An append-only sequence that keeps its capacity when cleared.
+
+    Clearing a ``list`` releases its backing array, so a buffer reused for the next
+    request would grow through all reallocations again. This buffer overwrites its
+    slots in place instead and only tracks how many of them are in use.
+
+    Appends pass the ``owner`` the buffer was acquired for (see :class:`BufferPool`),
+    and are discarded once the buffer was returned to the pool: a thread that read
+    the buffer of a finished request must not append to that of the next one.
+    """
+
+    __slots__ = ("_items", "_size", "_lock", "_owner")
+
+    def __init__(self, owner: object = None):
+        self._items: list["ServerTimingMetric | None"] = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._owner = owner
+
+    def append(self, item: "ServerTimingMetric", owner: object = None) -> None:
+        # Requests may record from several threads (e.g. thread pools)
+        with self._lock:
+            if owner is not self._owner:
+                return
+            size = self._size
+            if size == len(self._items):
+                self._items.append(item)
+            else:
+                self._items[size] = item
+            self._size = size + 1
+
+    def clear(self) -> None:
+        """Drops all items, keeping the capacity."""
+        with self._lock:
+            # Release references so that metrics can be collected
+            self._items[: self._size] = [None] * self._size
+            self._size = 0
+
+    def disown(self) -> None:
+        """Discards all later appends, until the buffer is acquired again."""
+        with self._lock:
+            self._owner = _RETURNED
+
+    def to_list(self) -> list["ServerTimingMetric"]:
+        return self._items[: self._size]
+
+    @property
+    def capacity(self) -> int:
+        return len(self._items)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+
+class _ReleasedBuffer(MetricBuffer):
+    """Stands in for a buffer returned to the pool, discarding late appends."""
+
+    __slots__ = ()
+
+    def append(self, item, owner: object = None) -> None:
+        pass
+
+
+RELEASED = _ReleasedBuffer()
+
+
+class BufferPool:
+    """A bounded pool recycling metric buffers across requests."""
+
+    def __init__(self, max_size: int = 64, max_capacity: int = 4096):
+        self.max_size = max_size
+        # Buffers that grew larger than this are not kept, to bound memory
+        self.max_capacity = max_capacity
+        self._free: list[MetricBuffer] = []
+
+    def acquire(self, owner: object = None) -> MetricBuffer:
+        """Returns a buffer accepting the appends of ``owner``."""
+        try:
+            # list.pop and list.append are atomic, no lock needed
+            buffer = self._free.pop()
+        except IndexError:
+            return MetricBuffer(owner)
+        # Disowned buffers take no appends, so nothing races with this
+        buffer._owner = owner
+        return buffer
+
+    def release(self, buffer: MetricBuffer) -> None:
+        if buffer is RELEASED:
+            return
+        # Also when not pooled, so that it does not reference its owner
+        buffer.disown()
+        if buffer.capacity > self.max_capacity:
+            return
+        buffer.clear()
+        if len(self._free) < self.max_size:
+            self._free.append(buffer)
+
+    def __len__(self) -> int:
+        return len(self._free)
@@ -0,0 +1,56 @@
+import logging
+from collections.abc import Callable
+
+from timings.exporters import Exporter, LoggingSink
+from timings.propagation import TimingContext, WorkerTimings, capture
+
+# The task message header carrying the TimingContext of the publishing request
+HEADER = "server_timings"
+
+logger = logging.getLogger(__name__)
+
+
+def connect(exporter: Exporter | None = None) -> Exporter:
+    """
+    Propagates timings from requests to the Celery tasks they publish.
+
+    Call it in both the web application and the worker. Publishing a task during a
+    request adds the request's timing context to the task headers; the worker
+    measures each task and exports its record, keyed by the request ID, to
+    ``exporter``. Returns the exporter.
+    """
+    from celery import signals
+
+    exporter = exporter or Exporter([LoggingSink(logger)])
+    before_task_publish, task_prerun, task_postrun = _handlers(exporter)
+    signals.before_task_publish.connect(before_task_publish, weak=False)
+    signals.task_prerun.connect(task_prerun, weak=False)
+    signals.task_postrun.connect(task_postrun, weak=False)
+    return exporter
+
+
+def _handlers(exporter: Exporter) -> tuple[Callable, Callable, Callable]:
+    """Returns the before_task_publish, task_prerun and task_postrun receivers."""
+    # task id -> timings of the running task
+    running: dict[str, WorkerTimings] = {}
+
+    # Receivers must accept the other signal arguments (sender, signal, ...)
+    def before_task_publish(headers=None, **_kwargs):
+        context = capture()
+        if context is not None and headers is not None:
+            headers[HEADER] = context._asdict()
+
+    def task_prerun(task_id=None, task=None, **_kwargs):
+        header = task.request.get(HEADER) or (task.request.headers or {}).get(HEADER)
+        worker = WorkerTimings(
+            TimingContext(**header) if header else None, task.name
+        ).__enter__()
+        running[task_id] = worker
+
+    def task_postrun(task_id=None, **_kwargs):
+        worker = running.pop(task_id, None)
+        if worker is not None:
+            worker.__exit__(None, None, None)
+            exporter.export(worker.record)
+
+    return before_task_publish, task_prerun, task_postrun
@@ -1,14 +1,51 @@
-import logging
-import sqlparse
-from timings.models import ServerTimingMetric
+from contextvars import ContextVar
+from functools import wraps
+from importlib.util import find_spec
+from urllib.parse import urlsplit
+
+from timings.instruments import (
+    DBMode,
+    add_query_metrics,
+    check_db_mode,
+    describe_query,
+)
+from timings.models import ServerTimingMetric, clock
+from timings.sql import QueryAggregator
 
 
 class DBQueryInstrument:
-    def __init__(self, timings):
+    """
+    Times the queries of a request (installed via ``connection.execute_wrapper``).
+
+    Modes:
+    - ``per-query``: one ``db_N`` metric per query (default)
+    - ``aggregated``: one ``db-group`` metric per query fingerprint with
+      count, min, max and p95
+    - ``both``: per-query and aggregated metrics
+
+    Fingerprints executed at least ``duplicate_threshold`` times are reported as
+    ``db-dup`` metrics naming the call site, in every mode.
+    """
+
+    def __init__(self, timings, mode: DBMode = "per-query", duplicate_threshold=5):
+        check_db_mode(mode)
         self.counter = 0
         self.timings = timings
+        self.mode = mode
+        self.queries = QueryAggregator(duplicate_threshold)
+        # Query count and time per database alias
+        self.aliases = CallAggregator("db-alias")
 
     def __call__(self, execute, sql: str, params, many, context):
+        if self.mode == "aggregated":
+            start = clock()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = (clock() - start) / 1_000_000
+                self.queries.record(sql, duration)
+                self.aliases.record(context["connection"].alias, duration)
+
         metric = ServerTimingMetric(
             name=f"db_{self.counter + 1}", description="", timings=self.timings
         )
@@ -24,43 +61,309 @@ class DBQueryInstrument:
         finally:
             metric.description = self.execution_info(sql)
             metric.end()
+            self.queries.record(sql, metric.duration)
+            self.aliases.record(context["connection"].alias, metric.duration)
+
+    def finish(self):
+        """
+        Adds the aggregated and duplicate query metrics to the timings, and the
+        ``db-alias`` metrics when more than one database was queried.
+        """
+        if len(self.aliases.calls) > 1:
+            self.aliases.finish(self.timings)
+        add_query_metrics(self.timings, self.queries, self.mode)
 
     def execution_info(self, sql) -> str:
-        if len(sql) < 20:
-            return sql
-        parsed = sqlparse.parse(sql)[0]
-        tokens = [token for token in parsed.tokens if not token.is_whitespace]
-
-        operation = tokens[
-            0
-        ].value.upper()  # First token is typically the operation (SELECT, INSERT, etc.)
-        table_name = None
-
-        match operation:
-            case "SET":
-                table_name_token_prefix = "SET"
-            case "INSERT":
-                table_name_token_prefix = "INTO"
-            case "UPDATE":
-                table_name_token_prefix = "TABLE"
-            case "DELETE", "SELECT":
-                table_name_token_prefix = "FROM"
-            case "SELECT":
-                table_name_token_prefix = "FROM"
-            case _:
-                logging.warning(
-                    f"[DatabaseQueryTiming] Unsupported operation: {operation}"
+        return describe_query(sql)
+
+
+# The call aggregators of the current request, by instrument name
+_active: ContextVar[dict[str, "CallAggregator"] | None] = ContextVar(
+    "server_timings_django_instruments", default=None
+)
+# The innermost recorded call, see _Call
+_current_call: ContextVar["_Call | None"] = ContextVar(
+    "server_timings_django_call", default=None
+)
+# (owner, attribute, original) of the patched attributes, see uninstall
+_patched: list[tuple[object, str, object]] = []
+# The original of an attribute that was inherited
+_MISSING = object()
+
+CACHE_METHODS = (
+    "add",
+    "get",
+    "set",
+    "touch",
+    "delete",
+    "get_many",
+    "get_or_set",
+    "has_key",
+    "incr",
+    "decr",
+    "set_many",
+    "delete_many",
+    "clear",
+)
+ASYNC_CACHE_METHODS = tuple(f"a{method}" for method in CACHE_METHODS)
+
+
+class CallAggregator:
+    """
+    Counts calls and sums their durations per key (e.g. cache alias or host).
+    """
+
+    __slots__ = ("name", "calls")
+
+    def __init__(self, name: str):
+        self.name = name
+        # key -> [count, total duration]
+        self.calls: dict[str, list] = {}
+
+    def record(self, key: str, duration: float) -> None:
+        entry = self.calls.get(key)
+        if entry is None:
+            self.calls[key] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+
+    def finish(self, timings) -> None:
+        """Adds one metric per key to the timings."""
+        for key, (count, total) in self.calls.items():
+            ServerTimingMetric(
+                name=self.name,
+                description=f"{key} x{count}",
+                duration=total,
+                timings=timings,
+            )
+
+
+class CallInstruments:
+    """
+    Activates the cache, template and HTTP instruments for a request.
+
+    The instruments hook into their libraries once (see :func:`install`), and only
+    record calls made while a ``CallInstruments`` is active.
+    """
+
+    def __init__(self, timings, names):
+        self.timings = timings
+        self.aggregators = {name: CallAggregator(name) for name in names}
+        self._token = None
+
+    def __enter__(self) -> "CallInstruments":
+        self._token = _active.set(self.aggregators)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        _active.reset(self._token)
+
+    def finish(self) -> None:
+        """Adds the aggregated metrics to the timings."""
+        for aggregator in self.aggregators.values():
+            aggregator.finish(self.timings)
+
+
+def install(name: str) -> None:
+    """Installs the hooks of an instrument ("cache", "template" or "http"), once."""
+    if name not in INSTRUMENTS:
+        raise ValueError(f"Instrument must be one of {', '.join(INSTRUMENTS)}")
+    INSTRUMENTS[name]()
+
+
+def uninstall() -> None:
+    """Restores everything the installed instruments patched, e.g. between tests."""
+    while _patched:
+        owner, attribute, original = _patched.pop()
+        if original is _MISSING:
+            delattr(owner, attribute)
+        else:
+            setattr(owner, attribute, original)
+
+
+def _patch(owner, attribute: str, wrapper) -> None:
+    """Sets ``owner.attribute`` to ``wrapper``, saving what it replaces."""
+    if getattr(owner, attribute) is wrapper:
+        return
+    # Inherited attributes are deleted again rather than set on the subclass
+    _patched.append((owner, attribute, owner.__dict__.get(attribute, _MISSING)))
+    setattr(owner, attribute, wrapper)
+
+
+class _Call:
+    """
+    A recorded call, so that the calls made within it are told apart.
+
+    Calls of the same instrument made within it (e.g. ``get_or_set`` calling
+    ``get``, or ``aget`` calling ``get`` in a thread) are not recorded again, unless
+    the instrument records nested calls: then their time is recorded under their
+    own key, and subtracted from the enclosing call's (e.g. included templates).
+    """
+
+    __slots__ = ("name", "outer", "enclosing", "children")
+
+    def __init__(self, name: str, outer: "_Call | None", enclosing: "_Call | None"):
+        self.name = name
+        self.outer = outer
+        # The innermost call of the same instrument this one was made within
+        self.enclosing = enclosing
+        self.children = 0.0
+
+
+def _enter(name: str, nested: bool):
+    """Starts recording a call of the instrument ``name``, or returns None."""
+    aggregators = _active.get()
+    aggregator = aggregators.get(name) if aggregators is not None else None
+    if aggregator is None:
+        return None
+    outer = enclosing = _current_call.get()
+    while enclosing is not None and enclosing.name != name:
+        enclosing = enclosing.outer
+    if enclosing is not None and not nested:
+        return None
+    call = _Call(name, outer, enclosing)
+    return aggregator, call, _current_call.set(call)
+
+
+def _exit(entered, key: str, duration: float) -> None:
+    aggregator, call, token = entered
+    _current_call.reset(token)
+    if call.enclosing is not None:
+        call.enclosing.children += duration
+    aggregator.record(key, duration - call.children)
+
+
+def _timed(name: str, func, key, nested: bool = False):
+    """
+    Wraps ``func`` to record its calls in the active aggregator ``name``, see
+    :class:`_Call` for the calls made within them.
+    """
+    if getattr(func, "__server_timings__", False):
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        entered = _enter(name, nested)
+        if entered is None:
+            return func(*args, **kwargs)
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _exit(entered, key(*args, **kwargs), (clock() - start) / 1_000_000)
+
+    wrapper.__server_timings__ = True
+    return wrapper
+
+
+def _timed_async(name: str, func, key):
+    if getattr(func, "__server_timings__", False):
+        return func
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        entered = _enter(name, False)
+        if entered is None:
+            return await func(*args, **kwargs)
+        start = clock()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _exit(entered, key(*args, **kwargs), (clock() - start) / 1_000_000)
+
+    wrapper.__server_timings__ = True
+    return wrapper
+
+
+def _install_cache() -> None:
+    from django.core.cache import CacheHandler, caches
+
+    def tag(backend, alias):
+        backend._server_timings_alias = alias
+        backend_class = type(backend)
+        for method in CACHE_METHODS:
+            _patch(
+                backend_class,
+                method,
+                _timed("cache", getattr(backend_class, method), _cache_alias),
+            )
+        for method in ASYNC_CACHE_METHODS:
+            # Async methods are missing before Django 4.0
+            if hasattr(backend_class, method):
+                _patch(
+                    backend_class,
+                    method,
+                    _timed_async("cache", getattr(backend_class, method), _cache_alias),
                 )
-                table_name_token_prefix = None
-
-        if table_name_token_prefix:
-            for i in range(len(tokens)):
-                token = tokens[i]
-                if (
-                    token.ttype == sqlparse.tokens.Keyword
-                    and token.value.upper() == table_name_token_prefix
-                ):
-                    table_name = str(tokens[i + 1].value).replace('"', "'")
-                    break
-
-        return "DB: " + operation + " " + (table_name or "")
+
+    create_connection = CacheHandler.create_connection
+    if getattr(create_connection, "__server_timings__", False):
+        return
+
+    @wraps(create_connection)
+    def create_tagged_connection(self, alias):
+        backend = create_connection(self, alias)
+        tag(backend, alias)
+        return backend
+
+    create_tagged_connection.__server_timings__ = True
+    _patch(CacheHandler, "create_connection", create_tagged_connection)
+    for alias in caches.settings:
+        tag(caches[alias], alias)
+
+
+def _cache_alias(backend, *_args, **_kwargs) -> str:
+    return getattr(backend, "_server_timings_alias", type(backend).__name__)
+
+
+def _install_template() -> None:
+    from django.template.base import Template
+
+    # _render, which {% extends %} calls directly, unlike render. Included and
+    # extended templates are recorded under their own name, with their time
+    # subtracted from the template rendering them.
+    _patch(
+        Template,
+        "_render",
+        _timed("template", Template._render, _template_name, nested=True),
+    )
+
+
+def _template_name(template, *_args, **_kwargs) -> str:
+    return template.name or "<string>"
+
+
+def _install_http() -> None:
+    if find_spec("requests"):
+        import requests
+
+        _patch(
+            requests.Session,
+            "send",
+            _timed("http", requests.Session.send, _requests_host),
+        )
+    if find_spec("httpx"):
+        import httpx
+
+        _patch(httpx.Client, "send", _timed("http", httpx.Client.send, _httpx_host))
+        _patch(
+            httpx.AsyncClient,
+            "send",
+            _timed_async("http", httpx.AsyncClient.send, _httpx_host),
+        )
+
+
+def _requests_host(_session, request, **_kwargs) -> str:
+    return urlsplit(request.url).netloc
+
+
+def _httpx_host(_client, request, **_kwargs) -> str:
+    return request.url.netloc.decode()
+
+
+INSTRUMENTS = {
+    "cache": _install_cache,
+    "template": _install_template,
+    "http": _install_http,
+}
@@ -1,10 +1,17 @@
-import json
 import logging
+from contextlib import ExitStack
+
 from django.apps import AppConfig
-from django.db import connection
+from django.conf import settings
+from django.db import connections
 
-from .instruments import DBQueryInstrument
-from timings.models import ServerTimingMetric, ServerTimings
+from .instruments import CallInstruments, DBQueryInstrument, install
+from timings.exporters import Exporter, LoggingSink
+from timings.header import format_metric, render_header
+from timings.instruments import RequestInstruments
+from timings.models import ServerTimingMetric, ServerTimings, clock
+from timings.sampling import unsampled_record
+from timings.tracecontext import header_entry, parse_traceparent, record_fields
 
 
 class TimingsConfig(AppConfig):
@@ -16,39 +23,130 @@ class ServerTimingMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
         self.logger = logging.getLogger(__name__)
+        # Any of "db", "cache", "template" and "http", and instrument objects such
+        # as the ResourceInstrument of timings.resources
+        instruments = getattr(settings, "SERVER_TIMINGS_INSTRUMENTS", ("db",))
+        self.db_enabled = "db" in instruments
+        self.call_instruments = [
+            name for name in instruments if isinstance(name, str) and name != "db"
+        ]
+        for name in self.call_instruments:
+            install(name)
+        self.instruments = [
+            instrument for instrument in instruments if not isinstance(instrument, str)
+        ]
+        # A mode name, or a callable returning the mode for a request
+        self.db_mode = getattr(settings, "SERVER_TIMINGS_DB_MODE", "per-query")
+        self.db_duplicate_threshold = getattr(
+            settings, "SERVER_TIMINGS_DB_DUPLICATE_THRESHOLD", 5
+        )
+        self.header_max_bytes = getattr(
+            settings, "SERVER_TIMINGS_HEADER_MAX_BYTES", None
+        )
+        # "flat", "top-level" or "self", see timings.header.render_header
+        self.header_mode = getattr(settings, "SERVER_TIMINGS_HEADER_MODE", "flat")
+        # A timings.sampling.SamplingPolicy, or None to instrument every request
+        self.sampling = getattr(settings, "SERVER_TIMINGS_SAMPLING", None)
+        # A timings.exporters.Exporter receiving a record per finished request
+        self.exporter = getattr(settings, "SERVER_TIMINGS_EXPORTER", None) or Exporter(
+            [LoggingSink(self.logger)]
+        )
 
     def __call__(self, request):
+        if self.sampling is not None and not self.should_sample(request):
+            return self.call_unsampled(request)
+
         # Bind sync storage for this request
         ServerTimings.setUp("sync")
+        instruments = None
 
         try:
             thread_local_timings = ServerTimings()
-            query_timings = DBQueryInstrument(thread_local_timings)
+            thread_local_timings.trace = parse_traceparent(
+                request.META.get("HTTP_TRACEPARENT")
+            )
+            db_mode = self.db_mode(request) if callable(self.db_mode) else self.db_mode
+            query_timings = DBQueryInstrument(
+                thread_local_timings,
+                mode=db_mode,
+                duplicate_threshold=self.db_duplicate_threshold,
+            )
+
+            call_timings = CallInstruments(thread_local_timings, self.call_instruments)
+            instruments = RequestInstruments(self.instruments, thread_local_timings)
 
-            with connection.execute_wrapper(query_timings):
+            with ExitStack() as stack:
+                if self.db_enabled:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(query_timings))
+                stack.enter_context(call_timings)
                 metric = ServerTimingMetric(
                     name="request", description="", timings=thread_local_timings
                 )
-                with metric.measure():
+                # The request spans everything else, so it is not their parent
+                with metric.measure(nest=False):
                     response = self.get_response(request)
+            query_timings.finish()
+            call_timings.finish()
+            instruments.finish()
 
-            timing_header = ", ".join(
-                str(metric) for metric in thread_local_timings.metrics
+            timing_header = render_header(
+                thread_local_timings.metrics,
+                self.header_max_bytes,
+                self.header_mode,
+                leading=header_entry(thread_local_timings.trace),
             )
 
             if len(timing_header) > 0:
-                self.logger.info(
-                    json.dumps(
-                        {
-                            "path": request.path,
-                            "timings": thread_local_timings.dump(),
-                        }
-                    )
+                self.exporter.export(
+                    {
+                        "path": request.path,
+                        "route": self.route(request),
+                        "status": response.status_code,
+                        "duration": metric.duration,
+                        "request_id": thread_local_timings.request_id,
+                        **record_fields(thread_local_timings),
+                        "timings": thread_local_timings.dump(),
+                    }
                 )
                 response.headers["Server-Timing"] = timing_header
                 thread_local_timings.discard_all()
 
             return response
         finally:
+            # Unless they finished, e.g. when the view raised
+            if instruments is not None:
+                instruments.finish()
             # Clean up storage after request
             ServerTimings.tearDown()
+
+    @staticmethod
+    def route(request) -> str | None:
+        """Returns the route template the request matched, if any."""
+        match = getattr(request, "resolver_match", None)
+        return match.route if match is not None else None
+
+    def should_sample(self, request) -> bool:
+        sampling = self.sampling
+        return sampling.should_sample(
+            request.path,
+            header=sampling.trigger_header
+            and request.headers.get(sampling.trigger_header),
+            cookie=sampling.trigger_cookie
+            and request.COOKIES.get(sampling.trigger_cookie),
+        )
+
+    def call_unsampled(self, request):
+        """Handles a request without instrumentation, reporting it only if slow."""
+        start = clock()
+        response = self.get_response(request)
+        duration = (clock() - start) / 1_000_000
+
+        if self.sampling.is_slow(duration):
+            self.exporter.export(
+                unsampled_record(
+                    request.path, self.route(request), response.status_code, duration
+                )
+            )
+            response.headers["Server-Timing"] = format_metric("request", "", duration)
+        return response
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
+
+from timings.prometheus import CONTENT_TYPE
+from timings.recent import CONTENT_TYPE as JSON_CONTENT_TYPE
+
+
+def metrics(request):
+    """
+    Serves the aggregates of ``settings.SERVER_TIMINGS_PROMETHEUS``
+    (a :class:`timings.prometheus.PrometheusAggregates`) in the OpenMetrics format.
+    """
+    aggregates = settings.SERVER_TIMINGS_PROMETHEUS
+    return HttpResponse(aggregates.render(), content_type=CONTENT_TYPE)
+
+
+def recent(request):
+    """
+    Serves queries of ``settings.SERVER_TIMINGS_RECENT``
+    (a :class:`timings.recent.RecentRequests`) as JSON.
+    """
+    try:
+        body = settings.SERVER_TIMINGS_RECENT.render(request.GET)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    return HttpResponse(body, content_type=JSON_CONTENT_TYPE)
@@ -0,0 +1,168 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+from collections.abc import Callable, Iterable
+from typing import IO
+
+logger = logging.getLogger(__name__)
+
+# Stops the worker thread
+_CLOSE = object()
+
+
+class Sink:
+    """A destination for exported records, called on the exporter's worker thread."""
+
+    def write(self, batch: list[dict]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LoggingSink(Sink):
+    """
+    Logs each record as JSON, or as ``extra`` fields of a "Server timings" message
+    with ``extra=True``. Records without timings are not logged.
+    """
+
+    def __init__(self, logger: logging.Logger, extra: bool = False):
+        self.logger = logger
+        self.extra = extra
+
+    def write(self, batch: list[dict]) -> None:
+        for record in batch:
+            if not record["timings"]:
+                continue
+            if self.extra:
+                self.logger.info(msg="Server timings", extra=record)
+            else:
+                self.logger.info(json.dumps(record))
+
+
+class StreamSink(Sink):
+    """Writes each record as a JSON line to a text stream."""
+
+    def __init__(self, stream: IO[str]):
+        self.stream = stream
+
+    def write(self, batch: list[dict]) -> None:
+        self.stream.write("".join(json.dumps(record) + "\n" for record in batch))
+        self.stream.flush()
+
+
+class StdoutSink(StreamSink):
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+
+class JSONLFileSink(StreamSink):
+    """Appends each record as a JSON line to a file."""
+
+    def __init__(self, path: str):
+        super().__init__(open(path, "a", encoding="utf-8"))  # noqa: SIM115
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class CallableSink(Sink):
+    """Passes each batch to a callable."""
+
+    def __init__(self, func: Callable[[list[dict]], None]):
+        self.func = func
+
+    def write(self, batch: list[dict]) -> None:
+        self.func(batch)
+
+
+class Exporter:
+    """
+    Exports finished requests' records off the request path.
+
+    Records are put on a bounded queue and written to the sinks in batches by a
+    background thread, which is started on the first export. When the queue is full,
+    records are dropped and counted in ``dropped`` instead of blocking the request.
+    """
+
+    def __init__(
+        self,
+        sinks: Iterable[Sink],
+        max_queue_size: int = 10_000,
+        batch_size: int = 100,
+    ):
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue: queue.Queue = queue.Queue(max_queue_size)
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def export(self, record: dict) -> bool:
+        """Queues a record, returning False if it was dropped."""
+        if self._worker is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def flush(self) -> None:
+        """Blocks until all queued records have been written."""
+        if self._worker is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Writes the queued records, stops the worker and closes the sinks."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(_CLOSE)
+            worker.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(
+                target=self._run, name="server-timings-exporter", daemon=True
+            )
+            self._worker.start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = _CLOSE in batch
+            records = [record for record in batch if record is not _CLOSE]
+            if records:
+                self._write(records)
+            for _ in batch:
+                self._queue.task_done()
+            if closing:
+                return
+
+    def _write(self, batch: list[dict]) -> None:
+        for sink in self.sinks:
+            try:
+                sink.write(batch)
+            except Exception:  # noqa: BLE001
+                self.errors += 1
+                logger.exception(f"[ServerTimings] Failed to export to {sink!r}")
+        self.exported += len(batch)
@@ -1,66 +1,297 @@
-import json
 import logging
+from collections.abc import Sequence
 from typing import Callable, Awaitable
 
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp, Scope, Receive, Send
 
-from timings import ServerTimings
+from timings import ServerTimings, ServerTimingMetric
+from timings.exporters import Exporter, LoggingSink
+from timings.fastapi.monitor import LoopLagMonitor, Watch
+from timings.header import HeaderMode, format_metric, render_header
+from timings.instruments import RequestInstruments
+from timings.models import clock
+from timings.sampling import SamplingPolicy, cookie_value, unsampled_record
+from timings.tracecontext import (
+    TraceContext,
+    header_entry,
+    parse_traceparent,
+    record_fields,
+)
+
+TRAILERS_EXTENSION = "http.response.trailers"
+
+
+class ResponseTimer:
+    """Tracks how long a response body takes to be sent and how large it is."""
+
+    def __init__(self):
+        self.request_start = clock()
+        self.response_start: int | None = None
+        self.status: int | None = None
+        self.first_byte: int | None = None
+        self.end: int | None = None
+        self.bytes = 0
+        self.chunks = 0
+
+    def on_message(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.response_start = clock()
+            self.status = message["status"]
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            if body:
+                if self.first_byte is None:
+                    self.first_byte = clock()
+                self.bytes += len(body)
+                self.chunks += 1
+            if not message.get("more_body", False):
+                self.end = clock()
+
+    @property
+    def duration(self) -> float | None:
+        """The time from the start of the request to the end of the body in ms."""
+        if self.end is None:
+            return None
+        return (self.end - self.request_start) / 1_000_000
+
+    def add_metrics(self, timings: ServerTimings) -> None:
+        """Adds the ttfb and response-body metrics to the timings."""
+        if self.first_byte is not None:
+            ServerTimingMetric(
+                name="ttfb",
+                duration=(self.first_byte - self.request_start) / 1_000_000,
+                timings=timings,
+            )
+        if self.response_start is not None and self.end is not None:
+            ServerTimingMetric(
+                name="response-body",
+                description=f"{self.bytes} bytes in {self.chunks} chunks",
+                duration=(self.end - self.response_start) / 1_000_000,
+                timings=timings,
+            )
+
+
+class RequestState:
+    """The state of an instrumented request, shared by its ASGI messages."""
+
+    __slots__ = (
+        "timings",
+        "instruments",
+        "watch",
+        "trailers",
+        "timer",
+        "reported",
+        "exported",
+    )
+
+    def __init__(
+        self,
+        timings: ServerTimings,
+        instruments: RequestInstruments,
+        watch: Watch | None,
+        trailers: bool,
+    ):
+        self.timings = timings
+        self.instruments = instruments
+        self.watch = watch
+        self.trailers = trailers
+        self.timer = ResponseTimer()
+        # The number of metrics reported in the header
+        self.reported = 0
+        self.exported = False
 
 
 class FastAPIServerTimingMiddleware:
+    """
+    Adds the Server-Timing header to responses.
+
+    Metrics recorded while the body is sent (e.g. in a ``StreamingResponse``) and the
+    ``ttfb``/``response-body`` metrics are reported as a Server-Timing trailer when
+    the client sends ``TE: trailers`` and the server supports the ASGI trailers
+    extension. Otherwise, they are only exported.
+    """
+
     logger = logging.getLogger("FastAPIServerTimingMiddleware")
 
-    def __init__(self, app: ASGIApp):
+    def __init__(
+        self,
+        app: ASGIApp,
+        header_max_bytes: int | None = None,
+        header_mode: HeaderMode = "flat",
+        sampling: SamplingPolicy | None = None,
+        exporter: Exporter | None = None,
+        instruments: Sequence = (),
+        loop_monitor: LoopLagMonitor | None = None,
+    ):
         self.app = app
+        self.header_max_bytes = header_max_bytes
+        self.header_mode = header_mode
+        self.sampling = sampling
+        # Receives a record per finished request, off the event loop
+        self.exporter = exporter or Exporter([LoggingSink(self.logger)])
+        # Started and finished (before the header is rendered) around each request
+        self.instruments = list(instruments)
+        # Adds loop-blocked metrics to requests in flight while the loop was blocked
+        self.loop_monitor = loop_monitor
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
         if scope["type"] != "http":
             return await self.app(scope, receive, send)
+        if self.sampling is not None and not self.should_sample(scope):
+            return await self.call_unsampled(scope, receive, send)
 
-        from timings.storage import _thread_local
-        import threading
-
-        # Set up storage using the new API
+        # Sync endpoints run in anyio worker threads, which execute in a copy of
+        # this context, so they see the same ServerTimings without extra wiring.
         ServerTimings.setUp("async")
         timings = ServerTimings()
-
-        # Patch threading to copy storage to sync contexts
-        original_run = threading.Thread.run
-
-        def patched_run(self):
-            # Copy the timings instance to thread-local storage for sync routes
-            _thread_local.val = {"instance": timings}
-            _thread_local.mode = "sync"
-            return original_run(self)
-
-        threading.Thread.run = patched_run
+        timings.trace = self.trace(scope)
+        state = RequestState(
+            timings,
+            RequestInstruments(self.instruments, timings),
+            self.loop_monitor.watch() if self.loop_monitor is not None else None,
+            self.accepts_trailers(scope),
+        )
 
         async def send_wrapper(message):
+            state.timer.on_message(message)
             if message["type"] == "http.response.start":
-                timing_header = ", ".join(str(metric) for metric in timings.metrics)
-
-                if len(timing_header) > 0:
-                    self.logger.info(
-                        json.dumps(
-                            {
-                                "path": scope["path"],
-                                "timings": timings.dump(),
-                            }
-                        )
-                    )
-                    headers = list(message.get("headers", []))
-                    headers.append((b"server-timing", timing_header.encode()))
-                    message["headers"] = headers
-                    timings.discard_all()
-
+                self.start_response(state, message)
             await send(message)
+            if message["type"] == "http.response.body" and state.timer.end is not None:
+                await self.end_response(scope, state, send)
 
         try:
             await self.app(scope, receive, send_wrapper)
         finally:
-            # Restore original thread run method
-            threading.Thread.run = original_run
+            # Unless the response started, e.g. when the endpoint raised
+            state.instruments.finish()
+            if state.watch is not None:
+                self.loop_monitor.unwatch(state.watch)
+            if not state.exported:
+                self.export(scope, state)
             # Clean up context after request
             ServerTimings.tearDown()
+
+    def start_response(self, state: "RequestState", message) -> None:
+        """Adds the Server-Timing header (and trailer announcement) to the response."""
+        state.instruments.finish()
+        self.add_loop_metric(state)
+        metrics = state.timings.metrics
+        state.reported = len(metrics)
+        timing_header = render_header(
+            metrics,
+            self.header_max_bytes,
+            self.header_mode,
+            leading=header_entry(state.timings.trace),
+        )
+
+        headers = list(message.get("headers", []))
+        if len(timing_header) > 0:
+            headers.append((b"server-timing", timing_header.encode()))
+        if state.trailers:
+            headers.append((b"trailer", b"server-timing"))
+            message["trailers"] = True
+        message["headers"] = headers
+
+    async def end_response(self, scope: Scope, state: "RequestState", send: Send):
+        """Sends the metrics recorded while the body was sent and exports the record."""
+        state.timer.add_metrics(state.timings)
+        self.add_loop_metric(state)
+        if state.trailers:
+            trailer = render_header(
+                state.timings.metrics[state.reported :],
+                self.header_max_bytes,
+                self.header_mode,
+            )
+            await send(
+                {
+                    "type": "http.response.trailers",
+                    "headers": [(b"server-timing", trailer.encode())],
+                    "more_trailers": False,
+                }
+            )
+        self.export(scope, state)
+        state.timings.discard_all()
+
+    def add_loop_metric(self, state: "RequestState") -> None:
+        if state.watch is not None:
+            self.loop_monitor.poll()
+            state.watch.add_metric(state.timings)
+
+    def export(self, scope: Scope, state: "RequestState") -> None:
+        state.exported = True
+        self.exporter.export(
+            {
+                "path": scope["path"],
+                "route": self.route(scope),
+                "status": state.timer.status,
+                "duration": state.timer.duration,
+                "request_id": state.timings.request_id,
+                **record_fields(state.timings),
+                "timings": state.timings.dump(),
+            }
+        )
+
+    @staticmethod
+    def route(scope: Scope) -> str | None:
+        """Returns the path template of the route the request matched, if any."""
+        return getattr(scope.get("route"), "path", None)
+
+    @staticmethod
+    def trace(scope: Scope) -> TraceContext | None:
+        """Returns the trace context of the request's ``traceparent`` header, if any."""
+        for name, value in scope.get("headers", []):
+            if name == b"traceparent":
+                return parse_traceparent(value.decode("latin-1"))
+        return None
+
+    def should_sample(self, scope: Scope) -> bool:
+        sampling = self.sampling
+        trigger = sampling.trigger_header and sampling.trigger_header.lower().encode()
+        header = cookie = None
+        for name, value in scope.get("headers", []):
+            if trigger and name == trigger:
+                header = value.decode("latin-1")
+            elif sampling.trigger_cookie and name == b"cookie":
+                cookie = cookie_value(value.decode("latin-1"), sampling.trigger_cookie)
+        return sampling.should_sample(scope["path"], header=header, cookie=cookie)
+
+    async def call_unsampled(self, scope: Scope, receive: Receive, send: Send):
+        """Handles a request without instrumentation, reporting it only if slow."""
+        if self.sampling.slow_threshold_ms is None:
+            return await self.app(scope, receive, send)
+
+        start = clock()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                duration = (clock() - start) / 1_000_000
+                if self.sampling.is_slow(duration):
+                    self.exporter.export(
+                        unsampled_record(
+                            scope["path"],
+                            self.route(scope),
+                            message["status"],
+                            duration,
+                        )
+                    )
+                    timing_header = format_metric("request", "", duration)
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", timing_header.encode()),
+                    ]
+            await send(message)
+
+        return await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def accepts_trailers(scope: Scope) -> bool:
+        """Whether both the client and the server support response trailers."""
+        if TRAILERS_EXTENSION not in scope.get("extensions", {}):
+            return False
+        for name, value in scope.get("headers", []):
+            if name == b"te":
+                return b"trailers" in (v.strip() for v in value.lower().split(b","))
+        return False
@@ -0,0 +1,186 @@
+import asyncio
+import contextlib
+import sys
+import threading
+import traceback
+from collections import deque
+from typing import NamedTuple
+
+from timings.models import ServerTimingMetric, ServerTimings, clock
+
+
+class LoopBlock(NamedTuple):
+    """An episode in which the event loop could not run other tasks."""
+
+    # The clock() time the loop was due to run, in nanoseconds
+    start: int
+    # In milliseconds
+    duration: float
+    # "module:line (function)" of the blocking frame, if captured
+    location: str | None
+    stack: list[str] | None
+
+
+class Watch:
+    """The blocking time observed while a request was in flight."""
+
+    __slots__ = ("start", "blocked", "episodes", "location")
+
+    def __init__(self):
+        self.start = clock()
+        self.blocked = 0.0
+        self.episodes = 0
+        self.location: str | None = None
+
+    def add_metric(self, timings: ServerTimings) -> None:
+        """Adds a ``loop-blocked`` metric for the blocking observed so far."""
+        if not self.episodes:
+            return
+        description = f"{self.episodes} episodes"
+        if self.location is not None:
+            description += f", at {self.location}"
+        ServerTimingMetric(
+            name="loop-blocked",
+            description=description,
+            duration=self.blocked,
+            timings=timings,
+        )
+        self.blocked = 0.0
+        self.episodes = 0
+        self.location = None
+
+
+class LoopLagMonitor:
+    """
+    Detects when the event loop is blocked, e.g. by a sync call in an async endpoint.
+
+    A heartbeat task sleeps for ``interval`` seconds at a time; when it wakes up
+    ``threshold_ms`` or more late, the loop was blocked, and the blocked time is
+    attributed to all requests in flight. With ``capture_stacks``, a watchdog
+    thread checking the heartbeat every ``interval`` captures the stack of the
+    blocked loop thread, once per episode. The last ``max_episodes`` episodes are
+    kept in :attr:`episodes`.
+
+    The overhead is one wake-up per ``interval`` on the loop (and in the watchdog).
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        threshold_ms: float = 50.0,
+        capture_stacks: bool = False,
+        max_episodes: int = 100,
+    ):
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.capture_stacks = capture_stacks
+        self.episodes: deque[LoopBlock] = deque(maxlen=max_episodes)
+        self._watches: set[Watch] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        # When the heartbeat is due to wake up next, in clock() nanoseconds
+        self._due = 0
+        self._loop_thread: int | None = None
+        # The stack captured by the watchdog during the current episode
+        self._stack: tuple[str, list[str]] | None = None
+        self._stopped = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    def watch(self) -> Watch:
+        """Starts attributing blocking to a request; call from the event loop."""
+        self._ensure_started()
+        watch = Watch()
+        self._watches.add(watch)
+        return watch
+
+    def unwatch(self, watch: Watch) -> None:
+        self._watches.discard(watch)
+
+    def stop(self) -> None:
+        """Stops the heartbeat and the watchdog."""
+        self._stopped.set()
+        if self._task is not None:
+            # Unless its loop is closed already
+            with contextlib.suppress(RuntimeError):
+                self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+        self._loop = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        if self._loop is not None:
+            self.stop()
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._due = clock() + _nanoseconds(self.interval)
+        self._stopped = threading.Event()
+        self._task = loop.create_task(self._heartbeat(), name="server-timings-loop-lag")
+        if self.capture_stacks:
+            self._watchdog = threading.Thread(
+                target=self._watch_loop,
+                name="server-timings-loop-watchdog",
+                daemon=True,
+            )
+            self._watchdog.start()
+
+    def poll(self) -> None:
+        """
+        Records the episode the loop is in, if any.
+
+        A request that blocked the loop finishes before the heartbeat can run, so
+        call this before reporting the blocking of a request.
+        """
+        if self._loop is not None:
+            self._check(clock())
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._due = clock() + _nanoseconds(self.interval)
+            await asyncio.sleep(self.interval)
+            if not self._check(clock()):
+                self._stack = None
+
+    def _check(self, now: int) -> bool:
+        begin = self._due
+        if (now - begin) / 1_000_000 < self.threshold_ms:
+            return False
+        # Not to be counted again by the heartbeat
+        self._due = now
+        self._episode(begin, now)
+        return True
+
+    def _episode(self, begin: int, end: int) -> None:
+        captured, self._stack = self._stack, None
+        location, stack = captured if captured is not None else (None, None)
+        self.episodes.append(
+            LoopBlock(begin, (end - begin) / 1_000_000, location, stack)
+        )
+        for watch in self._watches:
+            overlap = end - max(watch.start, begin)
+            if overlap > 0:
+                watch.blocked += overlap / 1_000_000
+                watch.episodes += 1
+                if watch.location is None:
+                    watch.location = location
+
+    def _watch_loop(self) -> None:
+        threshold = self.threshold_ms * 1_000_000
+        while not self._stopped.wait(self.interval):
+            if self._stack is not None or clock() - self._due < threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                location = (
+                    f"{frame.f_globals.get('__name__', '?')}:{frame.f_lineno} "
+                    f"({frame.f_code.co_name})"
+                )
+                self._stack = (location, traceback.format_stack(frame))
+
+
+def _nanoseconds(seconds: float) -> int:
+    return int(seconds * 1_000_000_000)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Request, Response
+
+from timings.prometheus import CONTENT_TYPE, PrometheusAggregates
+from timings.recent import CONTENT_TYPE as JSON_CONTENT_TYPE, RecentRequests
+
+
+def metrics_router(
+    aggregates: PrometheusAggregates, path: str = "/metrics"
+) -> APIRouter:
+    """Returns a router serving the aggregates in the OpenMetrics format."""
+    router = APIRouter()
+
+    @router.get(path, include_in_schema=False)
+    def metrics():
+        return Response(aggregates.render(), media_type=CONTENT_TYPE)
+
+    return router
+
+
+def recent_router(recent: RecentRequests, path: str = "/debug/timings") -> APIRouter:
+    """Returns a router serving queries of the recent requests as JSON."""
+    router = APIRouter()
+
+    @router.get(path, include_in_schema=False)
+    def recent_requests(request: Request):
+        try:
+            body = recent.render(request.query_params)
+        except ValueError as error:
+            return Response(str(error), status_code=400)
+        return Response(body, media_type=JSON_CONTENT_TYPE)
+
+    return router
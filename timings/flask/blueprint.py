@@ -0,0 +1,38 @@
+from flask import Blueprint, Response, request
+
+from timings.prometheus import CONTENT_TYPE, PrometheusAggregates
+from timings.recent import CONTENT_TYPE as JSON_CONTENT_TYPE, RecentRequests
+
+
+def metrics_blueprint(
+    aggregates: PrometheusAggregates,
+    url: str = "/metrics",
+    name: str = "server_timings_metrics",
+) -> Blueprint:
+    """Returns a blueprint serving the aggregates in the OpenMetrics format."""
+    blueprint = Blueprint(name, __name__)
+
+    @blueprint.get(url)
+    def metrics():
+        return Response(aggregates.render(), content_type=CONTENT_TYPE)
+
+    return blueprint
+
+
+def recent_blueprint(
+    recent: RecentRequests,
+    url: str = "/debug/timings",
+    name: str = "server_timings_recent",
+) -> Blueprint:
+    """Returns a blueprint serving queries of the recent requests as JSON."""
+    blueprint = Blueprint(name, __name__)
+
+    @blueprint.get(url)
+    def recent_requests():
+        try:
+            body = recent.render(request.args)
+        except ValueError as error:
+            return Response(str(error), status=400)
+        return Response(body, content_type=JSON_CONTENT_TYPE)
+
+    return blueprint
@@ -4,7 +4,25 @@ from flask import g
 
 from flask import request
 
-from timings.models import ServerTimings
+from .middleware import ROUTE_KEY, ServerTimingsWSGIMiddleware
+from timings.exporters import Exporter, LoggingSink
+from timings.header import format_metric, render_header
+from timings.instruments import RequestInstruments
+from timings.models import ServerTimings, clock
+from timings.sampling import unsampled_record
+from timings.tracecontext import header_entry, parse_traceparent, record_fields
+
+
+class RequestState:
+    """The timings of the current request, stored on ``g`` as ``server_timings``."""
+
+    __slots__ = ("start", "timings", "instruments")
+
+    def __init__(self, start: int):
+        self.start = start
+        # None when the request is not sampled
+        self.timings: ServerTimings | None = None
+        self.instruments: RequestInstruments | None = None
 
 
 class ServerTimingsExtension:
@@ -23,27 +41,111 @@ class ServerTimingsExtension:
             self.init_app(app)
 
     def init_app(self, app):
+        self.header_max_bytes = app.config.get("SERVER_TIMINGS_HEADER_MAX_BYTES")
+        # "flat", "top-level" or "self", see timings.header.render_header
+        self.header_mode = app.config.get("SERVER_TIMINGS_HEADER_MODE", "flat")
+        # A timings.sampling.SamplingPolicy, or None to instrument every request
+        self.sampling = app.config.get("SERVER_TIMINGS_SAMPLING")
+        # A timings.exporters.Exporter receiving a record per finished request
+        self.exporter = app.config.get("SERVER_TIMINGS_EXPORTER") or Exporter(
+            [LoggingSink(self.logger, extra=True)]
+        )
+        # Instruments started and finished around each request, such as the
+        # SQLAlchemyInstrument of timings.sqlalchemy.instruments
+        self.instruments = list(app.config.get("SERVER_TIMINGS_INSTRUMENTS", ()))
+        # Time requests in a WSGI middleware instead of request hooks, including
+        # the streamed body, see timings.flask.middleware
+        if app.config.get("SERVER_TIMINGS_WSGI_MIDDLEWARE", False):
+            app.wsgi_app = ServerTimingsWSGIMiddleware(
+                app.wsgi_app,
+                header_max_bytes=self.header_max_bytes,
+                header_mode=self.header_mode,
+                sampling=self.sampling,
+                exporter=self.exporter,
+                instruments=self.instruments,
+            )
+            app.before_request(self.store_route)
+            return
         app.before_request(self.before_request)
         app.after_request(self.after_request)
         app.teardown_request(self.teardown_request)
 
     def before_request(self):
+        state = g.server_timings = RequestState(clock())
+        if self.sampling is not None and not self.should_sample():
+            return
+
         # Bind sync storage for this request
         ServerTimings.setUp("sync")
-        g.timings = ServerTimings()
+        timings = state.timings = ServerTimings()
+        timings.trace = parse_traceparent(request.headers.get("traceparent"))
+        state.instruments = RequestInstruments(self.instruments, timings)
+
+    def store_route(self):
+        """Passes the matched URL rule to the WSGI middleware."""
+        request.environ[ROUTE_KEY] = self.route()
+
+    @staticmethod
+    def route() -> str | None:
+        """Returns the URL rule the request matched, if any."""
+        return request.url_rule.rule if request.url_rule is not None else None
+
+    def should_sample(self) -> bool:
+        sampling = self.sampling
+        return sampling.should_sample(
+            request.path,
+            header=sampling.trigger_header
+            and request.headers.get(sampling.trigger_header),
+            cookie=sampling.trigger_cookie
+            and request.cookies.get(sampling.trigger_cookie),
+        )
 
     def after_request(self, response):
-        timing_header = ", ".join(str(metric) for metric in g.timings.metrics)
+        state = g.server_timings
+        timings = state.timings
+        if timings is None:
+            return self.after_unsampled_request(response, state)
+
+        state.instruments.finish()
+        timing_header = render_header(
+            timings.metrics,
+            self.header_max_bytes,
+            self.header_mode,
+            leading=header_entry(timings.trace),
+        )
+        self.exporter.export(
+            {
+                "path": request.path,
+                "route": self.route(),
+                "status": response.status_code,
+                "duration": (clock() - state.start) / 1_000_000,
+                "request_id": timings.request_id,
+                **record_fields(timings),
+                "timings": timings.dump(),
+            }
+        )
         if len(timing_header) > 0:
-            self.logger.info(
-                msg="Server timings",
-                extra={"path": request.path, "timings": g.timings.dump()},
-            )
             response.headers["Server-Timing"] = timing_header
-            g.timings.discard_all()
+            timings.discard_all()
 
         return response
 
+    def after_unsampled_request(self, response, state: RequestState):
+        """Reports a request without instrumentation only if it was slow."""
+        duration = (clock() - state.start) / 1_000_000
+        if self.sampling.is_slow(duration):
+            self.exporter.export(
+                unsampled_record(
+                    request.path, self.route(), response.status_code, duration
+                )
+            )
+            response.headers["Server-Timing"] = format_metric("request", "", duration)
+        return response
+
     def teardown_request(self, exception):
+        # Unless they finished, e.g. when the view raised
+        state = g.get("server_timings")
+        if state is not None and state.instruments is not None:
+            state.instruments.finish()
         # Clean up storage after request
         ServerTimings.tearDown()
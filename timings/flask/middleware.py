@@ -0,0 +1,189 @@
+import logging
+from collections.abc import Iterable, Sequence
+
+from timings.exporters import Exporter, LoggingSink
+from timings.header import HeaderMode, format_metric, render_header
+from timings.instruments import RequestInstruments
+from timings.models import ServerTimingMetric, ServerTimings, clock
+from timings.sampling import SamplingPolicy, cookie_value, unsampled_record
+from timings.tracecontext import header_entry, parse_traceparent, record_fields
+
+# The environ key the extension stores the matched URL rule in
+ROUTE_KEY = "server_timings.route"
+
+
+class ServerTimingsWSGIMiddleware:
+    """
+    Adds the Server-Timing header at the WSGI level, wrapping ``app.wsgi_app``.
+
+    Unlike the request hooks of the extension, it keeps the request's timings
+    until the response body has been sent and closed, so that metrics recorded
+    while streaming (e.g. with ``stream_with_context``) and the ``ttfb`` and
+    ``response-body`` metrics are exported. Only the metrics recorded until the
+    response starts are in the header. It does not use ``g`` or ``request``.
+
+    Enable it with ``SERVER_TIMINGS_WSGI_MIDDLEWARE = True``, see
+    :class:`~timings.flask.extension.ServerTimingsExtension`.
+    """
+
+    def __init__(
+        self,
+        wsgi_app,
+        header_max_bytes: int | None = None,
+        header_mode: HeaderMode = "flat",
+        sampling: SamplingPolicy | None = None,
+        exporter: Exporter | None = None,
+        instruments: Sequence = (),
+        logger: logging.Logger | None = None,
+    ):
+        self.wsgi_app = wsgi_app
+        self.header_max_bytes = header_max_bytes
+        self.header_mode = header_mode
+        self.sampling = sampling
+        self.exporter = exporter or Exporter(
+            [LoggingSink(logger or logging.getLogger(__name__), extra=True)]
+        )
+        self.instruments = list(instruments)
+
+    def __call__(self, environ, start_response):
+        if self.sampling is not None and not self.should_sample(environ):
+            return self.call_unsampled(environ, start_response)
+
+        ServerTimings.setUp("sync")
+        timings = ServerTimings()
+        timings.trace = parse_traceparent(environ.get("HTTP_TRACEPARENT"))
+        instruments = RequestInstruments(self.instruments, timings)
+        body = TimedBody(self, environ, timings, instruments)
+
+        def start_response_with_header(status, headers, exc_info=None):
+            body.response_start = clock()
+            body.status = int(status.split(" ", 1)[0])
+            instruments.finish()
+            timing_header = render_header(
+                timings.metrics,
+                self.header_max_bytes,
+                self.header_mode,
+                leading=header_entry(timings.trace),
+            )
+            if len(timing_header) > 0:
+                headers = [*headers, ("Server-Timing", timing_header)]
+            return start_response(status, headers, exc_info)
+
+        try:
+            body.iterable = self.wsgi_app(environ, start_response_with_header)
+        except BaseException:
+            instruments.finish()
+            ServerTimings.tearDown()
+            raise
+        return body
+
+    def should_sample(self, environ) -> bool:
+        sampling = self.sampling
+        header = cookie = None
+        if sampling.trigger_header:
+            key = "HTTP_" + sampling.trigger_header.upper().replace("-", "_")
+            header = environ.get(key)
+        if sampling.trigger_cookie and "HTTP_COOKIE" in environ:
+            cookie = cookie_value(environ["HTTP_COOKIE"], sampling.trigger_cookie)
+        return sampling.should_sample(
+            environ.get("PATH_INFO", ""), header=header, cookie=cookie
+        )
+
+    def call_unsampled(self, environ, start_response):
+        """Handles a request without instrumentation, reporting it only if slow."""
+        start = clock()
+
+        def start_response_if_slow(status, headers, exc_info=None):
+            duration = (clock() - start) / 1_000_000
+            if self.sampling.is_slow(duration):
+                self.exporter.export(
+                    unsampled_record(
+                        environ.get("PATH_INFO", ""),
+                        environ.get(ROUTE_KEY),
+                        int(status.split(" ", 1)[0]),
+                        duration,
+                    )
+                )
+                headers = [
+                    *headers,
+                    ("Server-Timing", format_metric("request", "", duration)),
+                ]
+            return start_response(status, headers, exc_info)
+
+        return self.wsgi_app(environ, start_response_if_slow)
+
+
+class TimedBody:
+    """
+    The response iterable, timing how long the body takes to be produced and sent.
+
+    Closing it (which the WSGI server does after sending the body) exports the
+    request's record and tears down its timings.
+    """
+
+    def __init__(
+        self,
+        middleware: ServerTimingsWSGIMiddleware,
+        environ,
+        timings,
+        instruments: RequestInstruments,
+    ):
+        self.middleware = middleware
+        self.environ = environ
+        self.timings = timings
+        self.instruments = instruments
+        self.iterable: Iterable[bytes] = ()
+        self.request_start = clock()
+        self.response_start: int | None = None
+        self.status: int | None = None
+        self.first_byte: int | None = None
+        self.bytes = 0
+        self.chunks = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            if chunk:
+                if self.first_byte is None:
+                    self.first_byte = clock()
+                self.bytes += len(chunk)
+                self.chunks += 1
+            yield chunk
+
+    def close(self) -> None:
+        try:
+            close = getattr(self.iterable, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        end = clock()
+        timings = self.timings
+        # Unless the response started, e.g. when the application raised
+        self.instruments.finish()
+        if self.first_byte is not None:
+            ServerTimingMetric(
+                name="ttfb",
+                duration=(self.first_byte - self.request_start) / 1_000_000,
+                timings=timings,
+            )
+        if self.response_start is not None:
+            ServerTimingMetric(
+                name="response-body",
+                description=f"{self.bytes} bytes in {self.chunks} chunks",
+                duration=(end - self.response_start) / 1_000_000,
+                timings=timings,
+            )
+        self.middleware.exporter.export(
+            {
+                "path": self.environ.get("PATH_INFO", ""),
+                "route": self.environ.get(ROUTE_KEY),
+                "status": self.status,
+                "duration": (end - self.request_start) / 1_000_000,
+                "request_id": timings.request_id,
+                **record_fields(timings),
+                "timings": timings.dump(),
+            }
+        )
+        ServerTimings.tearDown()
@@ -0,0 +1,168 @@
+import json
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Literal, NamedTuple
+
+if TYPE_CHECKING:
+    from .models import ServerTimingMetric
+
+SEPARATOR = ", "
+
+HeaderMode = Literal["flat", "top-level", "self"]
+HEADER_MODES: tuple[HeaderMode, ...] = ("flat", "top-level", "self")
+
+
+class Entry(NamedTuple):
+    """A header entry that is not a metric, e.g. a self-time rollup."""
+
+    name: str
+    description: str | None
+    duration: float
+
+    @property
+    def reported_duration(self) -> float:
+        return self.duration
+
+    def __str__(self):
+        return format_metric(self.name, self.description, self.duration)
+
+
+def format_metric(name: str, description: str | None, duration: float | None) -> str:
+    """Formats a single Server-Timing entry."""
+    res = name + ";"
+    if description is not None:
+        res += f"desc={json.dumps(description)};"
+    if duration is not None:
+        res += f"dur={duration:.2f};"
+    return res
+
+
+def child_durations(metrics: Iterable["ServerTimingMetric"]) -> dict[int, float]:
+    """Returns the summed duration of the direct children of each metric, by id."""
+    durations: dict[int, float] = {}
+    for metric in metrics:
+        if metric.parent is not None:
+            key = id(metric.parent)
+            durations[key] = durations.get(key, 0.0) + metric.duration
+    return durations
+
+
+def self_time_rollup(metrics: Iterable["ServerTimingMetric"]) -> list[Entry]:
+    """
+    Sums the self time (duration minus that of the children) of the metrics by name.
+
+    Children running concurrently can outlast their parent, so self times are
+    clamped at zero.
+    """
+    metrics = list(metrics)
+    children = child_durations(metrics)
+    # name -> [self duration, count, description]
+    rollup: dict[str, list] = {}
+    for metric in metrics:
+        own = max(0.0, metric.duration - children.get(id(metric), 0.0))
+        entry = rollup.get(metric.name)
+        if entry is None:
+            rollup[metric.name] = [own, 1, metric.description]
+        else:
+            entry[0] += own
+            entry[1] += 1
+    return [
+        Entry(name, _counted(description, count), duration)
+        for name, (duration, count, description) in rollup.items()
+    ]
+
+
+def render_header(
+    metrics: Iterable["ServerTimingMetric"],
+    max_bytes: int | None = None,
+    mode: HeaderMode = "flat",
+    leading: str | None = None,
+) -> str:
+    """
+    Renders the Server-Timing header value for the given metrics.
+
+    The ``mode`` selects what is rendered: every metric ("flat"), only metrics
+    without a parent ("top-level", so that nested time is not counted twice), or
+    the self time of the metrics summed by name ("self").
+
+    Without a budget, every metric is rendered in order. With ``max_bytes``,
+    same-named metrics are folded into one entry (sum of durations, with the count
+    appended to the description) and entries are rendered longest first until the
+    budget is reached. The remaining entries are replaced by a
+    ``truncated;desc="N more"`` marker; past the budget, no entry is formatted.
+
+    A ``leading`` entry (e.g. the ``traceparent``) is rendered first, and counts
+    against the budget. It is dropped if it alone exceeds the budget.
+    """
+    if leading is not None and (max_bytes is None or len(leading) <= max_bytes):
+        if max_bytes is not None:
+            max_bytes = max(0, max_bytes - len(leading) - len(SEPARATOR))
+        rendered = render_header(metrics, max_bytes, mode)
+        return leading + SEPARATOR + rendered if rendered else leading
+
+    if mode == "top-level":
+        metrics = [metric for metric in metrics if metric.parent is None]
+    elif mode == "self":
+        metrics = self_time_rollup(metrics)
+    elif mode != "flat":
+        raise ValueError(f"Header mode must be one of {', '.join(HEADER_MODES)}")
+
+    if max_bytes is None:
+        return SEPARATOR.join(str(metric) for metric in metrics)
+
+    return _budgeted(_fold(metrics), max_bytes)
+
+
+def _fold(metrics: Iterable) -> list[tuple[str, list]]:
+    """Folds same-named metrics into (name, [duration, count, description]) items."""
+    folded: dict[str, list] = {}
+    for metric in metrics:
+        duration = metric.reported_duration
+        entry = folded.get(metric.name)
+        if entry is None:
+            folded[metric.name] = [duration, 1, metric.description]
+            continue
+        # The duration stays None unless one of the metrics has one
+        if duration is not None:
+            entry[0] = duration if entry[0] is None else entry[0] + duration
+        entry[1] += 1
+    # Slowest first
+    return sorted(folded.items(), key=lambda item: item[1][0] or 0.0, reverse=True)
+
+
+def _budgeted(entries: list[tuple[str, list]], max_bytes: int) -> str:
+    # Room for the marker, sized for the worst case of dropping every entry
+    reserved = len(SEPARATOR) + len(_truncated_marker(len(entries)))
+
+    parts = []
+    size = 0
+    # The number of leading parts that still leave room for the marker
+    keep = 0
+    for name, (duration, count, description) in entries:
+        part = format_metric(name, _counted(description, count), duration)
+        part_size = len(part) if part.isascii() else len(part.encode())
+        if parts:
+            part_size += len(SEPARATOR)
+        if size + part_size > max_bytes:
+            break
+        parts.append(part)
+        size += part_size
+        if size + reserved <= max_bytes:
+            keep = len(parts)
+    else:
+        return SEPARATOR.join(parts)
+
+    marker = _truncated_marker(len(entries) - keep)
+    if not keep and len(marker) > max_bytes:
+        # Not even the marker fits
+        return ""
+    return SEPARATOR.join([*parts[:keep], marker])
+
+
+def _counted(description: str | None, count: int) -> str | None:
+    if count > 1:
+        return f"{description} (x{count})" if description else f"x{count}"
+    return description
+
+
+def _truncated_marker(dropped: int) -> str:
+    return f'truncated;desc="{dropped} more";'
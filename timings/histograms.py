@@ -0,0 +1,210 @@
+import math
+import re
+import threading
+import time
+from collections.abc import Callable
+
+from .exporters import Sink
+
+WINDOWS = {"1m": 60.0, "5m": 300.0, "1h": 3600.0}
+
+# Routes of requests that did not match a route (e.g. 404s)
+UNMATCHED_ROUTE = "<unmatched>"
+# Series beyond ``max_series`` are folded into this route, and beyond
+# ``max_overflow_series`` also into this metric name
+OTHER_ROUTE = "<other>"
+OTHER_NAME = "<other>"
+# The metric name the duration of whole requests is aggregated under
+REQUEST_NAME = "request"
+
+# The numbered metrics of the per-query DB mode
+_NUMBERED_DB = re.compile(r"db_\d+")
+
+
+def series_name(name: str) -> str:
+    """
+    Returns the name a metric is aggregated under: the numbered per-query metrics
+    (``db_1``, ``db_2``, ...) are all ``db``, so that they do not add series.
+    """
+    return "db" if _NUMBERED_DB.fullmatch(name) else name
+
+
+class LogHistogram:
+    """
+    A log-bucketed histogram of durations in milliseconds.
+
+    Bucket boundaries grow by ``growth``, so quantiles have a relative error of at
+    most ``(growth - 1) / 2``. Only non-empty buckets are stored.
+    """
+
+    __slots__ = ("growth", "minimum", "_log_growth", "counts", "count", "sum")
+
+    def __init__(self, growth: float = 1.1, minimum: float = 0.001):
+        self.growth = growth
+        self.minimum = minimum
+        self._log_growth = math.log(growth)
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float) -> None:
+        if value <= self.minimum:
+            index = 0
+        else:
+            index = int(math.log(value / self.minimum) / self._log_growth) + 1
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "LogHistogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float | None:
+        """Returns the value below which a fraction ``q`` of the durations falls."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self._value(index)
+        return self._value(max(self.counts))
+
+    def _value(self, index: int) -> float:
+        if index == 0:
+            return self.minimum
+        # The geometric middle of the bucket
+        return self.minimum * self.growth ** (index - 0.5)
+
+
+class HistogramRegistry(Sink):
+    """
+    Rolling latency histograms per (route template, metric name).
+
+    Each series keeps one histogram per ``slice_seconds`` for up to
+    ``retention_seconds``, so that quantiles can be queried for any window up to the
+    retention (e.g. "1m", "5m" or "1h"). The number of series is bounded by
+    ``max_series``, beyond which metrics are folded into the ``OTHER_ROUTE`` route,
+    and by ``max_overflow_series`` for those, beyond which they are also folded into
+    the ``OTHER_NAME`` name. Numbered per-query metrics are aggregated as ``db``, and
+    the duration of the requests as ``REQUEST_NAME``. The slices of a series are
+    allocated as they are first written to.
+
+    Use it as an exporter sink, so that it is fed from the exporter's worker thread;
+    request threads then never contend for its lock:
+
+    .. code-block:: python
+
+        histograms = HistogramRegistry()
+        exporter = Exporter([LoggingSink(logger), histograms])
+        ...
+        histograms.quantile("/api/procedures", "db", 0.99, window="5m")
+    """
+
+    def __init__(
+        self,
+        slice_seconds: float = 10.0,
+        retention_seconds: float = 3600.0,
+        max_series: int = 1000,
+        growth: float = 1.1,
+        clock: Callable[[], float] = time.time,
+        max_overflow_series: int = 100,
+    ):
+        self.slice_seconds = slice_seconds
+        self.slices = math.ceil(retention_seconds / slice_seconds)
+        self.max_series = max_series
+        self.max_overflow_series = max_overflow_series
+        self.growth = growth
+        self.clock = clock
+        # (route, name) -> ring of slice index -> [slice number, histogram]
+        self._series: dict[tuple[str, str], dict[int, list]] = {}
+        self._overflow_series = 0
+        self._lock = threading.Lock()
+
+    def write(self, batch: list[dict]) -> None:
+        with self._lock:
+            for record in batch:
+                self._record(record)
+
+    def record(self, record: dict) -> None:
+        """Adds the durations of a single exported record."""
+        with self._lock:
+            self._record(record)
+
+    def observe(self, route: str | None, name: str, duration: float) -> None:
+        with self._lock:
+            self._histogram(route, name, self._slice()).add(duration)
+
+    def _record(self, record: dict) -> None:
+        now = self._slice()
+        route = record.get("route")
+        duration = record.get("duration")
+        if duration is not None:
+            self._histogram(route, REQUEST_NAME, now).add(duration)
+        for metric in record["timings"]:
+            # Metrics without a duration (e.g. alloc) have nothing to aggregate
+            if metric["duration"] is None:
+                continue
+            # The request metric of some integrations is the request duration again
+            if duration is not None and metric["name"] == REQUEST_NAME:
+                continue
+            self._histogram(route, metric["name"], now).add(metric["duration"])
+
+    def _slice(self) -> int:
+        return int(self.clock() // self.slice_seconds)
+
+    def _histogram(self, route: str | None, name: str, number: int) -> LogHistogram:
+        name = series_name(name)
+        key = (route or UNMATCHED_ROUTE, name)
+        ring = self._series.get(key)
+        routed = len(self._series) - self._overflow_series
+        if ring is None and routed >= self.max_series:
+            key = (OTHER_ROUTE, name)
+            ring = self._series.get(key)
+            if ring is None and self._overflow_series >= self.max_overflow_series:
+                key = (OTHER_ROUTE, OTHER_NAME)
+                ring = self._series.get(key)
+            if ring is None:
+                self._overflow_series += 1
+        if ring is None:
+            ring = self._series[key] = {}
+
+        slot = ring.get(number % self.slices)
+        if slot is None:
+            slot = ring[number % self.slices] = [number, LogHistogram(self.growth)]
+        elif slot[0] != number:
+            slot[0] = number
+            slot[1] = LogHistogram(self.growth)
+        return slot[1]
+
+    def series(self) -> list[tuple[str, str]]:
+        """Returns the (route, metric name) keys with data."""
+        with self._lock:
+            return list(self._series)
+
+    def histogram(
+        self, route: str | None, name: str, window: str | float = "5m"
+    ) -> LogHistogram:
+        """Returns the merged histogram of a series over the last ``window``."""
+        if isinstance(window, str) and window not in WINDOWS:
+            raise ValueError(f"Window must be one of {', '.join(WINDOWS)}")
+        seconds = WINDOWS[window] if isinstance(window, str) else window
+        newest = self._slice()
+        oldest = newest - min(math.ceil(seconds / self.slice_seconds), self.slices) + 1
+        merged = LogHistogram(self.growth)
+        with self._lock:
+            ring = self._series.get((route or UNMATCHED_ROUTE, series_name(name)), {})
+            for number, histogram in ring.values():
+                if oldest <= number <= newest:
+                    merged.merge(histogram)
+        return merged
+
+    def quantile(
+        self, route: str | None, name: str, q: float, window: str | float = "5m"
+    ) -> float | None:
+        """Returns the ``q`` quantile (0.0 - 1.0) of a series over the last ``window``."""
+        return self.histogram(route, name, window).quantile(q)
@@ -0,0 +1,69 @@
+from collections.abc import Sequence
+from typing import Literal
+
+from .models import ServerTimingMetric, ServerTimings
+from .sql import QueryAggregator, fingerprint
+
+DBMode = Literal["per-query", "aggregated", "both"]
+DB_MODES = ("per-query", "aggregated", "both")
+
+
+class RequestInstruments:
+    """
+    The instruments started for a request, finished exactly once.
+
+    The integrations finish them when the response starts, and again in their
+    cleanup, which only has an effect if the request failed before: instruments
+    that are never finished keep their state (e.g. allocation tracing) running.
+    """
+
+    __slots__ = ("instruments", "finished")
+
+    def __init__(self, instruments: Sequence, timings: ServerTimings):
+        self.instruments = instruments
+        self.finished = False
+        for instrument in instruments:
+            instrument.start(timings)
+
+    def finish(self) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        for instrument in self.instruments:
+            instrument.finish()
+
+
+def check_db_mode(mode: str) -> None:
+    if mode not in DB_MODES:
+        raise ValueError(f"Mode must be one of {', '.join(DB_MODES)}")
+
+
+def describe_query(sql: str) -> str:
+    """Describes a query by its operation and table, short queries by themselves."""
+    if len(sql) < 20:
+        return sql
+    return fingerprint(sql).description
+
+
+def add_query_metrics(
+    timings: ServerTimings, queries: QueryAggregator, mode: DBMode
+) -> None:
+    """
+    Adds a ``db-group`` metric per query fingerprint (unless ``mode`` is
+    "per-query"), and a ``db-dup`` metric per duplicated fingerprint.
+    """
+    if mode != "per-query":
+        for group in queries.groups.values():
+            ServerTimingMetric(
+                name="db-group",
+                description=group.summary(),
+                duration=group.total,
+                timings=timings,
+            )
+    for group in queries.duplicates:
+        ServerTimingMetric(
+            name="db-dup",
+            description=f"{group.summary()} at {group.callsite}",
+            duration=group.total,
+            timings=timings,
+        )
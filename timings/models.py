@@ -1,9 +1,43 @@
-import json
+import sys
 import time
-from contextlib import contextmanager
-from typing import Literal
+from collections.abc import Callable
+from contextvars import ContextVar, Token
+from typing import TYPE_CHECKING, Literal
 
-from .storage import Storage
+from .buffer import RELEASED, BufferPool
+from .header import child_durations, format_metric
+from .storage import Storage, current
+
+if TYPE_CHECKING:
+    from .tracecontext import TraceContext
+
+# Metric buffers are recycled across requests to avoid regrowing them every time
+buffer_pool = BufferPool()
+
+# Returns the current time in integer nanoseconds, see set_clock
+_clock: Callable[[], int] = time.perf_counter_ns
+
+
+def set_clock(clock: Callable[[], int] | None = None) -> None:
+    """
+    Sets the clock metrics are timed with, e.g. a fake clock in tests.
+
+    The clock returns integer nanoseconds and must be monotonic. ``None`` restores
+    the default, ``time.perf_counter_ns``.
+    """
+    global _clock
+    _clock = time.perf_counter_ns if clock is None else clock
+
+
+def clock() -> int:
+    """Returns the current time of the clock metrics are timed with, in nanoseconds."""
+    return _clock()
+
+
+# The innermost running metric, which becomes the parent of metrics started within it
+_current_metric: ContextVar["ServerTimingMetric | None"] = ContextVar(
+    "server_timings_current_metric", default=None
+)
 
 
 class ServerTimings:
@@ -14,20 +48,28 @@ class ServerTimings:
     meaning it will return the same instance for the same request context.
     It is designed to be used in a request lifecycle,
     where you can set it up at the beginning of a request and tear it down at the end.
+
+    Outside a request, it returns a shared null instance discarding all metrics.
     """
 
+    request_id: str | None
+    # A timings.tracecontext.TraceContext, if the request is traced
+    trace: "TraceContext | None"
+    # When the timings were set up, by the metrics' clock and in ns since the epoch
+    start_ns: int
+    started_at: int
+
+    # A timings.profiler.StackSampler profiling every request, if set
+    profiler = None
+
     def __new__(cls, *args, **kwargs):
-        store = Storage.get()
-        if "instance" not in store:
-            inst = super().__new__(cls)
-            inst._metrics = []
-            store["instance"] = inst
-        return store["instance"]
+        instance = _current_timings()
+        return instance if instance is not None else NULL_TIMINGS
 
     @property
     def metrics(self):
         """Returns the list of metrics for the current instance."""
-        return self._metrics
+        return self._metrics.to_list()
 
     def discard_all(self):
         """Clears all metrics from the current instance."""
@@ -44,41 +86,139 @@ class ServerTimings:
                 raise ValueError(
                     "Cannot add a metric to a different ServerTimings instance"
                 )
-        self._metrics.append(metric)
+        self._metrics.append(metric, self)
+
+    def dump(self, tree: bool = False) -> list:
+        """
+        Returns a JSON representation of the timings.
 
-    def dump(self) -> list:
-        """Returns a JSON representation of the timings."""
-        return [
-            {"duration": m.duration, "name": m.name, "description": m.description}
-            for m in self.metrics
-        ]
+        The ``start`` of a metric is the time from the setup of the timings to its
+        start in ms, or None if it was given its duration. Its ``parent`` is the
+        index of the metric it was started within, or None. Metrics that were neither
+        given a duration nor started (e.g. ``alloc``) have a None ``duration``.
+
+        With ``tree=True``, metrics are nested under the metric they were started
+        within, and each one also reports its ``self_duration``: its duration minus
+        that of its children.
+        """
+        start_ns = self.start_ns
+        if not tree:
+            # Metrics are added when created, so parents come before their children
+            indexes: dict[int, int] = {}
+            dumped = []
+            for index, m in enumerate(self._metrics):
+                parent = m.parent
+                dumped.append(
+                    {
+                        "duration": m.reported_duration,
+                        "name": m.name,
+                        "description": m.description,
+                        "start": None
+                        if m._start_ns is None
+                        else (m._start_ns - start_ns) / 1_000_000,
+                        "parent": None if parent is None else indexes.get(id(parent)),
+                    }
+                )
+                indexes[id(m)] = index
+            return dumped
+
+        metrics = self._metrics.to_list()
+        children_durations = child_durations(metrics)
+        nodes: dict[int, dict] = {}
+        roots = []
+        for m in metrics:
+            duration = m.reported_duration
+            node = nodes[id(m)] = {
+                "duration": duration,
+                "self_duration": None
+                if duration is None
+                else max(0.0, duration - children_durations.get(id(m), 0.0)),
+                "name": m.name,
+                "description": m.description,
+                "start": None
+                if m._start_ns is None
+                else (m._start_ns - start_ns) / 1_000_000,
+                "children": [],
+            }
+            parent = nodes.get(id(m.parent)) if m.parent is not None else None
+            (parent["children"] if parent is not None else roots).append(node)
+        return roots
+
+    def _release(self):
+        """Returns the metric buffer to the pool; later metrics are discarded."""
+        buffer, self._metrics = self._metrics, RELEASED
+        buffer_pool.release(buffer)
 
     @classmethod
     def setUp(cls, mode: Literal["sync", "async"]):
-        """SetUp ServerTimings for the current request."""
-        Storage.bind(mode)
+        """
+        SetUp ServerTimings for the current request.
+
+        Both modes store the instance in a ContextVar. With a ``profiler``, the
+        request is profiled: in "sync" mode its thread, in "async" mode the task
+        running the caller of ``setUp``.
+        """
+        if mode not in ("sync", "async"):
+            raise ValueError("Mode must be 'sync' or 'async'")
+        instance = super().__new__(cls)
+        instance._metrics = buffer_pool.acquire(instance)
+        # Assigned when the timings are propagated, see timings.propagation
+        instance.request_id = None
+        # Assigned by the integrations, see timings.tracecontext
+        instance.trace = None
+        instance.start_ns = _clock()
+        instance.started_at = time.time_ns()
+        instance.profile = None
+        if cls.profiler is not None:
+            instance.profile = cls.profiler.start(
+                instance, sys._getframe(1) if mode == "async" else None
+            )
+        Storage.bind(instance)
 
     @classmethod
     def tearDown(cls):
         """TearDowbn ServerTimings for the current request."""
+        instance = Storage.get()
+        if instance is not None:
+            if instance.profile is not None:
+                instance.profile.stop()
+            instance._release()
         Storage.cleanup()
 
 
+_current_timings = current.get
+
+# Returned outside of requests; its buffer discards every metric
+NULL_TIMINGS = object.__new__(ServerTimings)
+NULL_TIMINGS._metrics = RELEASED
+NULL_TIMINGS.request_id = None
+NULL_TIMINGS.trace = None
+NULL_TIMINGS.start_ns = NULL_TIMINGS.started_at = 0
+NULL_TIMINGS.profile = None
+
+
 class ServerTimingMetric:
     """A class representing a server timing metric."""
 
-    _start_time: float | None
-    _end_time: float | None
+    __slots__ = (
+        "name",
+        "description",
+        "timings",
+        "parent",
+        "_nest",
+        "_duration",
+        "_start_ns",
+        "_token",
+    )
+
+    parent: "ServerTimingMetric | None"
+    _start_ns: int | None
+    # Predefined, or computed when the metric ends
     _duration: float | None
+    _token: Token | None
 
     def __str__(self):
-        res = self.name + ";"
-        if self.description is not None:
-            res += f"desc={json.dumps(self.description)};"
-
-        if self.duration:
-            res += f"dur={self.duration:.2f};"
-        return res
+        return format_metric(self.name, self.description, self.reported_duration)
 
     def __init__(
         self,
@@ -87,44 +227,147 @@ class ServerTimingMetric:
         duration: float | None = None,
         timings: ServerTimings | None = None,
     ):
-        self.name = name.replace(" ", "-")
-        self.description = description
-        self._duration = duration
-        self._start_time = self._end_time = None
         # Use provided timings or create a new instance
-        self.timings = timings or ServerTimings()
+        self._set_up(
+            name.replace(" ", "-"), description, duration, timings or ServerTimings()
+        )
 
-        if self._duration:
+        if self._duration is not None:
+            self.parent = self._running_parent()
             self.timings.add(self)
 
-    @contextmanager
-    def measure(self):
-        self.start()
-        yield
+    def _set_up(
+        self,
+        name: str,
+        description: str | None,
+        duration: float | None,
+        timings: ServerTimings,
+    ) -> None:
+        # Sets every slot, also for MetricTemplate.new, which skips __init__
+        self.name = name
+        self.description = description
+        self._duration = duration
+        self._start_ns = None
+        self._token = None
+        self._nest = True
+        self.timings = timings
+        self.parent = None
+
+    def measure(self, nest: bool = True) -> "ServerTimingMetric":
+        """Returns the metric, to be measured with ``with`` or ``async with``."""
+        self._nest = nest
+        return self
+
+    def __enter__(self) -> "ServerTimingMetric":
+        self.start(self._nest)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
         self.end()
 
-    def start(self):
-        if self._duration is not None:
+    async def __aenter__(self) -> "ServerTimingMetric":
+        self.start(self._nest)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.end()
+
+    def start(self, nest: bool = True):
+        """
+        Starts the metric.
+
+        The metric becomes a child of the innermost running metric of the same
+        timings. Unless ``nest`` is False, metrics started before it ends become its
+        children.
+        """
+        if self._start_ns is None and self._duration is not None:
             raise ValueError("Cannot start a metric with a duration")
-        self._start_time = time.monotonic()
-        self.timings.add(self)
+        timings = self.timings
+        # Inlined _running_parent(), this runs for every timed call
+        current = _current_metric.get()
+        self.parent = (
+            current if current is not None and current.timings is timings else None
+        )
+        if nest:
+            self._token = _current_metric.set(self)
+        # Restarted metrics are timed anew
+        self._duration = None
+        self._start_ns = _clock()
+        # The metric belongs to these timings, so the checks of add() are not needed
+        timings._metrics.append(self, timings)
 
     def end(self):
-        if self._duration is not None:
-            raise ValueError("Cannot end a metric with a duration")
-        if self._start_time is None:
+        end = _clock()
+        if self._start_ns is None:
+            if self._duration is not None:
+                raise ValueError("Cannot end a metric with a duration")
             raise ValueError("Cannot end a metric that has not been started")
-        self._end_time = time.monotonic()
+        self._duration = (end - self._start_ns) / 1_000_000
+        if self._token is not None:
+            token, self._token = self._token, None
+            try:
+                _current_metric.reset(token)
+            except ValueError:
+                # Ended in another context than it was started in (e.g. a callback)
+                if _current_metric.get() is self:
+                    _current_metric.set(self.parent)
+
+    def _running_parent(self) -> "ServerTimingMetric | None":
+        current = _current_metric.get()
+        # Ignore metrics of other requests leaking through a copied context
+        if current is not None and current.timings is self.timings:
+            return current
+        return None
 
     @property
     def duration(self) -> float:
         """
         Returns the duration of the metric:
         - If a metric has a predefined duration, it will return that duration.
+        - If a metric has ended, it will return the duration computed when it ended.
         - If a metric has only been started, it will return the difference to the current time.
         """
         if self._duration is not None:
             return self._duration
-        if self._start_time is None:
+        if self._start_ns is None:
             return 0.0  # Return 0 if the metric hasn't started
-        return ((self._end_time or time.monotonic()) - self._start_time) * 1000.0
+        return (_clock() - self._start_ns) / 1_000_000
+
+    @property
+    def reported_duration(self) -> float | None:
+        """
+        The duration rendered and exported: None for metrics that were neither given
+        a duration nor started (e.g. ``alloc``), instead of 0.0.
+        """
+        if self._duration is None and self._start_ns is None:
+            return None
+        return self.duration
+
+
+class MetricTemplate:
+    """
+    The name and description of a metric recorded over and over, e.g. by ``timed``.
+
+    The name is normalized once, and :meth:`new` skips the checks of
+    ``ServerTimingMetric.__init__``, which only matters on hot paths.
+    """
+
+    __slots__ = ("name", "description")
+
+    def __init__(self, name: str, description: str | None = None):
+        self.name = name.replace(" ", "-")
+        self.description = description
+
+    def new(self, timings: ServerTimings | None = None) -> ServerTimingMetric:
+        """Returns a new, not yet started metric."""
+        metric = _new_metric(ServerTimingMetric)
+        metric._set_up(
+            self.name,
+            self.description,
+            None,
+            ServerTimings() if timings is None else timings,
+        )
+        return metric
+
+
+_new_metric = object.__new__
@@ -0,0 +1,193 @@
+import json
+from collections.abc import Callable
+
+from . import __version__
+from .exporters import Sink
+from .tracecontext import is_sampled, new_span_id
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_CODE_ERROR = 2
+
+
+def to_spans(record: dict) -> list[dict]:
+    """
+    Converts the exported record of a traced request into OTLP spans.
+
+    The request is a span of its own, with the span ID of the ``traceparent`` entry
+    of its header. Its measured metrics become its descendant spans, children of the
+    metric they were started within or of the request, and metrics given
+    their duration (e.g. ``cpu``) become attributes of it, in ms. Records of
+    requests that were not traced, or whose caller did not sample the trace, have
+    no spans.
+    """
+    trace_id = record.get("trace_id")
+    if trace_id is None or not is_sampled(record.get("trace_flags", "01")):
+        return []
+    span_id = record["span_id"]
+    start = record["start_time"]
+    end = start
+    children = []
+    attributes: dict[str, object] = {}
+    # index of a metric in the record -> its span ID
+    metric_span_ids: dict[int, str] = {}
+    for index, metric in enumerate(record["timings"]):
+        duration = metric["duration"]
+        if duration is None:
+            continue
+        if metric.get("start") is None:
+            key = f"server_timing.{metric['name']}"
+            attributes[key] = attributes.get(key, 0.0) + duration
+            continue
+        metric_start = start + int(metric["start"] * 1_000_000)
+        metric_end = metric_start + int(duration * 1_000_000)
+        end = max(end, metric_end)
+        metric_span_id = metric_span_ids[index] = new_span_id()
+        children.append(
+            _span(
+                trace_id,
+                metric_span_id,
+                metric_span_ids.get(metric.get("parent"), span_id),
+                metric["name"],
+                SPAN_KIND_INTERNAL,
+                metric_start,
+                metric_end,
+                {"server_timing.description": metric["description"]},
+            )
+        )
+
+    if record.get("duration") is not None:
+        end = start + int(record["duration"] * 1_000_000)
+    status = record.get("status")
+    attributes.update(
+        {
+            "url.path": record.get("path"),
+            "http.route": record.get("route"),
+            "http.response.status_code": status,
+            "server_timings.request_id": record.get("request_id"),
+        }
+    )
+    request = _span(
+        trace_id,
+        span_id,
+        record.get("parent_span_id"),
+        record.get("route") or record.get("path") or "request",
+        # Records without a path are of work done outside requests
+        SPAN_KIND_SERVER if record.get("path") is not None else SPAN_KIND_INTERNAL,
+        start,
+        end,
+        attributes,
+    )
+    if status is not None and status >= 500:
+        request["status"] = {"code": STATUS_CODE_ERROR}
+    return [request, *children]
+
+
+def to_otlp(batch: list[dict], resource: dict[str, object]) -> dict:
+    """Converts a batch of records into an OTLP/JSON ``ExportTraceServiceRequest``."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _attributes(resource)},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "server-timings", "version": __version__},
+                        "spans": [
+                            span for record in batch for span in to_spans(record)
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _span(
+    trace_id: str,
+    span_id: str,
+    parent_span_id: str | None,
+    name: str,
+    kind: int,
+    start: int,
+    end: int,
+    attributes: dict[str, object],
+) -> dict:
+    span = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": kind,
+        # 64-bit integers are strings in the JSON encoding of protobuf
+        "startTimeUnixNano": str(start),
+        "endTimeUnixNano": str(end),
+        "attributes": _attributes(attributes),
+    }
+    if parent_span_id is not None:
+        span["parentSpanId"] = parent_span_id
+    return span
+
+
+def _attributes(attributes: dict[str, object]) -> list[dict]:
+    converted = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            converted.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            converted.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            converted.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            converted.append({"key": key, "value": {"stringValue": str(value)}})
+    return converted
+
+
+class OTLPSink(Sink):
+    """
+    Converts the records of traced requests into OTLP spans, without the
+    OpenTelemetry SDK.
+
+    An exporter sink, so that the conversion runs on the exporter's worker thread.
+    Each batch is passed to ``send`` as an OTLP/JSON ``ExportTraceServiceRequest``
+    (e.g. to post it to a collector's ``/v1/traces``). Batches without traced
+    requests are not sent.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[dict], None],
+        service_name: str = "server-timings",
+        resource: dict[str, object] | None = None,
+    ):
+        self.send = send
+        self.resource = {"service.name": service_name, **(resource or {})}
+
+    def write(self, batch: list[dict]) -> None:
+        payload = to_otlp(batch, self.resource)
+        if payload["resourceSpans"][0]["scopeSpans"][0]["spans"]:
+            self.send(payload)
+
+
+class OTLPFileSink(OTLPSink):
+    """
+    Appends each batch as a JSON line to a file, in the format of the OpenTelemetry
+    Collector's file exporter (readable by its ``otlpjsonfile`` receiver).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        service_name: str = "server-timings",
+        resource: dict[str, object] | None = None,
+    ):
+        super().__init__(self._write_line, service_name, resource)
+        self.file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+
+    def _write_line(self, payload: dict) -> None:
+        self.file.write(json.dumps(payload) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
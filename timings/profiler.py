@@ -0,0 +1,197 @@
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from types import FrameType
+
+logger = logging.getLogger(__name__)
+
+
+class Profile:
+    """The stack samples of one request, see :class:`StackSampler`."""
+
+    __slots__ = ("sampler", "timings", "thread_id", "frame_id", "start", "samples")
+
+    def __init__(self, sampler: "StackSampler", timings, thread_id: int, frame_id):
+        self.sampler = sampler
+        self.timings = timings
+        self.thread_id = thread_id
+        self.frame_id = frame_id
+        self.start = time.monotonic()
+        # Stacks of (code, line number), innermost frame first
+        self.samples: deque[tuple] = deque(maxlen=sampler.max_samples)
+
+    def stop(self) -> None:
+        self.sampler.stop(self)
+
+    def collapsed(self) -> dict[str, int]:
+        """Returns the sample counts per stack, in the collapsed-stack format."""
+        counts: dict[str, int] = {}
+        for stack in self.samples:
+            key = ";".join(
+                f"{code.co_name} ({code.co_filename}:{line})"
+                for code, line in reversed(stack)
+            )
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+class StackSampler:
+    """
+    A sampling profiler writing flamegraph-compatible profiles of slow requests.
+
+    Enable it for all integrations with ``ServerTimings.profiler = StackSampler()``;
+    ``ServerTimings.setUp`` then starts a :class:`Profile` per request. A
+    background thread samples the stacks of the profiled requests every
+    ``interval`` seconds, keeping the last ``max_samples`` per request. Requests
+    taking at least ``slow_threshold_ms`` get a ``<request_id>.collapsed`` file in
+    ``directory`` (written by the background thread); the samples of faster
+    requests are dropped.
+
+    Sync requests are sampled while their thread runs, including when it waits
+    for I/O. Async requests are only sampled while their task runs, so the
+    profile shows where they used the event loop.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.01,
+        slow_threshold_ms: float = 1000.0,
+        max_samples: int = 1000,
+        directory: str = "profiles",
+    ):
+        self.interval = interval
+        self.slow_threshold_ms = slow_threshold_ms
+        self.max_samples = max_samples
+        self.directory = directory
+        self.written = 0
+        # Sync requests by thread (nested ones, e.g. inline work, innermost last),
+        # async requests by thread and frame
+        self._threads: dict[int, list[Profile]] = {}
+        self._tasks: dict[int, dict[int, Profile]] = {}
+        self._pending: list[Profile] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._worker: threading.Thread | None = None
+
+    def start(self, timings, frame: FrameType | None = None) -> Profile:
+        """
+        Starts profiling the request of ``timings``: the current thread, or with a
+        ``frame``, the task running that frame.
+        """
+        if timings.request_id is None:
+            timings.request_id = uuid.uuid4().hex
+        thread_id = threading.get_ident()
+        frame_id = None if frame is None else id(frame)
+        profile = Profile(self, timings, thread_id, frame_id)
+        with self._lock:
+            if frame is None:
+                self._threads.setdefault(thread_id, []).append(profile)
+            else:
+                self._tasks.setdefault(thread_id, {})[id(frame)] = profile
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="server-timings-profiler", daemon=True
+                )
+                self._worker.start()
+        self._wake.set()
+        return profile
+
+    def stop(self, profile: Profile) -> None:
+        """Stops profiling a request, queueing its profile if it was slow."""
+        duration = (time.monotonic() - profile.start) * 1000.0
+        with self._lock:
+            if profile.frame_id is None:
+                profiles = self._threads.get(profile.thread_id, [])
+                if profile in profiles:
+                    profiles.remove(profile)
+                if not profiles:
+                    self._threads.pop(profile.thread_id, None)
+            else:
+                frames = self._tasks.get(profile.thread_id, {})
+                frames.pop(profile.frame_id, None)
+                if not frames:
+                    self._tasks.pop(profile.thread_id, None)
+            if duration >= self.slow_threshold_ms and profile.samples:
+                self._pending.append(profile)
+
+    def flush(self) -> None:
+        """Writes the queued profiles."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for profile in pending:
+            try:
+                self.write(profile)
+            except OSError:
+                logger.exception("[StackSampler] Failed to write profile")
+
+    def write(self, profile: Profile) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{profile.timings.request_id}.collapsed")
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in profile.collapsed().items():
+                file.write(f"{stack} {count}\n")
+        self.written += 1
+
+    def close(self) -> None:
+        """Stops the background thread and writes the queued profiles."""
+        with self._lock:
+            self._closed = True
+            self._wake.set()
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._closed:
+            with self._lock:
+                idle = not self._threads and not self._tasks and not self._pending
+                if idle and not self._closed:
+                    self._wake.clear()
+            if idle:
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+            self._sample()
+            self.flush()
+
+    def _sample(self) -> None:
+        with self._lock:
+            threads = [
+                (thread, list(profiles)) for thread, profiles in self._threads.items()
+            ]
+            tasks = [(thread, dict(frames)) for thread, frames in self._tasks.items()]
+        current = sys._current_frames()
+
+        for thread_id, profiles in threads:
+            frame = current.get(thread_id)
+            if frame is not None:
+                # Nested requests run within the outer ones, which include them
+                stack = _stack(frame)
+                for profile in profiles:
+                    profile.samples.append(stack)
+
+        for thread_id, frames in tasks:
+            frame = current.get(thread_id)
+            stack = []
+            owner = None
+            while frame is not None:
+                stack.append((frame.f_code, frame.f_lineno))
+                if owner is None:
+                    owner = frames.get(id(frame))
+                frame = frame.f_back
+            if owner is not None:
+                owner.samples.append(tuple(stack))
+
+
+def _stack(frame: FrameType | None) -> tuple:
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    return tuple(stack)
@@ -0,0 +1,290 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+
+from .exporters import Sink
+from .histograms import OTHER_NAME, OTHER_ROUTE, series_name
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_FAMILY = "server_timings_request_duration_seconds"
+METRIC_FAMILY = "server_timings_metric_duration_seconds"
+
+_MAGIC = b"STIMv001"
+# magic, used bytes, values per entry
+_HEADER = struct.Struct("<8sQQ")
+_KEY_LENGTH = struct.Struct("<Q")
+
+
+class AggregateTable:
+    """
+    A table of float vectors keyed by string, stored in a memory map.
+
+    With a ``path``, the map is backed by a file that other processes can read with
+    :func:`read_table`. Entries are only appended, so readers never see keys move.
+    Only one thread of one process may write to a table.
+    """
+
+    def __init__(
+        self, values: int, path: str | None = None, initial_size: int = 1 << 16
+    ):
+        self.values = values
+        self.path = path
+        self._vector = struct.Struct(f"<{values}d")
+        self._positions: dict[str, int] = {}
+        self._file = None
+        if path is None:
+            self._map = mmap.mmap(-1, initial_size)
+            self._used = _HEADER.size
+            self._write_header()
+        else:
+            self._file = open(path, "a+b")  # noqa: SIM115
+            size = os.fstat(self._file.fileno()).st_size
+            if size < _HEADER.size:
+                self._file.truncate(initial_size)
+                size = initial_size
+            self._map = mmap.mmap(self._file.fileno(), size)
+            if self._map[: len(_MAGIC)] != _MAGIC:
+                self._used = _HEADER.size
+                self._write_header()
+            else:
+                for key, position in _entries(self._map, self._vector):
+                    self._positions[key] = position
+                self._used = _HEADER.unpack_from(self._map)[1]
+
+    def add(self, key: str, values: list[float]) -> None:
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        current = self._vector.unpack_from(self._map, position)
+        self._vector.pack_into(
+            self._map, position, *(a + b for a, b in zip(current, values, strict=True))
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def items(self) -> dict[str, tuple[float, ...]]:
+        return dict(_entries(self._map, self._vector, values=True))
+
+    def close(self) -> None:
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode()
+        padded = len(encoded) + (-len(encoded) % 8)
+        size = _KEY_LENGTH.size + padded + self._vector.size
+        if self._used + size > len(self._map):
+            self._grow(self._used + size)
+
+        offset = self._used
+        _KEY_LENGTH.pack_into(self._map, offset, len(encoded))
+        self._map[
+            offset + _KEY_LENGTH.size : offset + _KEY_LENGTH.size + len(encoded)
+        ] = encoded
+        position = offset + _KEY_LENGTH.size + padded
+        self._vector.pack_into(self._map, position, *([0.0] * self.values))
+        self._used += size
+        # Publish the entry only once it is complete
+        self._write_header()
+        self._positions[key] = position
+        return position
+
+    def _grow(self, needed: int) -> None:
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        if self._file is None:
+            grown = mmap.mmap(-1, size)
+            grown[: len(self._map)] = self._map[:]
+        else:
+            self._map.flush()
+            self._file.truncate(size)
+            grown = mmap.mmap(self._file.fileno(), size)
+        self._map.close()
+        self._map = grown
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(self._map, 0, _MAGIC, self._used, self.values)
+
+
+def read_table(path: str) -> dict[str, tuple[float, ...]]:
+    """Reads the entries of a file-backed table written by another process."""
+    data = Path(path).read_bytes()
+    if len(data) < _HEADER.size or data[: len(_MAGIC)] != _MAGIC:
+        return {}
+    values = _HEADER.unpack_from(data)[2]
+    return dict(_entries(data, struct.Struct(f"<{values}d"), values=True))
+
+
+def _entries(data, vector: struct.Struct, values: bool = False):
+    used = _HEADER.unpack_from(data)[1]
+    offset = _HEADER.size
+    while offset < used:
+        (length,) = _KEY_LENGTH.unpack_from(data, offset)
+        start = offset + _KEY_LENGTH.size
+        key = bytes(data[start : start + length]).decode()
+        position = start + length + (-length % 8)
+        yield key, (vector.unpack_from(data, position) if values else position)
+        offset = position + vector.size
+
+
+class PrometheusAggregates(Sink):
+    """
+    Pre-aggregated duration histograms for Prometheus/OpenMetrics scrapes.
+
+    An exporter sink aggregating request durations per route, and metric durations
+    per route and metric name, so that scrapes only render the aggregates.
+
+    With a ``directory``, each process writes its aggregates to its own memory-mapped
+    file there and :meth:`render` merges the files of all processes, so that any
+    worker of a gunicorn/uvicorn deployment can serve the node-wide view. The
+    directory should be emptied when the server (not a worker) is restarted.
+
+    Numbered per-query metrics are aggregated as ``db``. Once a process has
+    ``max_series`` series, the durations of new ones are aggregated under the
+    ``OTHER_ROUTE`` route and ``OTHER_NAME`` name.
+    """
+
+    def __init__(
+        self,
+        directory: str | None = None,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        max_series: int = 1000,
+    ):
+        self.directory = directory
+        self.buckets = tuple(sorted(buckets))
+        self.max_series = max_series
+        self._table: AggregateTable | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def table(self) -> AggregateTable:
+        # Forked workers must not share the table of their parent
+        if self._table is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            path = None
+            if self.directory is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"server_timings_{self._pid}.db")
+            # count, sum and one count per bucket (incl. +Inf)
+            self._table = AggregateTable(len(self.buckets) + 3, path)
+        return self._table
+
+    def write(self, batch: list[dict]) -> None:
+        # Aggregate the batch first, to touch each entry only once
+        pending: dict[str, list[float]] = {}
+        for record in batch:
+            route = record.get("route") or ""
+            if record.get("duration") is not None:
+                self._observe(pending, REQUEST_FAMILY, route, "", record["duration"])
+            for metric in record["timings"]:
+                if metric["duration"] is None:
+                    continue
+                self._observe(
+                    pending,
+                    METRIC_FAMILY,
+                    route,
+                    series_name(metric["name"]),
+                    metric["duration"],
+                )
+        with self._lock:
+            table = self.table
+            for key, values in pending.items():
+                if key not in table and len(table) >= self.max_series:
+                    key = _overflow_key(key)
+                table.add(key, values)
+
+    def _observe(
+        self, pending: dict, family: str, route: str, name: str, duration_ms: float
+    ) -> None:
+        key = json.dumps([family, route, name])
+        values = pending.get(key)
+        if values is None:
+            values = pending[key] = [0.0] * (len(self.buckets) + 3)
+        seconds = duration_ms / 1000.0
+        values[0] += 1
+        values[1] += seconds
+        values[2 + bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def collect(self) -> dict[str, tuple[float, ...]]:
+        """Returns the aggregates of this process, or of all processes sharing the directory."""
+        if self.directory is None:
+            with self._lock:
+                return self.table.items()
+
+        merged: dict[str, list[float]] = {}
+        for path in sorted(Path(self.directory).glob("server_timings_*.db")):
+            for key, values in read_table(str(path)).items():
+                if key in merged:
+                    merged[key] = [
+                        a + b for a, b in zip(merged[key], values, strict=True)
+                    ]
+                else:
+                    merged[key] = list(values)
+        return merged
+
+    def render(self) -> str:
+        """Renders the aggregates in the OpenMetrics text format."""
+        families: dict[str, list[tuple[str, str, tuple[float, ...]]]] = {
+            REQUEST_FAMILY: [],
+            METRIC_FAMILY: [],
+        }
+        for key, values in sorted(self.collect().items()):
+            family, route, name = json.loads(key)
+            families[family].append((route, name, values))
+
+        lines = []
+        help_texts = {
+            REQUEST_FAMILY: "Duration of requests per route.",
+            METRIC_FAMILY: "Duration of Server-Timing metrics per route and name.",
+        }
+        for family, series in families.items():
+            lines.append(f"# TYPE {family} histogram")
+            lines.append(f"# UNIT {family} seconds")
+            lines.append(f"# HELP {family} {help_texts[family]}")
+            for route, name, values in series:
+                labels = f'route="{_escape(route)}"'
+                if family == METRIC_FAMILY:
+                    labels += f',name="{_escape(name)}"'
+                cumulative = 0.0
+                for bound, count in zip(
+                    (*self.buckets, "+Inf"), values[2:], strict=True
+                ):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else repr(float(bound))
+                    lines.append(
+                        f'{family}_bucket{{{labels},le="{le}"}} {int(cumulative)}'
+                    )
+                lines.append(f"{family}_count{{{labels}}} {int(values[0])}")
+                lines.append(f"{family}_sum{{{labels}}} {values[1]!r}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        with self._lock:
+            if self._table is not None:
+                self._table.close()
+                self._table = None
+
+
+def _overflow_key(key: str) -> str:
+    family, _, name = json.loads(key)
+    return json.dumps([family, OTHER_ROUTE, OTHER_NAME if name else ""])
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,167 @@
+import contextvars
+import uuid
+from collections.abc import Callable
+from concurrent.futures import (
+    CancelledError,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import NamedTuple
+
+from .exporters import Exporter
+from .models import NULL_TIMINGS, ServerTimingMetric, ServerTimings, _current_metric
+from .storage import Storage
+from .tracecontext import parse_traceparent, record_fields
+
+
+class TimingContext(NamedTuple):
+    """
+    The part of a request's timings that travels with work handed to other workers.
+
+    It is picklable and, via ``_asdict()``, JSON-serializable (e.g. for task headers).
+    """
+
+    request_id: str
+    # The name of the metric running when the work was handed off
+    parent: str | None = None
+    # The traceparent of the request's span, if the request is traced
+    traceparent: str | None = None
+
+
+def capture() -> TimingContext | None:
+    """Returns the timing context of the current request, or None outside requests."""
+    timings = ServerTimings()
+    if timings is NULL_TIMINGS:
+        return None
+    if timings.request_id is None:
+        timings.request_id = uuid.uuid4().hex
+    current = _current_metric.get()
+    parent = None
+    if current is not None and current.timings is timings:
+        parent = current.name
+    traceparent = timings.trace.traceparent if timings.trace is not None else None
+    return TimingContext(timings.request_id, parent, traceparent)
+
+
+class WorkerTimings:
+    """
+    Records the timings of work done for a request outside of its context.
+
+    Within the block, ``ServerTimings()`` is a fresh instance for the work, which is
+    itself measured as a metric named ``name``. On exit, :attr:`record` holds an
+    exporter record keyed by the request ID of ``context``:
+
+    .. code-block:: python
+
+        with WorkerTimings(context, "send_mail") as worker:
+            send_mail()
+        exporter.export(worker.record)
+    """
+
+    def __init__(self, context: TimingContext | None, name: str):
+        self.context = context
+        self.name = name
+        self.record: dict | None = None
+        self._previous: ServerTimings | None = None
+        self._metric: ServerTimingMetric | None = None
+
+    def __enter__(self) -> "WorkerTimings":
+        # Work may run inline within another request, e.g. eager Celery tasks
+        self._previous = Storage.get()
+        ServerTimings.setUp("sync")
+        timings = ServerTimings()
+        if self.context is not None:
+            timings.request_id = self.context.request_id
+            # The work is a span of its own, a child of the request's span
+            timings.trace = parse_traceparent(self.context.traceparent)
+        self._metric = ServerTimingMetric(self.name, timings=timings)
+        self._metric.start(nest=False)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._metric.end()
+        timings = self._metric.timings
+        self.record = {
+            "request_id": timings.request_id,
+            "parent": self.context.parent if self.context else None,
+            "path": None,
+            "route": self.name,
+            "duration": None,
+            **record_fields(timings),
+            "timings": timings.dump(),
+        }
+        ServerTimings.tearDown()
+        if self._previous is not None:
+            Storage.bind(self._previous)
+
+
+class TimingThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    A thread pool running submitted calls in a copy of the submitting context.
+
+    Metrics recorded by the calls are added to the submitting request's
+    ``ServerTimings``, nested under the metric running at submission. Calls running
+    after the request finished are not recorded.
+    """
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class TimingProcessPoolExecutor(ProcessPoolExecutor):
+    """
+    A process pool recording the timings of calls submitted during a request.
+
+    Each call is measured in the worker process, and the resulting record (see
+    :class:`WorkerTimings`) is passed to ``exporter`` once the call finished, keyed
+    by the request ID, also if it raised. Calls submitted outside requests are not
+    measured.
+    """
+
+    def __init__(self, *args, exporter: Exporter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exporter = exporter
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        context = capture()
+        if context is None:
+            return super().submit(fn, *args, **kwargs)
+
+        name = getattr(fn, "__name__", "task")
+        inner = super().submit(_call_with_timings, context, name, fn, args, kwargs)
+        # Returned futures cannot be cancelled, as if they were running already
+        outer: Future = Future()
+        outer.set_running_or_notify_cancel()
+
+        def done(future: Future) -> None:
+            if future.cancelled():
+                outer.set_exception(CancelledError())
+                return
+            exception = future.exception()
+            if exception is not None:
+                outer.set_exception(exception)
+                return
+            result, error, record = future.result()
+            self.exporter.export(record)
+            if error is not None:
+                outer.set_exception(error)
+            else:
+                outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+
+def _call_with_timings(
+    context: TimingContext, name: str, fn: Callable, args: tuple, kwargs: dict
+):
+    # The exception is returned, as raising it would lose the record
+    result = error = None
+    with WorkerTimings(context, name) as worker:
+        try:
+            result = fn(*args, **kwargs)
+        # Any exception of fn is raised again by the caller, see above
+        except Exception as exception:  # noqa: BLE001
+            error = exception
+    return result, error, worker.record
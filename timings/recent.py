@@ -0,0 +1,362 @@
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Callable, Mapping
+from pathlib import Path
+from typing import NamedTuple
+
+from .exporters import Sink
+
+CONTENT_TYPE = "application/json"
+
+_MAGIC = b"STRRv001"
+# magic, capacity, metrics per request, next sequence number
+_HEADER = struct.Struct("<8sQQQ")
+# sequence number, timestamp, duration, status, metric count, request id, path, route
+_REQUEST = struct.Struct("<QddHH32s192s192s")
+# duration, name
+_METRIC = struct.Struct("<d32s")
+# The sequence number again, to detect slots read while they were written
+_SEQUENCE = struct.Struct("<Q")
+# Attempts at reading a slot that is being written before skipping it
+_READ_ATTEMPTS = 3
+
+
+class RecentRequest(NamedTuple):
+    sequence: int
+    timestamp: float
+    request_id: str | None
+    path: str | None
+    route: str | None
+    status: int | None
+    duration: float | None
+    timings: tuple[tuple[str, float | None], ...]
+
+    def metric_duration(self, name: str) -> float | None:
+        """Returns the total duration of the metrics named ``name``, if any."""
+        durations = [duration for metric, duration in self.timings if metric == name]
+        if not durations:
+            return None
+        return sum(duration for duration in durations if duration is not None)
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "request_id": self.request_id,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "duration": self.duration,
+            "timings": [
+                {"name": name, "duration": duration} for name, duration in self.timings
+            ],
+        }
+
+
+class RequestRing:
+    """
+    A ring buffer of the last ``capacity`` requests, stored in a memory map.
+
+    Every slot has a fixed size and is preallocated, so writing a request only packs
+    its fields into its slot. Paths and routes are truncated to 192 bytes, metric
+    names to 32 bytes and the metrics to the first ``max_metrics``; descriptions are
+    not stored. With a ``path``, the map is backed by a file that other processes can
+    read with :func:`read_ring`. Only one thread of one process may write to a ring.
+    """
+
+    def __init__(self, capacity: int, max_metrics: int, path: str | None = None):
+        self.capacity = capacity
+        self.max_metrics = max_metrics
+        self.path = path
+        self._slot_size = _slot_size(max_metrics)
+        size = _HEADER.size + capacity * self._slot_size
+        self._file = None
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+            self._sequence = 0
+        else:
+            self._file = open(path, "a+b")  # noqa: SIM115
+            existing = os.fstat(self._file.fileno()).st_size
+            if existing != size:
+                self._file.truncate(0)
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            magic, capacity_, max_metrics_, sequence = _HEADER.unpack_from(self._map)
+            if (magic, capacity_, max_metrics_) == (_MAGIC, capacity, max_metrics):
+                self._sequence = sequence
+            else:
+                self._map[:] = bytes(size)
+                self._sequence = 0
+        self._write_header()
+
+    def append(self, record: Mapping, timestamp: float) -> None:
+        self._sequence += 1
+        sequence = self._sequence
+        offset = _HEADER.size + (sequence - 1) % self.capacity * self._slot_size
+        end = offset + self._slot_size - _SEQUENCE.size
+        # Readers skip the slot until both sequence numbers match again: the leading
+        # one is cleared first and the trailing one is written last
+        _SEQUENCE.pack_into(self._map, offset, 0)
+
+        metrics = record["timings"][: self.max_metrics]
+        position = offset + _REQUEST.size
+        for metric in metrics:
+            _METRIC.pack_into(
+                self._map,
+                position,
+                _float(metric["duration"]),
+                metric["name"].encode()[:32],
+            )
+            position += _METRIC.size
+        _REQUEST.pack_into(
+            self._map,
+            offset,
+            0,
+            timestamp,
+            _float(record.get("duration")),
+            record.get("status") or 0,
+            len(metrics),
+            _encode(record.get("request_id"), 32),
+            _encode(record.get("path"), 192),
+            _encode(record.get("route"), 192),
+        )
+        _SEQUENCE.pack_into(self._map, offset, sequence)
+        _SEQUENCE.pack_into(self._map, end, sequence)
+        self._write_header()
+
+    def requests(self) -> list[RecentRequest]:
+        return _requests(self._map, self.capacity, self.max_metrics)
+
+    def close(self) -> None:
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(
+            self._map, 0, _MAGIC, self.capacity, self.max_metrics, self._sequence
+        )
+
+
+def read_ring(path: str) -> list[RecentRequest]:
+    """Reads the requests of a file-backed ring written by another process."""
+    data = Path(path).read_bytes()
+    if len(data) < _HEADER.size or data[: len(_MAGIC)] != _MAGIC:
+        return []
+    _, capacity, max_metrics, _ = _HEADER.unpack_from(data)
+    if len(data) < _HEADER.size + capacity * _slot_size(max_metrics):
+        return []
+    return _requests(data, capacity, max_metrics)
+
+
+def _slot_size(max_metrics: int) -> int:
+    return _REQUEST.size + max_metrics * _METRIC.size + _SEQUENCE.size
+
+
+def _requests(data, capacity: int, max_metrics: int) -> list[RecentRequest]:
+    slot_size = _slot_size(max_metrics)
+    requests = []
+    for slot in range(capacity):
+        offset = _HEADER.size + slot * slot_size
+        for _ in range(_READ_ATTEMPTS):
+            # Copy the slot, then check that it was not rewritten during the copy
+            copy = data[offset : offset + slot_size]
+            sequence = _SEQUENCE.unpack_from(copy)[0]
+            trailing = _SEQUENCE.unpack_from(copy, slot_size - _SEQUENCE.size)[0]
+            if sequence == 0 or trailing != sequence:
+                continue
+            if _SEQUENCE.unpack(data[offset : offset + _SEQUENCE.size])[0] == sequence:
+                requests.append(_request(copy, max_metrics))
+                break
+    return requests
+
+
+def _request(slot: bytes, max_metrics: int) -> RecentRequest:
+    (sequence, timestamp, duration, status, count, request_id, path, route) = (
+        _REQUEST.unpack_from(slot)
+    )
+    timings = []
+    position = _REQUEST.size
+    for _ in range(min(count, max_metrics)):
+        metric_duration, name = _METRIC.unpack_from(slot, position)
+        timings.append((_decode(name) or "", _optional(metric_duration)))
+        position += _METRIC.size
+    return RecentRequest(
+        sequence=sequence,
+        timestamp=timestamp,
+        request_id=_decode(request_id),
+        path=_decode(path),
+        route=_decode(route),
+        status=status or None,
+        duration=_optional(duration),
+        timings=tuple(timings),
+    )
+
+
+def _encode(value: str | None, size: int) -> bytes:
+    return value.encode()[:size] if value else b""
+
+
+def _decode(value: bytes) -> str | None:
+    # Truncation may have split a multi-byte character
+    return value.rstrip(b"\0").decode(errors="ignore") or None
+
+
+def _float(value: float | None) -> float:
+    return math.nan if value is None else value
+
+
+def _optional(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+
+def _is_running(pid: int) -> bool:
+    if os.name != "posix":
+        # Signal 0 is CTRL_C_EVENT on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RecentRequests(Sink):
+    """
+    Keeps the last ``capacity`` exported requests for inspection.
+
+    An exporter sink writing each record into a preallocated :class:`RequestRing`.
+    With a ``directory``, each process writes its requests to its own memory-mapped
+    file there and the queries read the files of all processes, so that any worker
+    of a gunicorn/uvicorn deployment can serve the node-wide view. The files of
+    processes that are no longer running are skipped, but not removed: the
+    directory should be emptied when the server (not a worker) is restarted.
+
+    .. code-block:: python
+
+        recent = RecentRequests()
+        exporter = Exporter([LoggingSink(logger), recent])
+        ...
+        recent.slowest(10, route="/api/procedures/{pk}")
+        recent.query(metric="db", min_duration=100.0)
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000,
+        max_metrics: int = 32,
+        directory: str | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.capacity = capacity
+        self.max_metrics = max_metrics
+        self.directory = directory
+        self.clock = clock
+        self._ring: RequestRing | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def ring(self) -> RequestRing:
+        # Forked workers must not share the ring of their parent
+        if self._ring is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            path = None
+            if self.directory is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"recent_requests_{self._pid}.db")
+            self._ring = RequestRing(self.capacity, self.max_metrics, path)
+        return self._ring
+
+    def write(self, batch: list[dict]) -> None:
+        now = self.clock()
+        with self._lock:
+            ring = self.ring
+            for record in batch:
+                ring.append(record, now)
+
+    def requests(self) -> list[RecentRequest]:
+        """Returns the requests of this process, or of all processes, newest first."""
+        if self.directory is None:
+            with self._lock:
+                requests = self.ring.requests()
+        else:
+            requests = []
+            for path in sorted(Path(self.directory).glob("recent_requests_*.db")):
+                pid = path.stem.rpartition("_")[2]
+                if pid.isdigit() and _is_running(int(pid)):
+                    requests.extend(read_ring(str(path)))
+        requests.sort(key=lambda request: (request.timestamp, request.sequence))
+        return requests[::-1]
+
+    def query(
+        self,
+        route: str | None = None,
+        metric: str | None = None,
+        min_duration: float | None = None,
+        limit: int | None = None,
+        slowest: bool = False,
+    ) -> list[RecentRequest]:
+        """
+        Returns the recent requests, newest or with ``slowest`` slowest first.
+
+        Only requests matching ``route`` and having a ``metric`` of that name are
+        returned. ``min_duration`` (in ms) and ``slowest`` apply to the total
+        duration of the ``metric`` if given, and to the request's duration otherwise.
+        """
+
+        def duration(request: RecentRequest) -> float | None:
+            if metric is None:
+                return request.duration
+            return request.metric_duration(metric)
+
+        requests = [
+            request
+            for request in self.requests()
+            if (route is None or request.route == route)
+            and (metric is None or request.metric_duration(metric) is not None)
+            and (min_duration is None or (duration(request) or 0.0) >= min_duration)
+        ]
+        if slowest:
+            requests.sort(key=lambda request: duration(request) or 0.0, reverse=True)
+        return requests[:limit]
+
+    def slowest(self, k: int = 10, route: str | None = None) -> list[RecentRequest]:
+        return self.query(route=route, limit=k, slowest=True)
+
+    def render(self, params: Mapping[str, str]) -> str:
+        """
+        Renders the result of a query as JSON.
+
+        The query is read from ``params`` (e.g. the query string of a debug endpoint)
+        with the keys ``route``, ``metric``, ``min_duration``, ``limit`` (at most the
+        capacity) and ``order`` ("recent" or "slowest"). Raises ValueError for
+        invalid values.
+        """
+        order = params.get("order", "recent")
+        if order not in ("recent", "slowest"):
+            raise ValueError("Order must be one of recent, slowest")
+        min_duration = params.get("min_duration")
+        limit = int(params.get("limit") or 100)
+        if limit < 1:
+            raise ValueError("Limit must be positive")
+        requests = self.query(
+            route=params.get("route"),
+            metric=params.get("metric"),
+            min_duration=float(min_duration) if min_duration else None,
+            limit=min(limit, self.capacity),
+            slowest=order == "slowest",
+        )
+        return json.dumps({"requests": [request.to_dict() for request in requests]})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
@@ -0,0 +1,175 @@
+import asyncio
+import gc
+import random
+import threading
+import time
+import tracemalloc
+import weakref
+from collections.abc import Callable
+from contextvars import ContextVar
+
+from .models import ServerTimingMetric, ServerTimings
+
+# The instruments reporting GC pauses, to the current request of each
+_gc_instruments: "weakref.WeakSet[ResourceInstrument]" = weakref.WeakSet()
+_gc_start: float | None = None
+_gc_installed = False
+# Requests tracing allocations (at most one), and whether tracing was started for it
+_tracing = 0
+_tracing_started = False
+_tracing_lock = threading.Lock()
+
+
+class _RequestUsage:
+    __slots__ = ("timings", "cpu_start", "async_", "gc_pause", "gc_count", "memory")
+
+    def __init__(self, timings: ServerTimings):
+        self.timings = timings
+        self.cpu_start: float | None = None
+        self.async_ = False
+        self.gc_pause = 0.0
+        self.gc_count = 0
+        # The traced memory at the start, when tracing allocations
+        self.memory: int | None = None
+
+
+class ResourceInstrument:
+    """
+    Reports the CPU time, GC pauses and allocations of a request.
+
+    - ``cpu``: a ``cpu`` metric with the thread CPU time (``time.thread_time``). In
+      async servers, the thread runs other requests too, so this is the CPU time
+      of the event loop thread during the request.
+    - ``gc``: a ``gc`` metric with the pauses of garbage collections triggered
+      while the request was running (in its thread or task)
+    - ``memory_sample_rate``: the fraction of requests for which allocations are
+      traced with ``tracemalloc``, reported as an ``alloc`` metric with the net
+      allocated and the peak memory. Only one request at a time is traced, the
+      others sampled meanwhile are not. Tracing slows down all code while enabled,
+      and the allocations of concurrent requests are included (the peak is of the
+      process), so this is a debug mode.
+
+    Pass it to the integrations like the other instruments (e.g. in Django's
+    ``SERVER_TIMINGS_INSTRUMENTS``).
+    """
+
+    def __init__(
+        self,
+        cpu: bool = True,
+        gc: bool = True,
+        memory_sample_rate: float = 0.0,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.cpu = cpu
+        self.gc = gc
+        self.memory_sample_rate = memory_sample_rate
+        self.rng = rng
+        # The usage of the current request, per instrument
+        self._usage: ContextVar[_RequestUsage | None] = ContextVar(
+            "server_timings_resource_usage", default=None
+        )
+        if gc:
+            _gc_instruments.add(self)
+            _install_gc_callback()
+
+    def start(self, timings: ServerTimings) -> None:
+        usage = _RequestUsage(timings)
+        if self.cpu:
+            usage.cpu_start = time.thread_time()
+            try:
+                asyncio.get_running_loop()
+                usage.async_ = True
+            except RuntimeError:
+                pass
+        if self.memory_sample_rate and self.rng() < self.memory_sample_rate:
+            usage.memory = _start_tracing()
+        self._usage.set(usage)
+
+    def finish(self) -> None:
+        usage = self._usage.get()
+        if usage is None:
+            return
+        self._usage.set(None)
+        timings = usage.timings
+
+        if usage.cpu_start is not None:
+            ServerTimingMetric(
+                name="cpu",
+                description="event loop thread" if usage.async_ else None,
+                duration=(time.thread_time() - usage.cpu_start) * 1000.0,
+                timings=timings,
+            )
+        if usage.gc_count:
+            ServerTimingMetric(
+                name="gc",
+                description=f"{usage.gc_count} collections",
+                duration=usage.gc_pause,
+                timings=timings,
+            )
+        if usage.memory is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            _stop_tracing()
+            # A metric without duration, which adds itself only with a duration
+            timings.add(
+                ServerTimingMetric(
+                    name="alloc",
+                    description=(
+                        f"net {_kib(current - usage.memory)}, "
+                        f"peak {_kib(peak - usage.memory)}"
+                    ),
+                    timings=timings,
+                )
+            )
+
+
+def _kib(size: int) -> str:
+    return f"{size / 1024:.1f} KiB"
+
+
+def _install_gc_callback() -> None:
+    global _gc_installed
+    if not _gc_installed:
+        _gc_installed = True
+        gc.callbacks.append(_on_gc)
+
+
+def _on_gc(phase: str, info: dict) -> None:
+    global _gc_start
+    if phase == "start":
+        _gc_start = time.perf_counter()
+        return
+    if _gc_start is None:
+        return
+    pause = (time.perf_counter() - _gc_start) * 1000.0
+    _gc_start = None
+    for instrument in _gc_instruments:
+        usage = instrument._usage.get()
+        if usage is not None:
+            usage.gc_pause += pause
+            usage.gc_count += 1
+
+
+def _start_tracing() -> int | None:
+    """
+    Starts tracing allocations for a request, returning the traced memory, or None
+    if another request is traced: resetting the peak would corrupt its peak.
+    """
+    global _tracing, _tracing_started
+    with _tracing_lock:
+        if _tracing:
+            return None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing = 1
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+
+def _stop_tracing() -> None:
+    global _tracing, _tracing_started
+    with _tracing_lock:
+        _tracing -= 1
+        if _tracing == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
@@ -0,0 +1,96 @@
+import random
+from collections.abc import Callable, Mapping
+
+
+class SamplingPolicy:
+    """
+    Decides which requests are instrumented.
+
+    - ``rate``: the fraction of requests to instrument (0.0 - 1.0)
+    - ``path_rates``: rates for path prefixes, overriding ``rate``
+      (the longest matching prefix wins)
+    - ``trigger_header``/``trigger_cookie``: always instrument requests sending this
+      header/cookie with a non-empty value, e.g. for debugging (off by default, as
+      any client could send them)
+    - ``slow_threshold_ms``: requests not instrumented that turn out to be slower
+      still get a ``request`` metric (tail-based sampling)
+
+    Requests not instrumented get no storage binding and no DB instrumentation.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        path_rates: Mapping[str, float] | None = None,
+        trigger_header: str | None = None,
+        trigger_cookie: str | None = None,
+        slow_threshold_ms: float | None = None,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.rate = rate
+        # Longest prefixes first, so that the first match is the most specific one
+        self.path_rates = sorted(
+            (path_rates or {}).items(), key=lambda item: len(item[0]), reverse=True
+        )
+        self.trigger_header = trigger_header
+        self.trigger_cookie = trigger_cookie
+        self.slow_threshold_ms = slow_threshold_ms
+        self.rng = rng
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.path_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.rate
+
+    def should_sample(
+        self, path: str, header: str | None = None, cookie: str | None = None
+    ) -> bool:
+        """
+        Whether to instrument a request.
+
+        ``header`` and ``cookie`` are the request's values of the trigger header and
+        cookie, if any.
+        """
+        if header or cookie:
+            return True
+        rate = self.rate_for(path)
+        if rate >= 1.0:
+            return True
+        return rate > 0.0 and self.rng() < rate
+
+    def is_slow(self, duration_ms: float) -> bool:
+        """Whether a request that was not instrumented should still be reported."""
+        return (
+            self.slow_threshold_ms is not None and duration_ms >= self.slow_threshold_ms
+        )
+
+
+def unsampled_record(
+    path: str, route: str | None, status: int, duration: float
+) -> dict:
+    """Returns the exported record of a slow request that was not instrumented."""
+    return {
+        "path": path,
+        "route": route,
+        "status": status,
+        "duration": duration,
+        "timings": [
+            {
+                "duration": duration,
+                "name": "request",
+                "description": "",
+                "start": None,
+                "parent": None,
+            }
+        ],
+    }
+
+
+def cookie_value(header: str, name: str) -> str | None:
+    """Returns the value of the cookie ``name`` in a ``Cookie`` header value."""
+    for pair in header.split(";"):
+        key, _, value = pair.strip().partition("=")
+        if key == name:
+            return value
+    return None
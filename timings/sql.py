@@ -0,0 +1,362 @@
+import logging
+import math
+import re
+import sys
+from functools import lru_cache
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_CACHE_SIZE = 2048
+
+# Literals and placeholders collapse to "?" so that statements only differing in
+# their parameters share one template. String literals come first, so that
+# anything inside them is consumed before the other alternatives can match.
+_PARAM_RE = re.compile(
+    r"'(?:[^']|'')*'"  # string literal
+    r"|%\(\w+\)s|%s"  # pyformat / format placeholders
+    r"|\$\d+"  # numeric placeholders
+    r"|(?<![:\w]):[A-Za-z_]\w*"  # named placeholders (but not ::casts)
+    r"|\?"  # qmark placeholders
+    r"|\b\d+(?:\.\d+)?\b"  # numeric literals
+)
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS_RE = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE_RE = re.compile(r"\s+")
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<skip>\s+|--[^\n]*|/\*.*?\*/|'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+    |(?P<word>[A-Za-z_][\w$]*)
+    |(?P<punct>[(),;.])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Statement keywords a CTE (WITH ...) can lead into.
+_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE"}
+# Keywords after which the next identifier names the statement's target table.
+_TARGET_KEYWORDS = {
+    "INSERT": "INTO",
+    "REPLACE": "INTO",
+    "DELETE": "FROM",
+    "SELECT": "FROM",
+}
+# Statements naming their target right after the operation keyword.
+_DIRECT_TARGET = {"UPDATE", "SET", "SAVEPOINT", "RELEASE", "TRUNCATE"}
+# DDL statements naming their target after one of these object keywords.
+_DDL = {"CREATE", "ALTER", "DROP"}
+_DDL_OBJECTS = {"TABLE", "INDEX", "VIEW", "SEQUENCE", "TRIGGER", "SCHEMA"}
+# Statements without a target table that are expected and should not be reported.
+_BARE = {"BEGIN", "COMMIT", "ROLLBACK", "START", "END", "PRAGMA", "SHOW", "VACUUM"}
+# Modifiers that may sit between the operation/keyword and the table name.
+_MODIFIERS = {
+    "ONLY",
+    "OR",
+    "IGNORE",
+    "ABORT",
+    "FAIL",
+    "IF",
+    "NOT",
+    "EXISTS",
+    "TEMP",
+    "TEMPORARY",
+    "UNIQUE",
+    "CONCURRENTLY",
+    "LOW_PRIORITY",
+    "DELAYED",
+    "HIGH_PRIORITY",
+    "QUICK",
+    "LOCAL",
+    "SESSION",
+    "TO",
+    "SAVEPOINT",
+    "LATERAL",
+}
+_KNOWN = {*_TARGET_KEYWORDS, *_DIRECT_TARGET, *_DDL, *_BARE}
+_JOIN = "JOIN"
+# Clauses ending the table list of a statement at depth 0.
+_CLAUSE_END = {
+    "WHERE",
+    "GROUP",
+    "ORDER",
+    "HAVING",
+    "LIMIT",
+    "OFFSET",
+    "UNION",
+    "INTERSECT",
+    "EXCEPT",
+    "RETURNING",
+    "WINDOW",
+    "FOR",
+    "VALUES",
+    "SET",
+}
+
+
+class Fingerprint(NamedTuple):
+    """The operation and tables of a SQL statement, grouped by its template."""
+
+    operation: str
+    table: str | None
+    tables: tuple[str, ...]
+    template: str
+
+    @property
+    def description(self) -> str:
+        return "DB: " + self.operation + " " + (self.table or "")
+
+
+def normalize(sql: str) -> str:
+    """
+    Returns the template of a SQL statement.
+
+    Literals and placeholders are replaced by "?", IN-lists and multi-row VALUES are
+    collapsed to a single "(...)" and whitespace is squashed.
+    """
+    template = _PARAM_RE.sub("?", sql)
+    template = _LIST_RE.sub("(...)", template)
+    template = _ROWS_RE.sub("(...)", template)
+    return _SPACE_RE.sub(" ", template).strip()
+
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def fingerprint(sql: str) -> Fingerprint:
+    """
+    Returns the fingerprint of a SQL statement.
+
+    Django sends the same parametrized SQL over and over, so statements are cached
+    verbatim first; literal-bearing variants then share the cached template analysis.
+    """
+    return _analyse(normalize(sql))
+
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def _analyse(template: str) -> Fingerprint:
+    tokens = _tokenize(template)
+    operation, start = _operation(tokens)
+    tables = _tables(operation, tokens, start)
+    if operation and operation not in _KNOWN:
+        logger.warning(f"[DatabaseQueryTiming] Unsupported operation: {operation}")
+    return Fingerprint(
+        operation=operation,
+        table=tables[0] if tables else None,
+        tables=tables,
+        template=template,
+    )
+
+
+def _tokenize(sql: str) -> list[tuple[str, str]]:
+    """Splits SQL into (kind, value) tokens, dropping whitespace, comments and strings."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind == "skip":
+            continue
+        value = match.group(kind)
+        if kind == "word":
+            tokens.append(("word", value.upper()))
+        elif kind == "quoted":
+            tokens.append(("name", "'" + value[1:-1] + "'"))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+def _operation(tokens: list[tuple[str, str]]) -> tuple[str, int]:
+    """Returns the statement keyword and its index, skipping leading CTEs."""
+    i = 0
+    while i < len(tokens) and tokens[i] == ("punct", "("):
+        i += 1
+    if i >= len(tokens):
+        return "", i
+    if tokens[i][1] != "WITH":
+        return tokens[i][1].upper(), i
+
+    # WITH [RECURSIVE] name [(columns)] AS [[NOT] MATERIALIZED] (...) [, ...] <statement>
+    depth = 0
+    for j in range(i + 1, len(tokens)):
+        kind, value = tokens[j]
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word" and value in _STATEMENTS:
+            return value, j
+    return "WITH", i
+
+
+def _name_at(tokens: list[tuple[str, str]], i: int) -> tuple[str | None, int]:
+    """Reads a (possibly schema-qualified) identifier starting at index i."""
+    while i < len(tokens) and tokens[i][1] in _MODIFIERS:
+        i += 1
+    if i >= len(tokens) or tokens[i][0] not in ("word", "name"):
+        return None, i
+    parts = [_identifier(tokens[i])]
+    i += 1
+    while (
+        i + 1 < len(tokens)
+        and tokens[i] == ("punct", ".")
+        and tokens[i + 1][0] in ("word", "name")
+    ):
+        parts.append(_identifier(tokens[i + 1]))
+        i += 2
+    return ".".join(parts), i
+
+
+def _identifier(token: tuple[str, str]) -> str:
+    kind, value = token
+    return value.lower() if kind == "word" else value
+
+
+def _tables(
+    operation: str, tokens: list[tuple[str, str]], start: int
+) -> tuple[str, ...]:
+    if operation in _DIRECT_TARGET:
+        return _table_at(tokens, start + 1)
+    if operation in _DDL:
+        return _ddl_table(tokens, start)
+    keyword = _TARGET_KEYWORDS.get(operation)
+    if keyword is None:
+        return ()
+    return _table_list(keyword, tokens, start)
+
+
+def _table_at(tokens: list[tuple[str, str]], i: int) -> tuple[str, ...]:
+    name, _ = _name_at(tokens, i)
+    return (name,) if name else ()
+
+
+def _ddl_table(tokens: list[tuple[str, str]], start: int) -> tuple[str, ...]:
+    """Returns the object named after the first object keyword, e.g. TABLE."""
+    for i in range(start + 1, len(tokens)):
+        if tokens[i][1] in _DDL_OBJECTS:
+            return _table_at(tokens, i + 1)
+    return ()
+
+
+def _table_list(
+    keyword: str, tokens: list[tuple[str, str]], start: int
+) -> tuple[str, ...]:
+    """Returns the tables after the target keyword (FROM/INTO) and its JOINs."""
+    tables = []
+    # The depth the target keyword is looked for at. When FROM is followed by a
+    # subquery, the subquery's own FROM one level deeper names the table.
+    target_depth = depth = 0
+    collecting = False
+    i = start + 1
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+            target_depth = min(target_depth, depth)
+        elif depth == target_depth:
+            if _precedes_table(kind, value, keyword, collecting):
+                name, end = _name_at(tokens, i + 1)
+                if name:
+                    tables.append(name)
+                    collecting = True
+                    i = end
+                    continue
+                if not tables and end < len(tokens) and tokens[end] == ("punct", "("):
+                    target_depth = depth + 1
+            elif collecting and kind == "word" and value in _CLAUSE_END:
+                break
+        i += 1
+    return tuple(dict.fromkeys(tables))
+
+
+def _precedes_table(kind: str, value: str, keyword: str, collecting: bool) -> bool:
+    """Whether a table name follows: the keyword, or a JOIN or comma after it."""
+    if kind == "word" and value == keyword:
+        return True
+    # FROM a, b / FROM a JOIN b
+    return collecting and (value == "," or (kind == "word" and value == _JOIN))
+
+
+class QueryGroup:
+    """Statistics of the queries sharing one fingerprint within a request."""
+
+    __slots__ = ("fingerprint", "durations", "callsite")
+
+    def __init__(self, fingerprint: Fingerprint):
+        self.fingerprint = fingerprint
+        self.durations: list[float] = []
+        self.callsite: str | None = None
+
+    @property
+    def count(self) -> int:
+        return len(self.durations)
+
+    @property
+    def total(self) -> float:
+        return sum(self.durations)
+
+    @property
+    def min(self) -> float:
+        return min(self.durations)
+
+    @property
+    def max(self) -> float:
+        return max(self.durations)
+
+    @property
+    def p95(self) -> float:
+        ordered = sorted(self.durations)
+        return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def summary(self) -> str:
+        return (
+            f"{self.fingerprint.description.rstrip()} x{self.count} "
+            f"(min={self.min:.2f} max={self.max:.2f} p95={self.p95:.2f})"
+        )
+
+
+class QueryAggregator:
+    """
+    Groups the queries of a request by fingerprint.
+
+    A template executed at least ``duplicate_threshold`` times is considered an N+1
+    pattern; the call site of the query crossing the threshold is captured once.
+    """
+
+    def __init__(self, duplicate_threshold: int = 5):
+        self.duplicate_threshold = duplicate_threshold
+        self.groups: dict[str, QueryGroup] = {}
+
+    def record(self, sql: str, duration: float) -> QueryGroup:
+        fp = fingerprint(sql)
+        group = self.groups.get(fp.template)
+        if group is None:
+            group = self.groups[fp.template] = QueryGroup(fp)
+        group.durations.append(duration)
+        if group.count == self.duplicate_threshold:
+            group.callsite = callsite()
+        return group
+
+    @property
+    def duplicates(self) -> list[QueryGroup]:
+        """Groups considered N+1 patterns, most expensive first."""
+        return sorted(
+            (g for g in self.groups.values() if g.count >= self.duplicate_threshold),
+            key=lambda g: g.total,
+            reverse=True,
+        )
+
+
+# Modules that run queries on behalf of application code.
+_INTERNAL_MODULES = ("timings.", "django.", "sqlalchemy.", "contextlib", "asgiref.")
+
+
+def callsite(skip: tuple[str, ...] = _INTERNAL_MODULES) -> str | None:
+    """Returns "module:line (function)" of the innermost application frame."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(skip):
+            return f"{module}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return None
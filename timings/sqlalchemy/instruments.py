@@ -0,0 +1,104 @@
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from timings.instruments import DBMode, add_query_metrics, check_db_mode, describe_query
+from timings.models import ServerTimingMetric, ServerTimings, clock
+from timings.sql import QueryAggregator
+
+# Connection.info key of the running queries' metrics (or start times)
+_RUNNING = "server_timings"
+
+
+class _RequestQueries:
+    __slots__ = ("timings", "counter", "queries")
+
+    def __init__(self, timings: ServerTimings, duplicate_threshold: int):
+        self.timings = timings
+        self.counter = 0
+        self.queries = QueryAggregator(duplicate_threshold)
+
+
+class SQLAlchemyInstrument:
+    """
+    Times the queries of an SQLAlchemy engine (sync or ``AsyncEngine``) per request.
+
+    Pass it to the Flask extension (``SERVER_TIMINGS_INSTRUMENTS``) or the FastAPI
+    middleware (``instruments``), which call :meth:`start` and :meth:`finish` around
+    each request. Queries outside requests are not timed. The modes and ``db-dup``
+    metrics are the same as for Django's ``DBQueryInstrument``.
+    """
+
+    def __init__(self, engine, mode: DBMode = "per-query", duplicate_threshold=5):
+        check_db_mode(mode)
+        self.mode = mode
+        self.duplicate_threshold = duplicate_threshold
+        # Async engines run the events of their sync engine in a greenlet sharing
+        # the context of the awaiting task, so the request state is visible there.
+        self.engine = getattr(engine, "sync_engine", engine)
+        self._state: ContextVar[_RequestQueries | None] = ContextVar(
+            f"server_timings_sqlalchemy_{id(self)}", default=None
+        )
+        event.listen(self.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(self.engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(self.engine, "handle_error", self.handle_error)
+
+    def remove(self) -> None:
+        """Stops listening to the engine's events."""
+        event.remove(self.engine, "before_cursor_execute", self.before_cursor_execute)
+        event.remove(self.engine, "after_cursor_execute", self.after_cursor_execute)
+        event.remove(self.engine, "handle_error", self.handle_error)
+
+    def start(self, timings: ServerTimings) -> None:
+        """Starts timing the queries of the current request."""
+        self._state.set(_RequestQueries(timings, self.duplicate_threshold))
+
+    def finish(self) -> None:
+        """Adds the aggregated and duplicate query metrics to the request's timings."""
+        state = self._state.get()
+        if state is None:
+            return
+        self._state.set(None)
+        add_query_metrics(state.timings, state.queries, self.mode)
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        state = self._state.get()
+        if state is None:
+            return
+        running = conn.info.setdefault(_RUNNING, [])
+        if self.mode == "aggregated":
+            running.append((state, statement, clock()))
+            return
+
+        state.counter += 1
+        metric = ServerTimingMetric(
+            name=f"db_{state.counter}",
+            description=describe_query(statement),
+            timings=state.timings,
+        )
+        # Queries have no children, and must not adopt those of a failed query
+        metric.start(nest=False)
+        running.append((state, statement, metric))
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        self._end(conn)
+
+    def handle_error(self, exception_context):
+        if exception_context.connection is not None:
+            self._end(exception_context.connection)
+
+    def _end(self, conn) -> None:
+        running = conn.info.get(_RUNNING)
+        if not running:
+            return
+        state, statement, started = running.pop()
+        if isinstance(started, ServerTimingMetric):
+            started.end()
+            duration = started.duration
+        else:
+            duration = (clock() - started) / 1_000_000
+        state.queries.record(statement, duration)
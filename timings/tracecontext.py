@@ -0,0 +1,97 @@
+import random
+import re
+from typing import TYPE_CHECKING, NamedTuple
+
+from .header import format_metric
+
+if TYPE_CHECKING:
+    from .models import ServerTimings
+
+# The request header carrying the trace context (https://www.w3.org/TR/trace-context/)
+HEADER = "traceparent"
+
+_TRACEPARENT = re.compile(
+    r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-[^\s]*)?"
+)
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+
+class TraceContext(NamedTuple):
+    """
+    The W3C trace context of a request.
+
+    The request is a span of its own, ``span_id``, whose parent is the span of the
+    caller, ``parent_id``.
+    """
+
+    trace_id: str
+    parent_id: str
+    span_id: str
+    flags: str
+
+    @property
+    def traceparent(self) -> str:
+        """The ``traceparent`` of the request's span, for its callees."""
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags}"
+
+    @property
+    def sampled(self) -> bool:
+        return is_sampled(self.flags)
+
+
+def is_sampled(flags: str) -> bool:
+    """Whether the caller may have recorded its span, per the ``sampled`` flag."""
+    return int(flags, 16) & 1 == 1
+
+
+def new_span_id() -> str:
+    # random is reseeded in forked processes, so workers do not repeat IDs
+    return f"{random.getrandbits(64) or 1:016x}"
+
+
+def parse_traceparent(value: str | None) -> TraceContext | None:
+    """
+    Returns the trace context of a ``traceparent`` header value, with a new span ID
+    for the request, or None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    match = _TRACEPARENT.fullmatch(value.strip())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    if (
+        version == "ff"
+        # Version 00 has no further fields, later versions may add some
+        or (version == "00" and rest is not None)
+        or trace_id == _INVALID_TRACE_ID
+        or parent_id == _INVALID_SPAN_ID
+    ):
+        return None
+    return TraceContext(trace_id, parent_id, new_span_id(), flags)
+
+
+def header_entry(trace: TraceContext | None) -> str | None:
+    """Returns the ``traceparent;desc=...`` Server-Timing entry of a trace context."""
+    if trace is None:
+        return None
+    return format_metric(HEADER, trace.traceparent, None)
+
+
+def record_fields(timings: "ServerTimings") -> dict:
+    """
+    Returns the fields added to the exported record of a traced request: its trace
+    and span IDs, the span ID of its caller, the trace flags and its start (in ns
+    since the epoch).
+    """
+    trace = timings.trace
+    if trace is None:
+        return {}
+    return {
+        "trace_id": trace.trace_id,
+        "span_id": trace.span_id,
+        "parent_span_id": trace.parent_id,
+        "trace_flags": trace.flags,
+        "start_time": timings.started_at,
+    }
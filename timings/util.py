@@ -1,33 +1,94 @@
-from collections.abc import Generator
-from contextlib import contextmanager
+import inspect
+from collections.abc import Callable
 from functools import wraps
-from typing import Any, Callable
 
-from .models import ServerTimingMetric, ServerTimings
+from .models import MetricTemplate, ServerTimingMetric, ServerTimings
 
 
-@contextmanager
 def timed_metric(
     name: str, description: str | None = None, timings: ServerTimings | None = None
-) -> Generator[ServerTimingMetric, Any, None]:
-    """A context manager, that tracks the execution time of a function"""
-    service = ServerTimingMetric(name=name, description=description, timings=timings)
-    with service.measure():
-        yield service
+) -> ServerTimingMetric:
+    """
+    A context manager, that tracks the execution time of a block.
+
+    Works with both ``with`` and ``async with``.
+    """
+    return ServerTimingMetric(name=name, description=description, timings=timings)
 
 
 def timed(name: str | None = None, description: str | None = None):
-    """Decorator to track the execution time of a function"""
+    """
+    Decorator to track the execution time of a function.
+
+    Coroutine functions are timed until they return, generators (sync and async)
+    until they are exhausted or closed. Generators do not become the parent of the
+    metrics recorded while they are suspended, since those belong to the consumer.
+    """
 
     def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # Use the function name as the default name if not provided
-            metric_name = name if name is not None else func.__name__
+        # Use the function name as the default name if not provided
+        template = MetricTemplate(
+            name if name is not None else func.__name__, description
+        )
+        if inspect.iscoroutinefunction(func):
+            return _timed_coroutine(func, template.new)
+        if inspect.isasyncgenfunction(func):
+            return _timed_async_generator(func, template.new)
+        if inspect.isgeneratorfunction(func):
+            return _timed_generator(func, template.new)
+        return _timed_function(func, template.new)
 
-            with timed_metric(name=metric_name, description=description):
-                return func(*args, **kwargs)
+    return decorator
 
-        return wrapper
 
-    return decorator
+def _timed_coroutine(func: Callable, new_metric: Callable) -> Callable:
+    @wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        with new_metric():
+            return await func(*args, **kwargs)
+
+    return async_wrapper
+
+
+def _timed_async_generator(func: Callable, new_metric: Callable) -> Callable:
+    @wraps(func)
+    async def async_generator_wrapper(*args, **kwargs):
+        # Forwards asend/athrow/aclose, as yield from would for generators
+        generator = func(*args, **kwargs)
+        with new_metric().measure(nest=False):
+            try:
+                item = await generator.__anext__()
+                while True:
+                    try:
+                        sent = yield item
+                    except GeneratorExit:
+                        raise
+                    # Everything thrown into the wrapper is thrown into the generator
+                    except BaseException as error:  # noqa: BLE001
+                        item = await generator.athrow(error)
+                    else:
+                        item = await generator.asend(sent)
+            except StopAsyncIteration:
+                return
+            finally:
+                await generator.aclose()
+
+    return async_generator_wrapper
+
+
+def _timed_generator(func: Callable, new_metric: Callable) -> Callable:
+    @wraps(func)
+    def generator_wrapper(*args, **kwargs):
+        with new_metric().measure(nest=False):
+            return (yield from func(*args, **kwargs))
+
+    return generator_wrapper
+
+
+def _timed_function(func: Callable, new_metric: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with new_metric():
+            return func(*args, **kwargs)
+
+    return wrapper